@@ -2,19 +2,25 @@
 AI Agents for content generation, editing, and image creation
 """
 
+from __future__ import annotations
+
 import asyncio
 import logging
+import time
+from collections import deque
 from functools import lru_cache
-from typing import List
+from typing import TYPE_CHECKING, Deque, List, Sequence
 
-import fal_client
 from pydantic import BaseModel, Field
-from pydantic_ai import Agent
-from pydantic_ai.messages import ModelRequest, ModelResponse
 
 from constants import (
-    MODEL,
+    get_fal_key,
+    get_fallback_model,
+    get_model,
+    OPENROUTER_MODEL_NAME,
     FAL_IMAGE_MODEL,
+    IMAGE_REFERENCE_SHEET,
+    REFERENCE_SHEET_PROMPT_NOTE,
     LINKEDIN_CONTENT_SYSTEM_PROMPT,
     X_CONTENT_SYSTEM_PROMPT,
     INSTAGRAM_CONTENT_SYSTEM_PROMPT,
@@ -28,22 +34,94 @@ from constants import (
     RAG_FINAL_X_PROMPT,
     RAG_FINAL_INSTAGRAM_PROMPT,
     RAG_ENABLED,
+    RETRIEVAL_BATCH_MAX_WAIT_MS,
+    RETRIEVAL_CACHE_MAX_ENTRIES,
+    RETRIEVAL_CACHE_TTL_SECONDS,
+    HEDGE_ENABLED,
     OUTPUT_VALIDATION_RETRIES,
     REQUEST_LIMIT,
     TOKEN_LIMIT,
 )
+from cache import content_digest, get_cache
+from hedging import get_hedger
+from http_clients import get_fal_client
+from metrics import outcome_for, record, span
+from usage import model_name, record_usage
+from scheduler import provider_slot
 from models import (
     PlatformContent,
-    GeneratedContent,
     EditedContent,
     EditedPartContent,
     ImagePrompt,
     AgentDeps,
 )
 
+if TYPE_CHECKING:
+    # pydantic-ai and fal_client are imported on first use to keep imports fast
+    from pydantic_ai import Agent
+    from pydantic_ai.messages import ModelRequest, ModelResponse
+
 logger = logging.getLogger(__name__)
 
 
+def _new_agent(**kwargs) -> Agent:
+    """
+    Build an agent on the primary model, importing pydantic-ai on first use.
+    
+    Args:
+        **kwargs: Passed through to ``Agent`` (system_prompt, deps_type, result_type)
+    """
+    from pydantic_ai import Agent
+    
+    return Agent(get_model(), retries=OUTPUT_VALIDATION_RETRIES, **kwargs)
+
+
+async def run_agent(
+    agent: Agent,
+    prompt: str,
+    stage: str,
+    platform: str | None = None,
+    hedge: bool = False,
+    **kwargs,
+):
+    """
+    Run an agent through the OpenRouter scheduler and record its token usage.
+    
+    Every LLM call goes through here so provider concurrency and request rate stay
+    within the limits the scheduler has learned from 429s and latency, and so every
+    run's usage lands in the request's usage ledger.
+    
+    Args:
+        agent: The agent to run
+        prompt: User prompt for the run
+        stage: Pipeline stage the run belongs to, used for usage accounting
+        platform: Platform (or post part) the run is for, if any
+        hedge: When hedging is enabled, send a backup request for slow calls (see hedging.py)
+        **kwargs: Passed through to ``agent.run``
+    """
+    from pydantic_ai.usage import Usage
+    
+    async def attempt(model=None):
+        # The run adds each model response to this as it arrives, so an attempt that
+        # is cancelled (a hedge loser, or a request past its deadline) still reports
+        # the responses it paid for. The request in flight when it was cancelled is
+        # billed but never reported; hedge attempts are counted on /metrics instead.
+        usage = Usage()
+        try:
+            async with provider_slot("openrouter", stage):
+                result = await agent.run(prompt, model=model, usage=usage, **kwargs)
+        except asyncio.CancelledError:
+            if usage.requests:
+                record_usage(stage, platform, model_name(model or agent.model), usage)
+            raise
+        record_usage(stage, platform, model_name(model or agent.model), result.usage())
+        return result
+    
+    if HEDGE_ENABLED and hedge:
+        return await get_hedger().run(f"{stage}:{platform}" if platform else stage, attempt)
+    return await attempt()
+
+
 # ──────────────────────────────────────────────────────────────────────────────
 # Platform-Specific Content Generation Agents
 # ──────────────────────────────────────────────────────────────────────────────
@@ -51,37 +129,31 @@ logger = logging.getLogger(__name__)
 
 def create_linkedin_agent() -> Agent[AgentDeps, PlatformContent]:
     """Create an agent for generating LinkedIn content."""
-    logger.info(f"Creating LinkedIn content agent with model: {MODEL}")
-    return Agent(
-        MODEL,
+    logger.info("Creating LinkedIn content agent with model: %s", OPENROUTER_MODEL_NAME)
+    return _new_agent(
         system_prompt=LINKEDIN_CONTENT_SYSTEM_PROMPT,
         deps_type=AgentDeps,
         result_type=PlatformContent,
-        retries=OUTPUT_VALIDATION_RETRIES,
     )
 
 
 def create_x_agent() -> Agent[AgentDeps, PlatformContent]:
     """Create an agent for generating X (formerly Twitter) content."""
-    logger.info(f"Creating X content agent with model: {MODEL}")
-    return Agent(
-        MODEL,
+    logger.info("Creating X content agent with model: %s", OPENROUTER_MODEL_NAME)
+    return _new_agent(
         system_prompt=X_CONTENT_SYSTEM_PROMPT,
         deps_type=AgentDeps,
         result_type=PlatformContent,
-        retries=OUTPUT_VALIDATION_RETRIES,
     )
 
 
 def create_instagram_agent() -> Agent[AgentDeps, PlatformContent]:
     """Create an agent for generating Instagram content."""
-    logger.info(f"Creating Instagram content agent with model: {MODEL}")
-    return Agent(
-        MODEL,
+    logger.info("Creating Instagram content agent with model: %s", OPENROUTER_MODEL_NAME)
+    return _new_agent(
         system_prompt=INSTAGRAM_CONTENT_SYSTEM_PROMPT,
         deps_type=AgentDeps,
         result_type=PlatformContent,
-        retries=OUTPUT_VALIDATION_RETRIES,
     )
 
 
@@ -118,37 +190,31 @@ class InitialText(BaseModel):
 
 def create_rag_initial_linkedin_agent() -> Agent[AgentDeps, InitialText]:
     """Create an agent for generating initial LinkedIn text for RAG retrieval."""
-    logger.info(f"Creating RAG initial LinkedIn agent with model: {MODEL}")
-    return Agent(
-        MODEL,
+    logger.info("Creating RAG initial LinkedIn agent with model: %s", OPENROUTER_MODEL_NAME)
+    return _new_agent(
         system_prompt=RAG_INITIAL_LINKEDIN_PROMPT,
         deps_type=AgentDeps,
         result_type=InitialText,
-        retries=OUTPUT_VALIDATION_RETRIES,
     )
 
 
 def create_rag_initial_x_agent() -> Agent[AgentDeps, InitialText]:
     """Create an agent for generating initial X text for RAG retrieval."""
-    logger.info(f"Creating RAG initial X agent with model: {MODEL}")
-    return Agent(
-        MODEL,
+    logger.info("Creating RAG initial X agent with model: %s", OPENROUTER_MODEL_NAME)
+    return _new_agent(
         system_prompt=RAG_INITIAL_X_PROMPT,
         deps_type=AgentDeps,
         result_type=InitialText,
-        retries=OUTPUT_VALIDATION_RETRIES,
     )
 
 
 def create_rag_initial_instagram_agent() -> Agent[AgentDeps, InitialText]:
     """Create an agent for generating initial Instagram text for RAG retrieval."""
-    logger.info(f"Creating RAG initial Instagram agent with model: {MODEL}")
-    return Agent(
-        MODEL,
+    logger.info("Creating RAG initial Instagram agent with model: %s", OPENROUTER_MODEL_NAME)
+    return _new_agent(
         system_prompt=RAG_INITIAL_INSTAGRAM_PROMPT,
         deps_type=AgentDeps,
         result_type=InitialText,
-        retries=OUTPUT_VALIDATION_RETRIES,
     )
 
 
@@ -180,37 +246,31 @@ def get_rag_initial_instagram_agent() -> Agent[AgentDeps, InitialText]:
 
 def create_rag_final_linkedin_agent() -> Agent[AgentDeps, PlatformContent]:
     """Create an agent for generating final LinkedIn content with RAG examples."""
-    logger.info(f"Creating RAG final LinkedIn agent with model: {MODEL}")
-    return Agent(
-        MODEL,
+    logger.info("Creating RAG final LinkedIn agent with model: %s", OPENROUTER_MODEL_NAME)
+    return _new_agent(
         system_prompt=RAG_FINAL_LINKEDIN_PROMPT,
         deps_type=AgentDeps,
         result_type=PlatformContent,
-        retries=OUTPUT_VALIDATION_RETRIES,
     )
 
 
 def create_rag_final_x_agent() -> Agent[AgentDeps, PlatformContent]:
     """Create an agent for generating final X content with RAG examples."""
-    logger.info(f"Creating RAG final X agent with model: {MODEL}")
-    return Agent(
-        MODEL,
+    logger.info("Creating RAG final X agent with model: %s", OPENROUTER_MODEL_NAME)
+    return _new_agent(
         system_prompt=RAG_FINAL_X_PROMPT,
         deps_type=AgentDeps,
         result_type=PlatformContent,
-        retries=OUTPUT_VALIDATION_RETRIES,
     )
 
 
 def create_rag_final_instagram_agent() -> Agent[AgentDeps, PlatformContent]:
     """Create an agent for generating final Instagram content with RAG examples."""
-    logger.info(f"Creating RAG final Instagram agent with model: {MODEL}")
-    return Agent(
-        MODEL,
+    logger.info("Creating RAG final Instagram agent with model: %s", OPENROUTER_MODEL_NAME)
+    return _new_agent(
         system_prompt=RAG_FINAL_INSTAGRAM_PROMPT,
         deps_type=AgentDeps,
         result_type=PlatformContent,
-        retries=OUTPUT_VALIDATION_RETRIES,
     )
 
 
@@ -263,7 +323,7 @@ async def generate_initial_text_for_retrieval(
         total_tokens_limit=TOKEN_LIMIT
     )
     
-    logger.info(f"Generating initial {platform} text for retrieval...")
+    logger.info("Generating initial %s text for retrieval...", platform)
     
     # Select the appropriate initial agent
     if platform == "linkedin":
@@ -276,21 +336,172 @@ async def generate_initial_text_for_retrieval(
         raise ValueError(f"Unknown platform: {platform}")
     
     try:
-        result = await agent.run(prompt, deps=deps, usage_limits=limits)
+        with span("rag_initial", platform):
+            result = await run_agent(agent, prompt, "rag_initial", platform, hedge=True, deps=deps, usage_limits=limits)
         initial_text = result.data.text
-        logger.info(f"Initial {platform} text generated: {initial_text[:100]}...")
+        logger.info("Initial %s text generated: %.100s", platform, initial_text)
         return initial_text
     except Exception as e:
-        logger.error(f"Failed to generate initial {platform} text: {e}", exc_info=True)
+        logger.error("Failed to generate initial %s text: %s", platform, e, exc_info=True)
         # Fallback to user prompt if initial generation fails
         return prompt
 
 
+class RetrievalBatch:
+    """
+    Gathers the retrieval queries of one request's platform pipelines and sends
+    them to Qdrant as one batched search.
+
+    Each pipeline reaches retrieval once its initial draft is ready, and drafts
+    usually finish seconds apart. Batching therefore costs latency. The batch is
+    sent once every expected platform has a query (or was answered from the
+    retrieval cache), or ``max_wait_seconds`` after the query that opened it.
+    Until then, every platform already waiting is held back, and whichever of
+    them is on the request's critical path finishes that much later.
+
+    To keep that cost for requests where it buys a batch, the gaps between
+    platforms reaching retrieval are tracked across requests. A query that
+    would open a batch waits only if, judging by those gaps, another platform
+    usually arrives within the window. Otherwise it is searched straight away.
+    """
+
+    # Seconds between a request's first query and each later one, across recent requests
+    _arrival_gaps: Deque[float] = deque(maxlen=200)
+    MIN_GAP_SAMPLES = 20
+
+    def __init__(self, platforms: Sequence[str], limit: int, max_wait_seconds: float):
+        self.limit = limit
+        self.max_wait_seconds = max_wait_seconds
+        self._expected = set(platforms)
+        self._first_arrival: float | None = None
+        self._pending: list[tuple[str, str, asyncio.Future]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def retrieve(self, query_text: str, platform: str) -> List[str]:
+        """Return the similar posts for one platform's query once its batch has been searched."""
+        loop = asyncio.get_running_loop()
+        elapsed = self._arrived(loop.time())
+        future = loop.create_future()
+        self._pending.append((query_text, platform, future))
+        self._expected.discard(platform)
+        if not self._expected:
+            self._flush()
+        elif self._flush_handle is None:
+            if self._worth_waiting(elapsed):
+                self._flush_handle = loop.call_later(self.max_wait_seconds, self._flush)
+            else:
+                self._flush()
+        return await future
+
+    def skip(self, platform: str) -> None:
+        """Stop waiting for a platform that will not query, e.g. after a cache hit."""
+        self._expected.discard(platform)
+        if not self._expected and self._pending:
+            self._flush()
+
+    def _arrived(self, now: float) -> float:
+        """Record a query's arrival and return the seconds since the request's first one."""
+        if self._first_arrival is None:
+            self._first_arrival = now
+            return 0.0
+        elapsed = now - self._first_arrival
+        self._arrival_gaps.append(elapsed)
+        return elapsed
+
+    def _worth_waiting(self, elapsed: float) -> bool:
+        """Whether another platform is likely to arrive within the window, ``elapsed`` seconds in."""
+        if len(self._arrival_gaps) < self.MIN_GAP_SAMPLES:
+            # Too little history yet; waiting is also how it gets collected
+            return True
+        # Only arrivals later than this one say anything about the wait
+        later = [gap for gap in self._arrival_gaps if gap > elapsed]
+        if not later:
+            return False
+        within = sum(1 for gap in later if gap <= elapsed + self.max_wait_seconds)
+        return within >= len(later) / 2
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[str, str, asyncio.Future]]) -> None:
+        from qdrant_client_helper import retrieve_similar_posts_batch
+        
+        logger.info("Retrieving similar posts for %s in one batch", ", ".join(platform for _, platform, _ in batch))
+        try:
+            results = await retrieve_similar_posts_batch(
+                [(query_text, platform) for query_text, platform, _ in batch], self.limit
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), similar_posts in zip(batch, results):
+            if not future.done():
+                future.set_result(similar_posts)
+
+
+def create_retrieval_batch(platforms: Sequence[str], limit: int = 3) -> RetrievalBatch | None:
+    """
+    Return a RetrievalBatch for one request's platform pipelines, or None when
+    RAG is disabled, batching is off (RETRIEVAL_BATCH_MAX_WAIT_MS is 0) or
+    there is only one platform to retrieve for.
+    """
+    if not RAG_ENABLED or RETRIEVAL_BATCH_MAX_WAIT_MS <= 0 or len(platforms) < 2:
+        return None
+    return RetrievalBatch(platforms, limit, RETRIEVAL_BATCH_MAX_WAIT_MS / 1000)
+
+
+async def retrieve_similar_posts_cached(
+    query_text: str,
+    platform: str,
+    limit: int,
+    batch: RetrievalBatch | None = None,
+) -> List[str]:
+    """
+    Retrieve similar posts, reusing results for the same query from the shared
+    retrieval cache. Empty results are not cached, since retrieval returns an
+    empty list on errors too. On a miss, the search joins ``batch`` when given.
+    """
+    from qdrant_client_helper import retrieve_similar_posts
+    
+    if batch is not None and batch.limit != limit:
+        batch.skip(platform)
+        batch = None
+    cache = get_cache("retrieval", RETRIEVAL_CACHE_TTL_SECONDS, RETRIEVAL_CACHE_MAX_ENTRIES)
+    key = content_digest(f"{platform}\n{limit}\n{query_text}".encode("utf-8"))
+    with span("retrieval", platform) as timing:
+        cached_posts = await cache.get(key)
+        if cached_posts is not None:
+            logger.info("Retrieval cache hit for %s (%s posts)", platform, len(cached_posts))
+            timing.outcome = "cached"
+            if batch is not None:
+                batch.skip(platform)
+            return cached_posts
+        if batch is not None:
+            similar_posts = await batch.retrieve(query_text, platform)
+        else:
+            similar_posts = await retrieve_similar_posts(query_text=query_text, platform=platform, limit=limit)
+    if similar_posts:
+        await cache.set(key, similar_posts)
+    return similar_posts
+
+
 async def retrieve_and_generate_content(
     prompt: str,
     platform: str,
     deps: AgentDeps,
     num_examples: int = 3,
+    retrieval: RetrievalBatch | None = None,
 ) -> PlatformContent:
     """
     RAG-based content generation: generate initial text, retrieve similar posts, 
@@ -301,35 +512,31 @@ async def retrieve_and_generate_content(
         platform: Target platform (linkedin, x, instagram)
         deps: Agent dependencies
         num_examples: Number of similar posts to retrieve
+        retrieval: Batch shared with the request's other platform pipelines, if any
     
     Returns:
         Final generated platform content
     """
     from pydantic_ai.usage import UsageLimits
-    from qdrant_client_helper import retrieve_similar_posts
     
     limits = UsageLimits(
         request_limit=REQUEST_LIMIT,
         total_tokens_limit=TOKEN_LIMIT
     )
     
-    logger.info(f"Starting RAG-based generation for {platform}...")
+    logger.info("Starting RAG-based generation for %s...", platform)
     
     # Step 1: Generate initial text for retrieval
     initial_text = await generate_initial_text_for_retrieval(prompt, platform, deps)
     
     # Step 2: Retrieve similar posts from Qdrant
-    logger.info(f"Retrieving similar {platform} posts from Qdrant...")
-    similar_posts = await retrieve_similar_posts(
-        query_text=initial_text,
-        platform=platform,
-        limit=num_examples
-    )
+    logger.info("Retrieving similar %s posts from Qdrant...", platform)
+    similar_posts = await retrieve_similar_posts_cached(initial_text, platform, num_examples, retrieval)
     
     # Step 3: Build enhanced prompt with retrieved examples
     enhanced_prompt = prompt
     if similar_posts:
-        logger.info(f"Found {len(similar_posts)} similar posts, adding to prompt")
+        logger.info("Found %s similar posts, adding to prompt", len(similar_posts))
         examples_text = "\n\n--- SIMILAR HIGH-PERFORMING POSTS FOR INSPIRATION ---\n\n"
         for i, post in enumerate(similar_posts, 1):
             examples_text += f"Example {i}:\n{post}\n\n"
@@ -337,7 +544,7 @@ async def retrieve_and_generate_content(
         examples_text += "Now create an original post based on the user's requirements, using these examples for inspiration on style and structure.\n\n"
         enhanced_prompt = examples_text + prompt
     else:
-        logger.warning(f"No similar posts found for {platform}, generating without RAG")
+        logger.warning("No similar posts found for %s, generating without RAG", platform)
     
     # Step 4: Generate final content with RAG examples
     if platform == "linkedin":
@@ -350,90 +557,50 @@ async def retrieve_and_generate_content(
         raise ValueError(f"Unknown platform: {platform}")
     
     try:
-        logger.info(f"Generating final {platform} content with RAG examples...")
-        result = await agent.run(enhanced_prompt, deps=deps, usage_limits=limits)
-        logger.info(f"RAG-based {platform} content generated successfully")
+        logger.info("Generating final %s content with RAG examples...", platform)
+        with span("text", platform):
+            result = await run_agent(agent, enhanced_prompt, "text", platform, hedge=True, deps=deps, usage_limits=limits)
+        logger.info("RAG-based %s content generated successfully", platform)
         return result.data
     except Exception as e:
-        logger.error(f"Failed to generate final {platform} content: {e}", exc_info=True)
+        logger.error("Failed to generate final %s content: %s", platform, e, exc_info=True)
         raise
 
 
-async def generate_all_platform_content(
+async def generate_platform_content(
     prompt: str,
+    platform: str,
     deps: AgentDeps,
-) -> GeneratedContent:
+    retrieval: RetrievalBatch | None = None,
+) -> PlatformContent:
     """
-    Generate content for all platforms using 3 separate API calls in parallel.
-    If RAG is enabled, uses retrieval-augmented generation workflow.
+    Generate content for a single platform.
+    If RAG is enabled, uses retrieval-augmented generation workflow, retrieving
+    through ``retrieval`` when the request's platforms share a batch.
     """
     from pydantic_ai.usage import UsageLimits
     
+    if RAG_ENABLED:
+        return await retrieve_and_generate_content(prompt, platform, deps, retrieval=retrieval)
+    
     limits = UsageLimits(
         request_limit=REQUEST_LIMIT,
         total_tokens_limit=TOKEN_LIMIT
     )
     
-    logger.info(f"Starting content generation for all platforms (RAG: {'ENABLED' if RAG_ENABLED else 'DISABLED'})...")
-    
-    if RAG_ENABLED:
-        # Use RAG-based generation
-        logger.info("Using RAG-based content generation workflow")
-        
-        # Run all 3 RAG workflows in parallel
-        linkedin_task = retrieve_and_generate_content(prompt, "linkedin", deps)
-        x_task = retrieve_and_generate_content(prompt, "x", deps)
-        instagram_task = retrieve_and_generate_content(prompt, "instagram", deps)
-        
-        try:
-            linkedin_content, x_content, instagram_content = await asyncio.gather(
-                linkedin_task,
-                x_task,
-                instagram_task,
-            )
-            
-            logger.info("All platforms generated successfully with RAG")
-            
-            return GeneratedContent(
-                linkedin=linkedin_content,
-                x=x_content,
-                instagram=instagram_content,
-            )
-        except Exception as e:
-            logger.error(f"RAG-based content generation failed: {e}", exc_info=True)
-            raise
+    if platform == "linkedin":
+        agent = get_linkedin_agent()
+    elif platform == "x":
+        agent = get_x_agent()
+    elif platform == "instagram":
+        agent = get_instagram_agent()
     else:
-        # Use traditional generation without RAG
-        logger.info("Using traditional content generation (without RAG)")
-        
-        linkedin_agent = get_linkedin_agent()
-        x_agent = get_x_agent()
-        instagram_agent = get_instagram_agent()
-        
-        # Run all 3 API calls in parallel
-        linkedin_task = linkedin_agent.run(prompt, deps=deps, usage_limits=limits)
-        x_task = x_agent.run(prompt, deps=deps, usage_limits=limits)
-        instagram_task = instagram_agent.run(prompt, deps=deps, usage_limits=limits)
-        
-        try:
-            linkedin_result, x_result, instagram_result = await asyncio.gather(
-                linkedin_task,
-                x_task,
-                instagram_task,
-            )
-            
-            logger.info(f"LinkedIn content generated. Usage: {linkedin_result.usage()}")
-            logger.info(f"X content generated. Usage: {x_result.usage()}")
-            logger.info(f"Instagram content generated. Usage: {instagram_result.usage()}")
-            
-            return GeneratedContent(
-                linkedin=linkedin_result.data,
-                x=x_result.data,
-                instagram=instagram_result.data,
-            )
-        except Exception as e:
-            logger.error(f"Content generation failed: {e}", exc_info=True)
-            raise
+        raise ValueError(f"Unknown platform: {platform}")
+    
+    with span("text", platform):
+        result = await run_agent(agent, prompt, "text", platform, hedge=True, deps=deps, usage_limits=limits)
+    logger.info("%s content generated. Usage: %s", platform, result.usage())
+    return result.data
 
 
 # ──────────────────────────────────────────────────────────────────────────────
@@ -442,13 +609,11 @@ async def generate_all_platform_content(
 
 
 def create_content_edit_agent() -> Agent[None, EditedContent]:
-    """Create an agent for editing social media content."""
-    logger.info(f"Creating content edit agent with model: {MODEL}")
-    return Agent(
-        MODEL,
+    """Create an agent for editing all parts of social media content at once."""
+    logger.info("Creating content edit agent with model: %s", OPENROUTER_MODEL_NAME)
+    return _new_agent(
         system_prompt=CONTENT_EDIT_SYSTEM_PROMPT,
         result_type=EditedContent,
-        retries=OUTPUT_VALIDATION_RETRIES,
     )
 
 
@@ -459,12 +624,21 @@ def get_content_edit_agent() -> Agent[None, EditedContent]:
     return create_content_edit_agent()
 
 
-async def run_content_edit_agent(
-    agent: Agent[None, EditedContent],
-    prompt: str,
-    message_history: List[ModelRequest | ModelResponse] | None = None,
-) -> EditedContent:
-    """Execute an edit request against the content edit agent."""
+async def edit_full_content(
+    hook: str,
+    body: str,
+    outro: str,
+    edit_instructions: str,
+) -> tuple[str, str, str]:
+    """
+    Edit all parts of the content (hook, body, outro) in a single agent run.
+    
+    One run sees and rewrites the whole post, so the parts stay consistent and
+    the post is sent to the model once instead of once per part.
+    
+    Returns:
+        The edited hook, body and outro
+    """
     from pydantic_ai.usage import UsageLimits
     
     limits = UsageLimits(
@@ -472,13 +646,27 @@ async def run_content_edit_agent(
         total_tokens_limit=TOKEN_LIMIT
     )
     
+    prompt = f"""
+Current post:
+
+Hook: {hook}
+
+Body: {body}
+
+Outro: {outro}
+
+Edit instructions:
+{edit_instructions}
+"""
+    
     try:
-        logger.info("Running content edit agent")
-        result = await agent.run(prompt, message_history=message_history, usage_limits=limits)
-        logger.info(f"Content edit completed successfully. Usage: {result.usage()}")
-        return result.data
+        logger.info("Editing all content parts with instructions: %.50s", edit_instructions)
+        with span("edit"):
+            result = await run_agent(get_content_edit_agent(), prompt, "edit", hedge=True, usage_limits=limits)
+        logger.info("Successfully edited all content parts. Usage: %s", result.usage())
+        return result.data.hook, result.data.body, result.data.outro
     except Exception as e:
-        logger.error(f"Content edit failed: {e}", exc_info=True)
+        logger.error("Failed to edit content: %s", e, exc_info=True)
         raise
 
 
@@ -489,12 +677,10 @@ async def run_content_edit_agent(
 
 def create_content_part_edit_agent() -> Agent[None, EditedPartContent]:
     """Create an agent for editing a specific part of social media content."""
-    logger.info(f"Creating content part edit agent with model: {MODEL}")
-    return Agent(
-        MODEL,
+    logger.info("Creating content part edit agent with model: %s", OPENROUTER_MODEL_NAME)
+    return _new_agent(
         system_prompt=CONTENT_PART_EDIT_SYSTEM_PROMPT,
         result_type=EditedPartContent,
-        retries=OUTPUT_VALIDATION_RETRIES,
     )
 
 
@@ -537,41 +723,13 @@ Please generate the new content for the {part_name} only.
 """
     
     try:
-        logger.info(f"Editing {part_name} with instructions: {edit_instructions[:50]}...")
-        result = await agent.run(prompt, usage_limits=limits)
-        logger.info(f"Successfully edited {part_name}. Usage: {result.usage()}")
+        logger.info("Editing %s with instructions: %.50s", part_name, edit_instructions)
+        with span(f"edit_{part_name}"):
+            result = await run_agent(agent, prompt, f"edit_{part_name}", hedge=True, usage_limits=limits)
+        logger.info("Successfully edited %s. Usage: %s", part_name, result.usage())
         return result.data.content
     except Exception as e:
-        logger.error(f"Failed to edit {part_name}: {e}", exc_info=True)
-        raise
-
-
-async def edit_full_content(
-    hook: str,
-    body: str,
-    outro: str,
-    edit_instructions: str,
-) -> tuple[str, str, str]:
-    """Edit all parts of the content (hook, body, outro) in parallel."""
-    full_context = f"Hook: {hook}\n\nBody: {body}\n\nOutro: {outro}"
-    
-    logger.info("Editing all content parts in parallel...")
-    
-    # Run all edits in parallel
-    hook_task = edit_content_part("hook", hook, full_context, edit_instructions)
-    body_task = edit_content_part("body", body, full_context, edit_instructions)
-    outro_task = edit_content_part("outro", outro, full_context, edit_instructions)
-    
-    try:
-        new_hook, new_body, new_outro = await asyncio.gather(
-            hook_task,
-            body_task,
-            outro_task,
-        )
-        logger.info("Successfully edited all content parts")
-        return new_hook, new_body, new_outro
-    except Exception as e:
-        logger.error(f"Failed to edit content: {e}", exc_info=True)
+        logger.error("Failed to edit %s: %s", part_name, e, exc_info=True)
         raise
 
 
@@ -582,12 +740,10 @@ async def edit_full_content(
 
 def create_image_prompt_agent() -> Agent[None, ImagePrompt]:
     """Create an agent for generating image prompts."""
-    logger.info(f"Creating image prompt agent with model: {MODEL}")
-    return Agent(
-        MODEL,
+    logger.info("Creating image prompt agent with model: %s", OPENROUTER_MODEL_NAME)
+    return _new_agent(
         system_prompt=IMAGE_PROMPT_SYSTEM_PROMPT,
         result_type=ImagePrompt,
-        retries=OUTPUT_VALIDATION_RETRIES,
     )
 
 
@@ -613,11 +769,11 @@ async def run_image_prompt_agent(
     
     try:
         logger.info("Running image prompt agent")
-        result = await agent.run(prompt, message_history=message_history, usage_limits=limits)
-        logger.info(f"Image prompt generation completed successfully. Usage: {result.usage()}")
+        result = await run_agent(agent, prompt, "image_prompt", message_history=message_history, usage_limits=limits)
+        logger.info("Image prompt generation completed successfully. Usage: %s", result.usage())
         return result.data
     except Exception as e:
-        logger.error(f"Image prompt generation failed: {e}", exc_info=True)
+        logger.error("Image prompt generation failed: %s", e, exc_info=True)
         raise
 
 
@@ -631,34 +787,56 @@ class ImageGenerationError(Exception):
     pass
 
 
-async def generate_image(prompt: str, image_urls: list[str]) -> str:
-    """Generate/edit an image using Fal.ai nano-banana-pro and return the URL."""
-    logger.info(f"Starting image generation with {len(image_urls)} reference images")
-    logger.debug(f"Image generation prompt: {prompt[:150]}..." if len(prompt) > 150 else f"Image generation prompt: {prompt}")
+async def generate_image(prompt: str, image_urls: list[str], platform: str | None = None) -> str:
+    """
+    Generate/edit an image using Fal.ai nano-banana-pro and return the URL.
+    
+    The job is timed as three stages: ``fal_submit`` (until Fal accepts it),
+    ``fal_queue`` (waiting for a runner) and ``fal_run`` (until the result is back).
+    """
+    logger.info("Starting image generation with %s reference images", len(image_urls))
+    logger.debug("Image generation prompt: %.150s", prompt)
+    
+    import fal_client
     
     try:
-        handler = await fal_client.submit_async(
-            FAL_IMAGE_MODEL,
-            arguments={
-                "prompt": prompt,
-                "image_urls": image_urls,
-            },
-        )
-        logger.debug(f"Submitted async image generation request to {FAL_IMAGE_MODEL}")
-        
-        # Wait for completion by iterating through events
-        async for event in handler.iter_events(with_logs=True):
-            if hasattr(event, 'logs'):
-                for log in event.logs:
-                    logger.debug(f"Fal.ai log: {log}")
-        
-        # Get the final result
-        result = await handler.get()
+        # Hold a fal scheduling slot for the whole job so queued jobs count against the limit
+        async with provider_slot("fal", "image"):
+            with span("fal_submit", platform):
+                handler = await get_fal_client().submit(
+                    FAL_IMAGE_MODEL,
+                    arguments={
+                        "prompt": prompt,
+                        "image_urls": image_urls,
+                    },
+                )
+            logger.debug("Submitted async image generation request to %s", FAL_IMAGE_MODEL)
+            
+            # Wait for completion by iterating through events
+            queued_at = time.perf_counter()
+            started_at = None
+            try:
+                async for event in handler.iter_events(with_logs=True):
+                    if started_at is None and not isinstance(event, fal_client.Queued):
+                        started_at = time.perf_counter()
+                        record("fal_queue", started_at - queued_at, platform)
+                    # Fal streams many log lines per job; skip the loop unless they would be emitted
+                    if hasattr(event, 'logs') and logger.isEnabledFor(logging.DEBUG):
+                        for log in event.logs:
+                            logger.debug("Fal.ai log: %s", log)
+                
+                # Get the final result
+                result = await handler.get()
+            except BaseException as e:
+                stage = "fal_queue" if started_at is None else "fal_run"
+                record(stage, time.perf_counter() - (started_at or queued_at), platform, outcome=outcome_for(e))
+                raise
+            record("fal_run", time.perf_counter() - (started_at or queued_at), platform)
         image_url = result["images"][0]["url"]
-        logger.info(f"Image generation completed successfully: {image_url}")
+        logger.info("Image generation completed successfully: %s", image_url)
         return image_url
     except Exception as e:
-        logger.error(f"Image generation failed: {e}", exc_info=True)
+        logger.error("Image generation failed: %s", e, exc_info=True)
         raise ImageGenerationError(f"Image generation failed: {str(e)}")
 
 
@@ -667,64 +845,64 @@ def _format_platform_content(content: PlatformContent) -> str:
     return f"{content.hook}\n\n{content.body}\n\n{content.outro}"
 
 
-async def generate_platform_images(
+# Per-platform image prompt instructions: (request, style)
+IMAGE_PROMPT_TEMPLATES = {
+    "linkedin": (
+        "Create a professional marketing image prompt for LinkedIn.",
+        "Style: Professional, clean, corporate-friendly.",
+    ),
+    "x": (
+        "Create an eye-catching marketing image prompt for X (formerly Twitter).",
+        "Style: Bold, attention-grabbing, shareable.",
+    ),
+    "instagram": (
+        "Create a visually stunning marketing image prompt for Instagram.",
+        "Style: Aesthetic, lifestyle-focused, Instagram-worthy.",
+    ),
+}
+
+
+def _build_image_prompt_request(
     product_description: str,
-    linkedin_content: PlatformContent,
-    x_content: PlatformContent,
-    instagram_content: PlatformContent,
-    product_image_urls: list[str],
-) -> tuple[str, str, str]:
-    """Generate optimized images for each platform."""
-    logger.info("Generating platform-specific images for LinkedIn, X, and Instagram")
-    image_prompt_agent = get_image_prompt_agent()
-    
-    # Format content for prompts
-    linkedin_text = _format_platform_content(linkedin_content)
-    x_text = _format_platform_content(x_content)
-    instagram_text = _format_platform_content(instagram_content)
-    
-    # Generate image prompts for each platform
-    logger.info("Creating image prompts for all platforms...")
-    linkedin_prompt_task = image_prompt_agent.run(
-        f"Create a professional marketing image prompt for LinkedIn. "
-        f"Product: {product_description}. Post content: {linkedin_text}. "
-        f"Style: Professional, clean, corporate-friendly."
-    )
-    
-    x_prompt_task = image_prompt_agent.run(
-        f"Create an eye-catching marketing image prompt for X (formerly Twitter). "
-        f"Product: {product_description}. Post content: {x_text}. "
-        f"Style: Bold, attention-grabbing, shareable."
-    )
-    
-    instagram_prompt_task = image_prompt_agent.run(
-        f"Create a visually stunning marketing image prompt for Instagram. "
-        f"Product: {product_description}. Post content: {instagram_text}. "
-        f"Style: Aesthetic, lifestyle-focused, Instagram-worthy."
+    platform: str,
+    content: PlatformContent,
+) -> str:
+    """Build the image prompt agent request for a platform's post."""
+    if platform not in IMAGE_PROMPT_TEMPLATES:
+        raise ValueError(f"Unknown platform: {platform}")
+    request, style = IMAGE_PROMPT_TEMPLATES[platform]
+    return (
+        f"{request} "
+        f"Product: {product_description}. Post content: {_format_platform_content(content)}. "
+        f"{style}"
     )
+
+
+async def generate_platform_image_prompt(
+    product_description: str,
+    platform: str,
+    content: PlatformContent,
+) -> str:
+    """
+    Generate the image generation prompt for a single platform's post.
     
-    # Run all prompt generations concurrently
-    logger.info("Waiting for image prompt generation to complete...")
-    linkedin_result, x_result, instagram_result = await asyncio.gather(
-        linkedin_prompt_task,
-        x_prompt_task,
-        instagram_prompt_task,
-    )
-    logger.info("All image prompts generated successfully")
-    logger.debug(f"LinkedIn prompt: {linkedin_result.data.prompt[:100]}...")
-    logger.debug(f"X prompt: {x_result.data.prompt[:100]}...")
-    logger.debug(f"Instagram prompt: {instagram_result.data.prompt[:100]}...")
-    
-    # Generate images concurrently using product images as base
-    logger.info("Generating images for all platforms concurrently...")
-    linkedin_image, x_image, instagram_image = await asyncio.gather(
-        generate_image(linkedin_result.data.prompt, product_image_urls),
-        generate_image(x_result.data.prompt, product_image_urls),
-        generate_image(instagram_result.data.prompt, product_image_urls),
-    )
-    logger.info("All platform images generated successfully")
+    In reference sheet mode the prompt tells the image model how to read a
+    contact sheet of product photos.
+    """
+    image_prompt_agent = get_image_prompt_agent()
     
-    return linkedin_image, x_image, instagram_image
+    logger.info("Creating image prompt for %s...", platform)
+    with span("image_prompt", platform):
+        result = await run_agent(
+            image_prompt_agent,
+            _build_image_prompt_request(product_description, platform, content),
+            "image_prompt",
+            platform,
+        )
+    logger.debug("%s prompt: %.100s", platform, result.data.prompt)
+    if IMAGE_REFERENCE_SHEET:
+        return f"{result.data.prompt}\n\n{REFERENCE_SHEET_PROMPT_NOTE}"
+    return result.data.prompt
 
 
 async def generate_edited_image(
@@ -738,16 +916,69 @@ async def generate_edited_image(
     image_prompt_agent = get_image_prompt_agent()
     
     logger.info("Creating image prompt for edited content...")
-    result = await image_prompt_agent.run(
-        f"Create an image prompt for edited social media content. "
-        f"Original: {original_content}. "
-        f"Edit instructions: {edit_instructions}. "
-        f"New content: {edited_content}. "
-        f"Style: Modern, engaging, scroll-stopping."
-    )
-    logger.debug(f"Generated image prompt: {result.data.prompt[:100]}...")
+    with span("image_prompt"):
+        result = await run_agent(
+            image_prompt_agent,
+            f"Create an image prompt for edited social media content. "
+            f"Original: {original_content}. "
+            f"Edit instructions: {edit_instructions}. "
+            f"New content: {edited_content}. "
+            f"Style: Modern, engaging, scroll-stopping.",
+            "image_prompt",
+        )
+    logger.debug("Generated image prompt: %.100s", result.data.prompt)
     
     logger.info("Generating edited image...")
     new_image_url = await generate_image(result.data.prompt, [original_image_url])
     logger.info("Edited image generated successfully")
     return new_image_url
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Warmup
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+AGENT_GETTERS = (
+    get_linkedin_agent,
+    get_x_agent,
+    get_instagram_agent,
+    get_rag_initial_linkedin_agent,
+    get_rag_initial_x_agent,
+    get_rag_initial_instagram_agent,
+    get_rag_final_linkedin_agent,
+    get_rag_final_x_agent,
+    get_rag_final_instagram_agent,
+    get_content_edit_agent,
+    get_content_part_edit_agent,
+    get_image_prompt_agent,
+)
+
+
+def warmup_agents() -> None:
+    """
+    Check the API keys and build the models, every agent and the Fal client up
+    front, so the first request does not pay for imports and construction.
+    
+    Raises:
+        ValueError: If an API key is missing
+    """
+    start = time.perf_counter()
+    get_fal_key()
+    get_model()
+    get_fallback_model()
+    for getter in AGENT_GETTERS:
+        getter()
+    get_fal_client()
+    logger.info("Warmed up %s agents in %.0f ms", len(AGENT_GETTERS), (time.perf_counter() - start) * 1000)
+
+
+def clear_agents() -> None:
+    """
+    Drop the cached agents and the hedger (which holds the fallback model), so
+    the next request rebuilds them on the current models (see
+    http_clients.close_http_clients).
+    """
+    for getter in AGENT_GETTERS:
+        getter.cache_clear()
+    get_hedger.cache_clear()
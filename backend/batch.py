@@ -0,0 +1,233 @@
+"""
+Batch campaign generation: many prompts through the generate pipeline under one
+shared concurrency budget
+
+Usage:
+    python batch.py manifest.json [--concurrency 4] [--output results.jsonl]
+
+The manifest is a JSON list (or an object with an "items" list) of campaigns:
+    [
+        {"id": "bottle-blue", "prompt": "...", "images": ["shots/blue.jpg"], "platforms": ["linkedin", "x"]},
+        {"id": "bottle-red", "prompt": "...", "images": ["shots/red.jpg", "shots/lifestyle.jpg"]}
+    ]
+
+Each result is written as one JSON line as soon as its campaign finishes.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import AsyncIterator, List, Sequence
+
+from pydantic import BaseModel, Field
+
+from constants import (
+    BATCH_DEFAULT_CONCURRENCY,
+    BATCH_MAX_CONCURRENCY,
+    BATCH_MAX_ITEMS,
+    GENERATE_DEADLINE_SECONDS,
+)
+from logging_config import configure_logging
+from deadlines import Deadline
+from models import BatchItemResult
+from pipeline import generate_campaign, normalize_platforms
+from singleflight import generate_request_key, get_request_coalescer
+from uploads import UploadedImage, guess_content_type, reference_image_urls, upload_image_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class BatchRequestItem(BaseModel):
+    """A single campaign in a batch request."""
+    prompt: str = Field(description="Description of the product, company, or campaign")
+    images: List[int] = Field(min_length=1, description="Indices into the uploaded images list")
+    platforms: List[str] | None = Field(default=None, description="Platforms to generate (default: all)")
+    id: str | None = Field(default=None, description="Client-supplied identifier echoed in the result")
+
+
+class BatchRequest(BaseModel):
+    """A batch of campaigns sharing one set of uploaded images."""
+    items: List[BatchRequestItem] = Field(min_length=1)
+
+
+@dataclass
+class BatchCampaign:
+    """A validated campaign ready to run, with its product images already uploaded."""
+    index: int
+    id: str
+    prompt: str
+    images: List[UploadedImage]
+    platforms: tuple[str, ...]
+
+
+def resolve_batch(request: BatchRequest, uploaded: Sequence[UploadedImage]) -> list[BatchCampaign]:
+    """
+    Validate a batch request against its uploaded images.
+
+    Raises:
+        ValueError: If the batch is too large, references a missing image or names an unknown platform
+    """
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise ValueError(f"Batch has {len(request.items)} items, the maximum is {BATCH_MAX_ITEMS}")
+
+    campaigns = []
+    for index, item in enumerate(request.items):
+        missing = [idx for idx in item.images if idx < 0 or idx >= len(uploaded)]
+        if missing:
+            raise ValueError(f"Item {index} references unknown image indices: {missing}")
+        campaigns.append(BatchCampaign(
+            index=index,
+            id=item.id or str(index),
+            prompt=item.prompt,
+            images=[uploaded[idx] for idx in item.images],
+            platforms=normalize_platforms(item.platforms),
+        ))
+    return campaigns
+
+
+@lru_cache(maxsize=1)
+def get_batch_slots() -> asyncio.Semaphore:
+    """
+    Return the process-wide campaign slots shared by every running batch.
+
+    A batch's own ``concurrency`` only limits that batch; this caps the total, so
+    several concurrent batch requests cannot multiply the load on the providers.
+    """
+    return asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+
+async def run_batch(
+    campaigns: Sequence[BatchCampaign],
+    concurrency: int = BATCH_DEFAULT_CONCURRENCY,
+) -> AsyncIterator[BatchItemResult]:
+    """
+    Run campaigns through the generate pipeline and yield results as they complete.
+
+    At most ``concurrency`` campaigns of this batch run at once, and at most
+    BATCH_MAX_CONCURRENCY across all batches in the process. Agents are
+    process-wide singletons, images are uploaded once per digest, and identical
+    campaigns within the batch share one execution.
+    """
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+    semaphore = asyncio.Semaphore(concurrency)
+    slots = get_batch_slots()
+    coalescer = get_request_coalescer()
+    logger.info("Running batch of %s campaigns with concurrency %s", len(campaigns), concurrency)
+
+    async def run_campaign(campaign: BatchCampaign) -> BatchItemResult:
+        # Take the batch's own slot first, so its queued campaigns don't hold shared ones
+        async with semaphore, slots:
+            start = time.perf_counter()
+            key = generate_request_key(
+                campaign.prompt,
+                [image.digest for image in campaign.images],
+                campaign.platforms,
+                GENERATE_DEADLINE_SECONDS,
+            )
+            try:
+                image_urls = await reference_image_urls(campaign.images)
+                result = await coalescer.do(
+                    key,
+                    # Each campaign gets its own budget, starting once it holds a slot
+                    lambda: generate_campaign(
+                        campaign.prompt, image_urls, campaign.platforms, Deadline(GENERATE_DEADLINE_SECONDS)
+                    ),
+                )
+            except Exception as e:
+                logger.error("Batch item %s failed: %s", campaign.id, e, exc_info=True)
+                return BatchItemResult(
+                    index=campaign.index,
+                    id=campaign.id,
+                    status="failed",
+                    elapsed_ms=(time.perf_counter() - start) * 1000,
+                    error=str(e),
+                )
+            return BatchItemResult(
+                index=campaign.index,
+                id=campaign.id,
+                status="succeeded",
+                elapsed_ms=(time.perf_counter() - start) * 1000,
+                result=result,
+            )
+
+    tasks = [asyncio.create_task(run_campaign(campaign)) for campaign in campaigns]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            item_result = await next_done
+            logger.info("Batch item %s %s in %.0f ms", item_result.id, item_result.status, item_result.elapsed_ms)
+            yield item_result
+    finally:
+        # Consumer went away (e.g. client disconnected): stop the remaining campaigns
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Command Line Interface
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+def load_manifest(path: Path) -> tuple[BatchRequest, list[Path]]:
+    """
+    Load a CLI manifest whose items list image file paths.
+    Returns the batch request (with images as indices) and the unique image paths.
+    """
+    data = json.loads(path.read_text(encoding="utf-8"))
+    raw_items = data["items"] if isinstance(data, dict) else data
+
+    image_paths: list[Path] = []
+    path_indices: dict[Path, int] = {}
+    items = []
+    for raw in raw_items:
+        indices = []
+        for image in raw.get("images", []):
+            image_path = (path.parent / image).resolve()
+            if image_path not in path_indices:
+                path_indices[image_path] = len(image_paths)
+                image_paths.append(image_path)
+            indices.append(path_indices[image_path])
+        items.append(BatchRequestItem(**{**raw, "images": indices}))
+    return BatchRequest(items=items), image_paths
+
+
+async def main(manifest_path: Path, concurrency: int, output: Path | None) -> int:
+    """Run a batch manifest in-process and write one JSON line per finished campaign."""
+    request, image_paths = load_manifest(manifest_path)
+    print(f"Uploading {len(image_paths)} unique images...", file=sys.stderr)
+    uploaded = await asyncio.gather(*(
+        upload_image_bytes(image_path.read_bytes(), image_path.name, guess_content_type(image_path.name))
+        for image_path in image_paths
+    ))
+    campaigns = resolve_batch(request, uploaded)
+
+    out = output.open("w", encoding="utf-8") if output else sys.stdout
+    failed = 0
+    try:
+        async for item_result in run_batch(campaigns, concurrency):
+            failed += item_result.status != "succeeded"
+            out.write(item_result.model_dump_json() + "\n")
+            out.flush()
+    finally:
+        if output:
+            out.close()
+
+    print(f"Batch complete: {len(campaigns) - failed} succeeded, {failed} failed", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate campaigns for many prompts in one run")
+    parser.add_argument("manifest", type=Path, help="JSON manifest of campaigns")
+    parser.add_argument("--concurrency", type=int, default=BATCH_DEFAULT_CONCURRENCY,
+                        help=f"Campaigns to run at once (max {BATCH_MAX_CONCURRENCY})")
+    parser.add_argument("--output", type=Path, default=None, help="Write JSON lines here instead of stdout")
+    args = parser.parse_args()
+    configure_logging()
+    sys.exit(asyncio.run(main(args.manifest, args.concurrency, args.output)))
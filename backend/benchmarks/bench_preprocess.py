@@ -0,0 +1,115 @@
+"""
+Image preprocessing benchmark: bytes and upload latency saved by downscaling
+
+Usage:
+    python benchmarks/bench_preprocess.py [photo.jpg ...] [--runs 3] [--uplink-mbps 20] [--upload]
+
+Without paths, a synthetic 12 MP phone photo (noisy, JPEG quality 95, EXIF
+rotated) is used. For each image the benchmark reports the original and
+preprocessed size, the preprocessing time and the upload time at the given
+uplink bandwidth. With --upload it also uploads both versions to the Fal CDN
+(needs FAL_KEY) and reports the measured upload times.
+"""
+
+import argparse
+import io
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from constants import IMAGE_MAX_EDGE, IMAGE_OUTPUT_FORMAT, IMAGE_OUTPUT_QUALITY  # noqa: E402
+from images import preprocess_image_bytes  # noqa: E402
+from uploads import guess_content_type  # noqa: E402
+
+
+def synthetic_photo(width: int = 4032, height: int = 3024) -> bytes:
+    """Return a phone-sized JPEG with sensor-like noise and a 90° EXIF orientation."""
+    from PIL import Image, ImageOps
+
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 48)
+    image = Image.merge("RGB", (gradient, noise, ImageOps.invert(gradient)))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Orientation: rotate 90° clockwise to display
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=95, exif=exif)
+    return buffer.getvalue()
+
+
+def upload_seconds(size: int, uplink_mbps: float) -> float:
+    return size * 8 / (uplink_mbps * 1_000_000)
+
+
+def measure_upload(data: bytes, content_type: str) -> float:
+    import fal_client
+    from uploads import FAL_UPLOAD_REPOSITORY
+
+    start = time.perf_counter()
+    fal_client.upload(data, content_type, repository=FAL_UPLOAD_REPOSITORY)
+    return time.perf_counter() - start
+
+
+def bench_image(name: str, data: bytes, content_type: str, args: argparse.Namespace) -> dict:
+    timings = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        prepared = preprocess_image_bytes(data, content_type, args.max_edge, args.format, args.quality)
+        timings.append(time.perf_counter() - start)
+    preprocess_s = statistics.median(timings)
+
+    result = {
+        "image": name,
+        "original_bytes": len(data),
+        "prepared_bytes": len(prepared.data),
+        "ratio": len(prepared.data) / len(data),
+        "size": f"{prepared.width}x{prepared.height}",
+        "preprocess_ms": preprocess_s * 1000,
+        "original_upload_ms": upload_seconds(len(data), args.uplink_mbps) * 1000,
+        "prepared_upload_ms": upload_seconds(len(prepared.data), args.uplink_mbps) * 1000,
+    }
+    if args.upload:
+        result["original_upload_ms"] = measure_upload(data, content_type) * 1000
+        result["prepared_upload_ms"] = measure_upload(prepared.data, prepared.content_type) * 1000
+    result["saved_ms"] = result["original_upload_ms"] - result["prepared_upload_ms"] - result["preprocess_ms"]
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark product image preprocessing")
+    parser.add_argument("images", nargs="*", type=Path, help="Images to preprocess (default: a synthetic photo)")
+    parser.add_argument("--runs", type=int, default=3, help="Preprocessing runs per image (median is reported)")
+    parser.add_argument("--max-edge", type=int, default=IMAGE_MAX_EDGE, help="Longest output edge in pixels")
+    parser.add_argument("--format", default=IMAGE_OUTPUT_FORMAT, help="Output format (WEBP, JPEG or PNG)")
+    parser.add_argument("--quality", type=int, default=IMAGE_OUTPUT_QUALITY, help="Output quality")
+    parser.add_argument("--uplink-mbps", type=float, default=20, help="Uplink bandwidth for the estimated upload time")
+    parser.add_argument("--upload", action="store_true", help="Measure real uploads to the Fal CDN (needs FAL_KEY)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+    args.format = args.format.upper()
+
+    if args.images:
+        inputs = [(path.name, path.read_bytes(), guess_content_type(path.name)) for path in args.images]
+    else:
+        inputs = [("synthetic-12mp.jpg", synthetic_photo(), "image/jpeg")]
+
+    results = [bench_image(name, data, content_type, args) for name, data, content_type in inputs]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    for result in results:
+        print(
+            f"{result['image']}: {result['original_bytes'] / 1e6:.2f} MB -> {result['prepared_bytes'] / 1e6:.2f} MB "
+            f"({result['ratio']:.0%}, {result['size']}), preprocess {result['preprocess_ms']:.0f} ms, "
+            f"upload {result['original_upload_ms']:.0f} -> {result['prepared_upload_ms']:.0f} ms, "
+            f"net saved {result['saved_ms']:.0f} ms"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
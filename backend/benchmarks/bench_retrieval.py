@@ -0,0 +1,174 @@
+"""
+Retrieval benchmark: per-call embedding and search latency of the RAG stage
+
+Usage:
+    python benchmarks/bench_retrieval.py [--calls 50] [--search]
+
+Measures, for the configured EMBEDDING_BACKEND:
+    - in-process embedding of one query (the embedder's raw cost),
+    - one query through the batching worker pool (what a retrieval pays),
+    - three concurrent queries, as issued by one /generate (batched into one call),
+    - a repeated query answered by the embedding cache,
+and with --search the full retrieve_similar_posts call against Qdrant, plus a
+request's three retrievals as separate searches and as one batched search
+(needs QDRANT_API_KEY and a collection built by populate_qdrant.py; search
+errors abort the run rather than timing empty results). Compare the
+totals with the rag_initial stage on /metrics to see what retrieval costs.
+Uncached queries carry a per-run nonce, so the persistent embedding cache never
+answers them from an earlier run.
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from constants import PLATFORMS  # noqa: E402
+from embeddings import get_embedder, get_local_embedder, shutdown_embedding_pool  # noqa: E402
+
+QUERIES = [
+    "We just launched an AI analytics tool that turns four-hour reports into four-minute insights.",
+    "Most of your audience isn't ready to buy, so build the brand before the purchase moment.",
+    "Our eco-friendly water bottle keeps drinks cold for 24 hours and is made from recycled steel.",
+    "Three lessons from almost shutting down our startup and growing to $5M ARR.",
+]
+
+NONCE = uuid.uuid4().hex[:8]
+
+
+def summarize(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+    return {
+        "p50_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+    }
+
+
+def bench_in_process(calls: int) -> dict:
+    embedder = get_local_embedder()
+    embedder.embed(["warmup"])
+    samples = []
+    for idx in range(calls):
+        start = time.perf_counter()
+        embedder.embed([QUERIES[idx % len(QUERIES)] + f" #{NONCE}-{idx}"])
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+async def bench_pool(calls: int) -> tuple[dict, dict, dict]:
+    embedder = get_embedder()
+    await embedder.embed("warmup")  # Spawn the worker and load the model
+
+    single = []
+    for idx in range(calls):
+        start = time.perf_counter()
+        await embedder.embed(QUERIES[idx % len(QUERIES)] + f" #{NONCE}-{idx}")
+        single.append(time.perf_counter() - start)
+
+    concurrent = []
+    for idx in range(calls):
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            embedder.embed(f"{QUERIES[(idx + offset) % len(QUERIES)]} {platform} #{NONCE}-{idx}")
+            for offset, platform in enumerate(PLATFORMS)
+        ))
+        concurrent.append(time.perf_counter() - start)
+
+    # The single-query texts again: answered by the cache when EMBEDDING_CACHE_ENABLED
+    cached = []
+    for idx in range(calls):
+        start = time.perf_counter()
+        await embedder.embed(QUERIES[idx % len(QUERIES)] + f" #{NONCE}-{idx}")
+        cached.append(time.perf_counter() - start)
+    return summarize(single), summarize(concurrent), summarize(cached)
+
+
+async def bench_search(calls: int) -> tuple[dict, dict, dict]:
+    from qdrant_client_helper import get_collection_info, retrieve_similar_posts, retrieve_similar_posts_batch
+
+    # The retrieval helpers return no posts on failure; time nothing but real searches
+    info = await get_collection_info()
+    if info is None or not info.exists:
+        raise SystemExit("--search needs QDRANT_API_KEY and a collection built by populate_qdrant.py")
+    retrieve = functools.partial(retrieve_similar_posts, raise_errors=True)
+    retrieve_batch = functools.partial(retrieve_similar_posts_batch, raise_errors=True)
+
+    await retrieve(QUERIES[0], "linkedin")
+    samples = []
+    for idx in range(calls):
+        start = time.perf_counter()
+        await retrieve(QUERIES[idx % len(QUERIES)] + f" #{NONCE}-{idx}", PLATFORMS[idx % len(PLATFORMS)])
+        samples.append(time.perf_counter() - start)
+
+    # One /generate worth of retrievals: three concurrent searches, then one batched search
+    separate = []
+    batched = []
+    for idx in range(calls):
+        # Distinct texts for each variant, so neither is answered by the embedding cache
+        queries = [
+            (f"{QUERIES[(idx + offset) % len(QUERIES)]} #{NONCE}-separate-{idx}", platform)
+            for offset, platform in enumerate(PLATFORMS)
+        ]
+        start = time.perf_counter()
+        await asyncio.gather(*(retrieve(query, platform) for query, platform in queries))
+        separate.append(time.perf_counter() - start)
+
+        queries = [(query.replace("-separate-", "-batched-"), platform) for query, platform in queries]
+        start = time.perf_counter()
+        await retrieve_batch(queries)
+        batched.append(time.perf_counter() - start)
+    return summarize(samples), summarize(separate), summarize(batched)
+
+
+async def run(args: argparse.Namespace) -> dict:
+    results = {
+        "embedder": get_local_embedder().name,
+        "dimension": get_local_embedder().dimension,
+        "embed_in_process": bench_in_process(args.calls),
+    }
+    (
+        results["embed_pool_single"],
+        results["embed_pool_3_concurrent"],
+        results["embed_pool_repeated"],
+    ) = await bench_pool(args.calls)
+    if args.search:
+        (
+            results["retrieve_similar_posts"],
+            results["retrieve_3_separate"],
+            results["retrieve_3_batched"],
+        ) = await bench_search(args.calls)
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the retrieval stage")
+    parser.add_argument("--calls", type=int, default=50, help="Calls per measurement")
+    parser.add_argument("--search", action="store_true", help="Also time full retrievals against Qdrant")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        shutdown_embedding_pool()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return 0
+    print(f"embedder: {results['embedder']} ({results['dimension']} dimensions)")
+    for name, stats in results.items():
+        if isinstance(stats, dict):
+            print(f"{name:>24}: p50 {stats['p50_ms']:7.2f} ms  p95 {stats['p95_ms']:7.2f} ms  mean {stats['mean_ms']:7.2f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
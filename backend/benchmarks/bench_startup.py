@@ -0,0 +1,125 @@
+"""
+Startup benchmark: import time, warmup time and first-request latency
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 5] [--max-import-ms 1500] [--max-first-request-ms 250]
+
+Every measurement runs in a fresh interpreter with the API keys removed from the
+environment, so it also checks that the server can be imported and served
+offline. Exits non-zero when a budget is exceeded or when importing the server
+pulls in a provider SDK that should only load on first use.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Provider SDKs that must not be imported just by importing the server
+LAZY_MODULES = ("pydantic_ai", "fal_client", "openai", "qdrant_client")
+
+IMPORT_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"ms": elapsed * 1000, "loaded": [m for m in {lazy!r} if m in sys.modules]}}))
+"""
+
+FIRST_REQUEST_SNIPPET = """
+import json, time
+from fastapi.testclient import TestClient
+import server
+
+with TestClient(server.app) as client:
+    start = time.perf_counter()
+    client.get("/")
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    client.get("/")
+    second = time.perf_counter() - start
+print(json.dumps({"first_ms": first * 1000, "second_ms": second * 1000}))
+"""
+
+WARMUP_SNIPPET = """
+import json, time
+import agents
+start = time.perf_counter()
+agents.warmup_agents()
+print(json.dumps({"ms": (time.perf_counter() - start) * 1000}))
+"""
+
+
+def run_snippet(code: str, env_overrides: dict[str, str] | None = None) -> dict:
+    """Run a snippet in a fresh interpreter from the backend directory and return its JSON output."""
+    env = {k: v for k, v in os.environ.items() if k not in ("OPENROUTER_API_KEY", "FAL_KEY")}
+    env["STARTUP_WARMUP"] = "false"
+    env.update(env_overrides or {})
+    completed = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Snippet failed:\n{completed.stderr}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def median_of(runs: int, code: str, key: str, env_overrides: dict[str, str] | None = None) -> tuple[float, dict]:
+    samples = [run_snippet(code, env_overrides) for _ in range(runs)]
+    return statistics.median(sample[key] for sample in samples), samples[-1]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark server startup")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per measurement")
+    parser.add_argument("--max-import-ms", type=float, default=1500, help="Budget for `import server`")
+    parser.add_argument("--max-first-request-ms", type=float, default=250, help="Budget for the first request")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results: dict[str, float] = {}
+    failures: list[str] = []
+
+    for module in ("constants", "agents", "server"):
+        ms, last = median_of(args.runs, IMPORT_SNIPPET.format(module=module, lazy=LAZY_MODULES), "ms")
+        results[f"import_{module}_ms"] = ms
+        if last["loaded"]:
+            failures.append(f"`import {module}` eagerly imports {', '.join(last['loaded'])}")
+
+    first_ms, last = median_of(args.runs, FIRST_REQUEST_SNIPPET, "first_ms")
+    results["first_request_ms"] = first_ms
+    results["second_request_ms"] = last["second_ms"]
+
+    # Dummy keys: building models and agents does not touch the network
+    warmup_ms, _ = median_of(
+        args.runs, WARMUP_SNIPPET, "ms",
+        {"OPENROUTER_API_KEY": "bench-offline", "FAL_KEY": "bench-offline"},
+    )
+    results["warmup_ms"] = warmup_ms
+
+    if results["import_server_ms"] > args.max_import_ms:
+        failures.append(f"import server took {results['import_server_ms']:.0f} ms (budget {args.max_import_ms:.0f} ms)")
+    if first_ms > args.max_first_request_ms:
+        failures.append(f"first request took {first_ms:.0f} ms (budget {args.max_first_request_ms:.0f} ms)")
+
+    if args.json:
+        print(json.dumps({"results": results, "failures": failures}, indent=2))
+    else:
+        for name, value in results.items():
+            print(f"{name:>20}: {value:8.1f}")
+        for failure in failures:
+            print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
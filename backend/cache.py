@@ -0,0 +1,314 @@
+"""
+Content-addressed caches with pluggable shared backends
+
+Every cache is a per-process memory tier in front of an optional shared backend
+(SQLite file or Redis) that all uvicorn workers on a host, or all hosts, see.
+Values must be JSON-serializable.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict
+
+from prometheus_client import Counter
+
+from constants import CACHE_BACKEND, CACHE_KEY_PREFIX, CACHE_REDIS_URL, CACHE_SQLITE_PATH
+
+logger = logging.getLogger(__name__)
+
+CACHE_REQUESTS = Counter(
+    "viral_spark_cache_requests_total",
+    "Cache lookups by cache, tier and result",
+    ["cache", "tier", "result"],
+)
+
+
+def content_digest(data: bytes) -> str:
+    """Return the SHA-256 hex digest used as a content address."""
+    return hashlib.sha256(data).hexdigest()
+
+
+class TTLCache:
+    """Bounded in-memory LRU cache whose entries expire after a TTL."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl_seconds: float | None = None) -> None:
+        self._entries[key] = (time.monotonic() + (ttl_seconds or self.ttl_seconds), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Shared Backends
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+class CacheBackend(ABC):
+    """A key-value store shared by all worker processes."""
+
+    name: str = "backend"
+
+    @abstractmethod
+    async def get(self, key: str) -> Any | None:
+        """Return the value for a key, or None if it is missing or expired."""
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl_seconds: float) -> None:
+        """Store a JSON-serializable value for ``ttl_seconds``."""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """Remove a key if present."""
+
+    async def close(self) -> None:
+        """Release connections held by the backend."""
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Cache in a local SQLite file, shared by every process on the host.
+
+    The database runs in WAL mode so readers never block the writer, and each
+    worker thread keeps its own connection. Queries run in a worker thread so
+    they never block the event loop. Expired rows are purged every
+    ``purge_every`` writes.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str | os.PathLike, purge_every: int = 500):
+        self.path = Path(path)
+        self.purge_every = purge_every
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # A generous busy timeout lets concurrent writers from other workers queue up
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _get(self, key: str) -> Any | None:
+        row = self._connect().execute(
+            "SELECT value FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _set(self, key: str, value: str, ttl_seconds: float) -> None:
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, time.time() + ttl_seconds),
+        )
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+
+    def _delete(self, key: str) -> None:
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    async def get(self, key: str) -> Any | None:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: Any, ttl_seconds: float) -> None:
+        await asyncio.to_thread(self._set, key, json.dumps(value), ttl_seconds)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key)
+
+
+class RedisBackend(CacheBackend):
+    """
+    Cache in Redis (or any server speaking the Redis protocol, e.g. Valkey or
+    KeyDB), shared across hosts. Requires the optional ``redis`` package.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND=redis requires the redis package (pip install redis)") from e
+        self.url = url
+        self._client = redis.from_url(url)
+
+    async def get(self, key: str) -> Any | None:
+        raw = await self._client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Any, ttl_seconds: float) -> None:
+        await self._client.set(key, json.dumps(value), px=max(1, int(ttl_seconds * 1000)))
+
+    async def delete(self, key: str) -> None:
+        await self._client.delete(key)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+@lru_cache(maxsize=1)
+def get_cache_backend() -> CacheBackend | None:
+    """
+    Return the singleton shared backend selected by CACHE_BACKEND, or None when
+    caches are memory-only.
+    """
+    if CACHE_BACKEND == "memory":
+        return None
+    if CACHE_BACKEND == "sqlite":
+        logger.info("Using SQLite cache backend at %s", CACHE_SQLITE_PATH)
+        return SQLiteBackend(CACHE_SQLITE_PATH)
+    if CACHE_BACKEND == "redis":
+        logger.info("Using Redis cache backend at %s", CACHE_REDIS_URL)
+        return RedisBackend(CACHE_REDIS_URL)
+    raise ValueError(f"Unknown CACHE_BACKEND: {CACHE_BACKEND} (expected memory, sqlite or redis)")
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Tiered Caches
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+class TieredCache:
+    """
+    A named cache: an optional per-process memory tier in front of an optional
+    shared backend.
+
+    Lookups check memory first and promote shared hits into memory; writes go to
+    both. Backend failures are logged and counted, and treated as misses so a
+    cache outage never fails a request. Keys are namespaced by the cache name.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl_seconds: float,
+        memory: TTLCache | None = None,
+        backend: CacheBackend | None = None,
+    ):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.memory = memory
+        self.backend = backend
+
+    @property
+    def shared(self) -> bool:
+        """Whether entries are visible to other worker processes."""
+        return self.backend is not None
+
+    def _key(self, key: str) -> str:
+        return f"{CACHE_KEY_PREFIX}:{self.name}:{key}"
+
+    def _count(self, tier: str, result: str) -> None:
+        CACHE_REQUESTS.labels(cache=self.name, tier=tier, result=result).inc()
+
+    async def get(self, key: str) -> Any | None:
+        if self.memory is not None:
+            value = self.memory.get(key)
+            self._count("memory", "hit" if value is not None else "miss")
+            if value is not None:
+                return value
+        if self.backend is None:
+            return None
+        try:
+            value = await self.backend.get(self._key(key))
+        except Exception as e:
+            logger.warning("%s cache lookup failed on %s backend: %s", self.name, self.backend.name, e)
+            self._count(self.backend.name, "error")
+            return None
+        self._count(self.backend.name, "hit" if value is not None else "miss")
+        if value is not None and self.memory is not None:
+            self.memory.set(key, value)
+        return value
+
+    async def set(self, key: str, value: Any, ttl_seconds: float | None = None) -> None:
+        ttl_seconds = ttl_seconds or self.ttl_seconds
+        if self.memory is not None:
+            self.memory.set(key, value, ttl_seconds)
+        if self.backend is None:
+            return
+        try:
+            await self.backend.set(self._key(key), value, ttl_seconds)
+        except Exception as e:
+            logger.warning("%s cache write failed on %s backend: %s", self.name, self.backend.name, e)
+
+    async def delete(self, key: str) -> None:
+        if self.memory is not None:
+            self.memory.delete(key)
+        if self.backend is None:
+            return
+        try:
+            await self.backend.delete(self._key(key))
+        except Exception as e:
+            logger.warning("%s cache delete failed on %s backend: %s", self.name, self.backend.name, e)
+
+
+# Cache name -> cache, created on first use
+_caches: Dict[str, TieredCache] = {}
+
+
+def get_cache(name: str, ttl_seconds: float, max_memory_entries: int = 0) -> TieredCache:
+    """
+    Return the singleton cache with the given name.
+
+    Args:
+        name: Cache name, used as the key namespace and the metrics label
+        ttl_seconds: Default time to live of entries
+        max_memory_entries: Size of the per-process memory tier (0 disables it,
+            e.g. for values that change and must be read from the shared backend)
+    """
+    if name not in _caches:
+        memory = TTLCache(max_memory_entries, ttl_seconds) if max_memory_entries > 0 else None
+        _caches[name] = TieredCache(name, ttl_seconds, memory, get_cache_backend())
+    return _caches[name]
+
+
+async def close_caches() -> None:
+    """Close the shared backend's connections."""
+    backend = get_cache_backend() if _caches else None
+    _caches.clear()
+    get_cache_backend.cache_clear()
+    if backend is not None:
+        await backend.close()
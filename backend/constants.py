@@ -1,72 +1,313 @@
 """
 Constants and configuration for the AI Marketing Tool API
+
+Importing this module is cheap and works offline: API keys are only checked and
+provider models only built on first use (or in the startup warmup), and logging
+is configured by the entry point (see logging_config.py).
 """
 
 import os
 import logging
+from functools import lru_cache
 from dotenv import load_dotenv
 
-# Configure logging for this module
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
-# Reduce noise from httpx and other libraries
-logging.getLogger("httpx").setLevel(logging.WARNING)
-logging.getLogger("httpcore").setLevel(logging.WARNING)
-
 # Load environment variables
-logger.info("Loading environment variables from .env file")
 load_dotenv()
-logger.info("Environment variables loaded successfully")
+
 
 # ──────────────────────────────────────────────────────────────────────────────
 # API Keys Configuration
 # ──────────────────────────────────────────────────────────────────────────────
 
-OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-FAL_KEY = os.getenv("FAL_KEY")
 
-if not OPENROUTER_API_KEY:
-    logger.error("OPENROUTER_API_KEY environment variable not found")
-    raise ValueError("OPENROUTER_API_KEY environment variable is required")
-if not FAL_KEY:
-    logger.error("FAL_KEY environment variable not found")
-    raise ValueError("FAL_KEY environment variable is required")
+def _require_env(name: str) -> str:
+    value = os.getenv(name)
+    if not value:
+        logger.error(f"{name} environment variable not found")
+        raise ValueError(f"{name} environment variable is required")
+    return value
+
 
-logger.info("API keys loaded successfully")
-logger.debug(f"OPENROUTER_API_KEY: {OPENROUTER_API_KEY[:10]}..." if OPENROUTER_API_KEY else "OPENROUTER_API_KEY: None")
-logger.debug(f"FAL_KEY: {FAL_KEY[:10]}..." if FAL_KEY else "FAL_KEY: None")
+@lru_cache(maxsize=1)
+def get_openrouter_api_key() -> str:
+    """Return the OpenRouter API key, raising ValueError if it is not configured."""
+    return _require_env("OPENROUTER_API_KEY")
+
+
+@lru_cache(maxsize=1)
+def get_fal_key() -> str:
+    """
+    Return the Fal API key, raising ValueError if it is not configured.
+    fal_client reads the key from the environment on each call.
+    """
+    key = _require_env("FAL_KEY")
+    os.environ["FAL_KEY"] = key
+    return key
 
-# Set API keys as environment variables for pydantic-ai and fal_client
-os.environ["OPENROUTER_API_KEY"] = OPENROUTER_API_KEY
-os.environ["FAL_KEY"] = FAL_KEY
-logger.info("API keys configured for pydantic-ai and fal_client")
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Model Configuration
 # ──────────────────────────────────────────────────────────────────────────────
 
 # OpenRouter configuration via OpenAI-compatible API
-from pydantic_ai.models.openai import OpenAIModel
-
 OPENROUTER_MODEL_NAME = "x-ai/grok-4-fast"
 OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 
-# Create OpenAI-compatible model pointing to OpenRouter (Grok)
-MODEL = OpenAIModel(
-    model_name=OPENROUTER_MODEL_NAME,
-    base_url=OPENROUTER_BASE_URL,
-    api_key=OPENROUTER_API_KEY,
-)
+# Optional fallback model used for hedged and retried text agent calls
+OPENROUTER_FALLBACK_MODEL_NAME = os.getenv("OPENROUTER_FALLBACK_MODEL_NAME")
 
 # Image generation/editing model on Fal
 FAL_IMAGE_MODEL = "fal-ai/nano-banana-pro/edit"
 
-logger.info(f"Configured AI model: OpenRouter ({OPENROUTER_MODEL_NAME})")
-logger.info(f"Configured image generation model: {FAL_IMAGE_MODEL}")
+# Platforms supported by the content generation pipeline, in response order
+PLATFORMS = ("linkedin", "x", "instagram")
+
+
+def _build_openrouter_model(model_name: str):
+    # pydantic-ai is only imported once a model is actually needed
+    from pydantic_ai.models.openai import OpenAIModel
+    from http_clients import get_http_client
+
+    logger.info(f"Building OpenRouter model: {model_name}")
+    return OpenAIModel(
+        model_name=model_name,
+        base_url=OPENROUTER_BASE_URL,
+        api_key=get_openrouter_api_key(),
+        http_client=get_http_client("openrouter"),
+    )
+
+
+@lru_cache(maxsize=1)
+def get_model():
+    """Return the OpenAI-compatible model pointing to OpenRouter (Grok), built on first use."""
+    return _build_openrouter_model(OPENROUTER_MODEL_NAME)
+
+
+@lru_cache(maxsize=1)
+def get_fallback_model():
+    """Return the fallback model, or None when OPENROUTER_FALLBACK_MODEL_NAME is unset."""
+    if not OPENROUTER_FALLBACK_MODEL_NAME:
+        return None
+    return _build_openrouter_model(OPENROUTER_FALLBACK_MODEL_NAME)
+
+
+# Names kept for code that still imports the eagerly built values
+_LAZY_ATTRIBUTES = {
+    "MODEL": get_model,
+    "FALLBACK_MODEL": get_fallback_model,
+    "OPENROUTER_API_KEY": get_openrouter_api_key,
+    "FAL_KEY": get_fal_key,
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Provider Scheduling Configuration
+# ──────────────────────────────────────────────────────────────────────────────
+
+# Per-provider limits for the adaptive scheduler. Concurrency and rate start at
+# their maxima, halve on HTTP 429 and recover additively on success.
+PROVIDER_LIMITS = {
+    "openrouter": {
+        "max_concurrency": int(os.getenv("OPENROUTER_MAX_CONCURRENCY", "24")),
+        "min_concurrency": 2,
+        "max_rate_per_second": float(os.getenv("OPENROUTER_MAX_RATE_PER_SECOND", "10")),
+        "min_rate_per_second": 0.5,
+    },
+    "fal": {
+        "max_concurrency": int(os.getenv("FAL_MAX_CONCURRENCY", "8")),
+        "min_concurrency": 1,
+        "max_rate_per_second": float(os.getenv("FAL_MAX_RATE_PER_SECOND", "4")),
+        "min_rate_per_second": 0.25,
+    },
+}
+
+# Shared keep-alive HTTP client per provider. The pool is sized above the
+# scheduler's concurrency so calls never queue for a connection.
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+HTTP_CONNECT_TIMEOUT_SECONDS = 10.0
+HTTP_KEEPALIVE_EXPIRY_SECONDS = 120.0
+HTTP_CLIENT_LIMITS = {
+    "openrouter": {
+        "max_connections": PROVIDER_LIMITS["openrouter"]["max_concurrency"] * 2,
+        "max_keepalive_connections": PROVIDER_LIMITS["openrouter"]["max_concurrency"],
+        "read_timeout_seconds": 180.0,
+    },
+    "fal": {
+        "max_connections": PROVIDER_LIMITS["fal"]["max_concurrency"] * 4,
+        "max_keepalive_connections": PROVIDER_LIMITS["fal"]["max_concurrency"] * 2,
+        "read_timeout_seconds": 120.0,
+    },
+    # Used by the async Qdrant client (qdrant_client_helper.py). Searches are small
+    # and fast, so a slow one is cut short and the post is generated without examples.
+    "qdrant": {
+        "max_connections": int(os.getenv("QDRANT_MAX_CONNECTIONS", "16")),
+        "max_keepalive_connections": 8,
+        "read_timeout_seconds": float(os.getenv("QDRANT_TIMEOUT_SECONDS", "5")),
+    },
+}
+# How long retrieval trusts its cached collection metadata (existence, vector size
+# and distance) before fetching it again, and how long a missing collection is
+# remembered. A search that finds the collection gone drops the entry at once.
+QDRANT_COLLECTION_INFO_TTL_SECONDS = float(os.getenv("QDRANT_COLLECTION_INFO_TTL_SECONDS", "300"))
+QDRANT_MISSING_COLLECTION_TTL_SECONDS = 30.0
+# When above 0, the per-platform RAG retrievals of one request are sent to Qdrant as
+# one batched search. A platform whose draft is ready waits up to this long for the
+# others, which delays that platform by as much; whoever has not arrived by then is
+# searched separately. Off by default: drafts usually finish seconds apart, so the
+# wait rarely buys a batch (measure with benchmarks/bench_retrieval.py --search).
+RETRIEVAL_BATCH_MAX_WAIT_MS = float(os.getenv("RETRIEVAL_BATCH_MAX_WAIT_MS", "0"))
+# Hosts to open a connection to during startup warmup
+HTTP_WARMUP_URLS = {
+    "openrouter": "https://openrouter.ai/api/v1/models",
+    "fal": "https://queue.fal.run",
+}
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Hedging Configuration
+# ──────────────────────────────────────────────────────────────────────────────
+
+# Hedged text agent calls: when a call is slower than HEDGE_PERCENTILE of recent
+# calls for the same agent, a second request is sent (to FALLBACK_MODEL if set)
+# and whichever finishes first wins.
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "0.95"))
+# Latency samples needed per agent before hedging starts
+HEDGE_MIN_SAMPLES = 20
+# Never hedge earlier than this, however fast recent calls were
+HEDGE_MIN_DELAY_SECONDS = 1.0
+# Upper bound on the fraction of calls that may be hedged (caps the extra spend)
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Image Preprocessing Configuration
+# ──────────────────────────────────────────────────────────────────────────────
+
+# Product images are rotated upright, downscaled and re-encoded before upload
+IMAGE_PREPROCESS_ENABLED = os.getenv("IMAGE_PREPROCESS_ENABLED", "true").lower() in ("1", "true", "yes")
+# Longest edge in pixels after downscaling; larger images gain nothing in the edit model
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "2048"))
+# Output format (a Pillow format name: WEBP, JPEG or PNG) and lossy quality
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "WEBP").upper()
+IMAGE_OUTPUT_QUALITY = int(os.getenv("IMAGE_OUTPUT_QUALITY", "85"))
+# Worker processes for decoding and re-encoding (CPU-bound, so not threads)
+IMAGE_PREPROCESS_WORKERS = int(os.getenv("IMAGE_PREPROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Optional: drop near-duplicate product images and pack the rest into one contact
+# sheet, uploaded once and shared by every platform as its only fal reference
+IMAGE_REFERENCE_SHEET = os.getenv("IMAGE_REFERENCE_SHEET", "false").lower() in ("1", "true", "yes")
+# Images whose 64-bit difference hashes differ in at most this many bits are duplicates
+IMAGE_DEDUPE_MAX_DISTANCE = int(os.getenv("IMAGE_DEDUPE_MAX_DISTANCE", "6"))
+# Longest edge of the contact sheet in pixels
+IMAGE_SHEET_MAX_EDGE = int(os.getenv("IMAGE_SHEET_MAX_EDGE", "2048"))
+# Appended to fal prompts in sheet mode so the grid itself is not reproduced
+REFERENCE_SHEET_PROMPT_NOTE = (
+    "If the reference image is a grid of product photos, treat each tile as a "
+    "separate reference photo of the products and do not reproduce the grid layout."
+)
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Direct Upload Configuration
+# ──────────────────────────────────────────────────────────────────────────────
+
+# Clients may upload product images straight to the Fal CDN and send only URLs.
+# URLs must be https and on one of these hosts (or their subdomains).
+IMAGE_URL_ALLOWED_HOSTS = tuple(
+    host.strip().lower()
+    for host in os.getenv("IMAGE_URL_ALLOWED_HOSTS", "fal.media").split(",")
+    if host.strip()
+)
+# Fal storage endpoint that issues presigned upload URLs, relative to fal_client's
+# REST_URL (the endpoint fal_client's own storage uploads use)
+FAL_UPLOAD_INITIATE_PATH = "/storage/upload/initiate?storage_type=gcs"
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Embedding Configuration
+# ──────────────────────────────────────────────────────────────────────────────
+
+# CPU embedding backend used for retrieval and ingestion (populate_qdrant.py):
+# "hashing" (feature hashing, no extra dependencies) or "fastembed" (ONNX
+# sentence embeddings; needs the fastembed package)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "hashing").lower()
+# Model for the fastembed backend
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5")
+# Vector size of the hashing backend
+EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION", "384"))
+# Worker processes that run the embedder
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "1"))
+# Queries arriving within this window are embedded together, up to the batch size
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+EMBEDDING_MAX_BATCH_SIZE = 32
+# Cache of computed embeddings keyed by text digest, model and dimension, shared
+# by the server and populate_qdrant.py: a bounded in-memory LRU per process in
+# front of a SQLite file of float32 vectors (set EMBEDDING_CACHE_PATH to an
+# empty string to keep it in memory only)
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(".cache", "embeddings.sqlite3"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "4096"))
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Cache Configuration
+# ──────────────────────────────────────────────────────────────────────────────
+
+# Legacy setting: a directory for the upload cache's disk tier. When set and
+# CACHE_BACKEND is not, caches use a SQLite file in this directory.
+UPLOAD_CACHE_DIR = os.getenv("UPLOAD_CACHE_DIR")
+
+# Shared backend behind the per-process memory caches:
+# "memory" (per process only), "sqlite" (shared by the workers on a host) or
+# "redis" (shared across hosts; needs the redis package)
+CACHE_BACKEND = (os.getenv("CACHE_BACKEND") or ("sqlite" if UPLOAD_CACHE_DIR else "memory")).lower()
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH") or os.path.join(UPLOAD_CACHE_DIR or ".cache", "cache.sqlite3")
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+# Prefix of every key in the shared backend, so several deployments can share one Redis
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "viral-spark")
+
+# Content-addressed cache mapping product image digests to Fal CDN URLs
+UPLOAD_CACHE_MAX_ENTRIES = 2048
+UPLOAD_CACHE_TTL_SECONDS = 24 * 60 * 60
+
+# Cache of similar posts retrieved for a (platform, query) pair
+RETRIEVAL_CACHE_MAX_ENTRIES = 512
+RETRIEVAL_CACHE_TTL_SECONDS = 10 * 60
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Job Queue Configuration
+# ──────────────────────────────────────────────────────────────────────────────
+
+# Number of generate jobs processed concurrently by the background workers
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+# Maximum number of jobs waiting for a worker before submissions are rejected
+JOB_MAX_QUEUE_SIZE = int(os.getenv("JOB_MAX_QUEUE_SIZE", "100"))
+# How long finished job results are kept for retrieval
+JOB_RESULT_TTL_SECONDS = 60 * 60
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Batch Configuration
+# ──────────────────────────────────────────────────────────────────────────────
+
+# Campaigns run at once within a batch, unless the request asks for fewer/more
+BATCH_DEFAULT_CONCURRENCY = 4
+# Campaigns running at once across all batches in a process, and so the upper
+# bound on the per-batch concurrency a client may request
+BATCH_MAX_CONCURRENCY = 16
+# Maximum number of campaigns in a single batch request
+BATCH_MAX_ITEMS = 100
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Startup Configuration
+# ──────────────────────────────────────────────────────────────────────────────
+
+# Build models and agents (and check API keys) when the server starts rather than
+# on the first request. Disable for tooling that only needs the app object.
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() in ("1", "true", "yes")
 
 # ──────────────────────────────────────────────────────────────────────────────
 # Agent Configuration
@@ -79,7 +320,17 @@ OUTPUT_VALIDATION_RETRIES = 3
 REQUEST_LIMIT = 50  # Maximum number of requests per agent run
 TOKEN_LIMIT = 100000  # Maximum tokens per agent run
 
-logger.info(f"Agent configuration: OUTPUT_VALIDATION_RETRIES={OUTPUT_VALIDATION_RETRIES}, REQUEST_LIMIT={REQUEST_LIMIT}, TOKEN_LIMIT={TOKEN_LIMIT}")
+# Request deadlines (seconds). Stages still running when the deadline passes are
+# cancelled and the response carries whatever finished.
+GENERATE_DEADLINE_SECONDS = float(os.getenv("GENERATE_DEADLINE_SECONDS", "120"))
+EDIT_DEADLINE_SECONDS = float(os.getenv("EDIT_DEADLINE_SECONDS", "60"))
+MAX_DEADLINE_SECONDS = 300.0  # Upper bound for client-supplied timeouts
+
+# Model prices in USD per million (prompt, completion) tokens, for cost estimates.
+# Runs on models missing here are counted in tokens but not in cost.
+MODEL_PRICES_PER_MTOK = {
+    "x-ai/grok-4-fast": (0.20, 0.50),
+}
 
 # ──────────────────────────────────────────────────────────────────────────────
 # System Prompts - Platform Specific Content Generation
@@ -217,6 +468,8 @@ Always ensure content is:
 
 CONTENT_EDIT_SYSTEM_PROMPT = """You are an expert social media content editor. Your task is to edit and improve existing social media content based on user feedback.
 
+You will receive the current hook, body and outro of a post, and edit instructions from the user. Return the edited hook, body and outro.
+
 Maintain the original platform's constraints (character limits, tone) while implementing the requested changes.
 
 Be creative but stay true to the user's edit instructions. Preserve the core message unless asked to change it.
@@ -419,4 +672,26 @@ Guidelines:
 # Enable/disable RAG functionality
 RAG_ENABLED = True  # Set to False to disable RAG and use regular generation
 
-logger.info(f"RAG functionality: {'ENABLED' if RAG_ENABLED else 'DISABLED'}")
+
+def log_configuration() -> None:
+    """Log the effective configuration; called once at startup."""
+    logger.info(f"Configured AI model: OpenRouter ({OPENROUTER_MODEL_NAME})")
+    logger.info(f"Configured fallback model: {OPENROUTER_FALLBACK_MODEL_NAME or 'none'}")
+    logger.info(f"Configured image generation model: {FAL_IMAGE_MODEL}")
+    logger.info(f"Provider limits: {PROVIDER_LIMITS}")
+    logger.info(f"HTTP clients: http2={HTTP2_ENABLED}, limits={HTTP_CLIENT_LIMITS}")
+    logger.info(f"Hedging: enabled={HEDGE_ENABLED}, percentile={HEDGE_PERCENTILE}, max_ratio={HEDGE_MAX_RATIO}")
+    logger.info(f"Image preprocessing: enabled={IMAGE_PREPROCESS_ENABLED}, max_edge={IMAGE_MAX_EDGE}, format={IMAGE_OUTPUT_FORMAT}, quality={IMAGE_OUTPUT_QUALITY}, workers={IMAGE_PREPROCESS_WORKERS}")
+    logger.info(f"Reference sheet: enabled={IMAGE_REFERENCE_SHEET}, dedupe_max_distance={IMAGE_DEDUPE_MAX_DISTANCE}, max_edge={IMAGE_SHEET_MAX_EDGE}")
+    logger.info(f"Direct image URLs: allowed_hosts={IMAGE_URL_ALLOWED_HOSTS}")
+    logger.info(f"Qdrant collection metadata: ttl={QDRANT_COLLECTION_INFO_TTL_SECONDS}s, missing_ttl={QDRANT_MISSING_COLLECTION_TTL_SECONDS}s")
+    logger.info(f"Retrieval batching: max_wait={RETRIEVAL_BATCH_MAX_WAIT_MS}ms")
+    logger.info(f"Embeddings: backend={EMBEDDING_BACKEND}, model={EMBEDDING_MODEL if EMBEDDING_BACKEND == 'fastembed' else EMBEDDING_DIMENSION}, workers={EMBEDDING_WORKERS}, batch_window={EMBEDDING_BATCH_WINDOW_MS}ms")
+    logger.info(f"Embedding cache: enabled={EMBEDDING_CACHE_ENABLED}, max_entries={EMBEDDING_CACHE_MAX_ENTRIES}, path={EMBEDDING_CACHE_PATH or 'memory only'}")
+    logger.info(f"Cache backend: {CACHE_BACKEND}" + (f" ({CACHE_SQLITE_PATH})" if CACHE_BACKEND == "sqlite" else ""))
+    logger.info(f"Upload cache: max_entries={UPLOAD_CACHE_MAX_ENTRIES}, ttl={UPLOAD_CACHE_TTL_SECONDS}s")
+    logger.info(f"Job queue: workers={JOB_WORKER_CONCURRENCY}, max_queue_size={JOB_MAX_QUEUE_SIZE}, result_ttl={JOB_RESULT_TTL_SECONDS}s")
+    logger.info(f"Agent configuration: OUTPUT_VALIDATION_RETRIES={OUTPUT_VALIDATION_RETRIES}, REQUEST_LIMIT={REQUEST_LIMIT}, TOKEN_LIMIT={TOKEN_LIMIT}")
+    logger.info(f"Request deadlines: generate={GENERATE_DEADLINE_SECONDS}s, edit={EDIT_DEADLINE_SECONDS}s")
+    logger.info(f"RAG functionality: {'ENABLED' if RAG_ENABLED else 'DISABLED'}")
+    logger.info(f"Startup warmup: {'ENABLED' if STARTUP_WARMUP else 'DISABLED'}")
@@ -0,0 +1,75 @@
+"""
+Per-request deadline budgets
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceededError(Exception):
+    """Exception raised when a stage does not finish before the request deadline."""
+    pass
+
+
+async def _cancel_and_wait(task: asyncio.Future) -> None:
+    """Cancel a task and wait for it to finish, discarding its outcome."""
+    task.cancel()
+    await asyncio.wait({task})
+    if not task.cancelled():
+        # It finished (or failed) while being cancelled; mark the exception retrieved
+        task.exception()
+
+
+class Deadline:
+    """
+    An absolute point in time by which a request must finish.
+
+    Created once per request and passed down to every stage, so each stage only
+    gets whatever budget is left rather than a fresh timeout of its own.
+    """
+
+    def __init__(self, budget_seconds: float):
+        self.budget_seconds = budget_seconds
+        self.expires_at = time.monotonic() + budget_seconds
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline (never negative)."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    async def run(self, aw: Awaitable[Any], stage: str = "stage") -> Any:
+        """
+        Await ``aw`` within the remaining budget.
+
+        Only the budget running out becomes DeadlineExceededError; a TimeoutError
+        raised by the stage itself (e.g. a socket or inner wait_for timeout) is
+        re-raised unchanged. A stage that is cancelled (by the deadline or by the
+        caller) is awaited until it has finished unwinding, so its cleanup runs
+        before the error reaches the caller.
+
+        Raises:
+            DeadlineExceededError: If the deadline passes first; the awaitable is cancelled
+        """
+        if self.expired:
+            # Don't start work that cannot finish in time
+            if asyncio.iscoroutine(aw):
+                aw.close()
+            raise DeadlineExceededError(f"{stage} skipped: request deadline of {self.budget_seconds:.0f}s already passed")
+        task = asyncio.ensure_future(aw)
+        try:
+            done, _ = await asyncio.wait({task}, timeout=self.remaining())
+        except asyncio.CancelledError:
+            await _cancel_and_wait(task)
+            raise
+        if not done:
+            await _cancel_and_wait(task)
+            logger.warning("%s cancelled: request deadline of %.0fs exceeded", stage, self.budget_seconds)
+            raise DeadlineExceededError(f"{stage} did not finish within the request deadline of {self.budget_seconds:.0f}s")
+        return task.result()
@@ -0,0 +1,476 @@
+"""
+CPU text embeddings for retrieval and ingestion, batched on a worker pool
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import multiprocessing
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from array import array
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence
+
+from cache import CACHE_REQUESTS
+from constants import (
+    EMBEDDING_BACKEND,
+    EMBEDDING_BATCH_WINDOW_MS,
+    EMBEDDING_CACHE_ENABLED,
+    EMBEDDING_CACHE_MAX_ENTRIES,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_DIMENSION,
+    EMBEDDING_MAX_BATCH_SIZE,
+    EMBEDDING_MODEL,
+    EMBEDDING_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+Vector = List[float]
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Embedders
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+class Embedder(ABC):
+    """A CPU embedding model. Implementations are synchronous and run in worker processes."""
+
+    name: str
+    dimension: int
+
+    @abstractmethod
+    def embed(self, texts: Sequence[str]) -> List[Vector]:
+        """Embed a batch of texts into unit-length vectors."""
+
+
+class HashingEmbedder(Embedder):
+    """
+    Feature-hashing embedder: word unigrams and bigrams hashed into a fixed-size
+    signed vector with log-scaled counts.
+
+    It needs no model download or extra dependency and embeds a post in well
+    under a millisecond. It captures lexical overlap (shared words and phrases)
+    rather than meaning, which is enough to find posts on the same topic.
+    """
+
+    TOKEN_PATTERN = re.compile(r"[\w']+")
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.name = f"hashing-{dimension}"
+
+    def _features(self, text: str) -> Counter:
+        words = self.TOKEN_PATTERN.findall(text.lower())
+        return Counter(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+
+    def _embed_one(self, text: str) -> Vector:
+        vector = [0.0] * self.dimension
+        for feature, count in self._features(text).items():
+            # A stable hash (unlike hash()) so every process and every run agree
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            sign = 1.0 if digest >> 63 else -1.0
+            vector[digest % self.dimension] += sign * (1.0 + math.log(count))
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector] if norm else vector
+
+    def embed(self, texts: Sequence[str]) -> List[Vector]:
+        return [self._embed_one(text) for text in texts]
+
+
+class FastEmbedEmbedder(Embedder):
+    """Sentence embeddings from a small ONNX model via the optional fastembed package."""
+
+    def __init__(self, model_name: str):
+        try:
+            from fastembed import TextEmbedding
+        except ImportError as e:
+            raise RuntimeError("EMBEDDING_BACKEND=fastembed requires the fastembed package (pip install fastembed)") from e
+        self._model = TextEmbedding(model_name=model_name)
+        self.dimension = next(
+            model["dim"] for model in TextEmbedding.list_supported_models() if model["model"] == model_name
+        )
+        self.name = f"fastembed:{model_name}"
+
+    def embed(self, texts: Sequence[str]) -> List[Vector]:
+        return [vector.tolist() for vector in self._model.embed(list(texts), batch_size=EMBEDDING_MAX_BATCH_SIZE)]
+
+
+def create_embedder(backend: str = EMBEDDING_BACKEND) -> Embedder:
+    """Create the embedder selected by EMBEDDING_BACKEND."""
+    if backend == "hashing":
+        return HashingEmbedder(EMBEDDING_DIMENSION)
+    if backend == "fastembed":
+        return FastEmbedEmbedder(EMBEDDING_MODEL)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend} (expected hashing or fastembed)")
+
+
+@lru_cache(maxsize=1)
+def get_local_embedder() -> Embedder:
+    """
+    Return the singleton embedder for this process.
+
+    The server only uses it to read the model name and dimension (and inside the
+    worker processes); scripts such as populate_qdrant.py embed with it directly.
+    """
+    embedder = create_embedder()
+    logger.info("Loaded %s embedder (dimension %s)", embedder.name, embedder.dimension)
+    return embedder
+
+
+def _embed_in_worker(texts: List[str]) -> List[Vector]:
+    return get_local_embedder().embed(texts)
+
+
+def _describe_in_worker() -> tuple[str, int]:
+    embedder = get_local_embedder()
+    return embedder.name, embedder.dimension
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Embedding Cache
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+def text_digest(text: str) -> bytes:
+    """Return the binary SHA-256 digest a text is cached under."""
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingStore:
+    """
+    Embeddings persisted in a local SQLite file, shared by the server workers and
+    populate_qdrant.py.
+
+    Vectors are stored as float32 blobs (1.5 KB for 384 dimensions) under the
+    binary digest of their text and the model they came from. Entries never go
+    stale, since the same text and model always give the same vector; delete the
+    file to reclaim space after switching models. Connections are per thread,
+    in WAL mode, like the SQLite cache backend.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, digest BLOB NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, digest)) WITHOUT ROWID"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, model: str, digests: Sequence[bytes]) -> Dict[bytes, array]:
+        found: Dict[bytes, array] = {}
+        conn = self._connect()
+        # Stay well under SQLite's limit on query parameters
+        for start in range(0, len(digests), 500):
+            chunk = digests[start:start + 500]
+            rows = conn.execute(
+                f"SELECT digest, vector FROM embeddings WHERE model = ? AND digest IN ({', '.join('?' * len(chunk))})",
+                (model, *chunk),
+            )
+            for digest, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[digest] = vector
+        return found
+
+    def put_many(self, model: str, items: Dict[bytes, array]) -> None:
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, digest, vector) VALUES (?, ?, ?)",
+                [(model, digest, vector.tobytes()) for digest, vector in items.items()],
+            )
+
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of one embedding model's vectors: a bounded LRU in
+    memory in front of an optional EmbeddingStore.
+
+    Vectors are held as float32 arrays, a quarter of the memory of lists of
+    Python floats. Lookups and writes are thread-safe, so the server can run
+    the disk tier in a worker thread.
+    """
+
+    def __init__(self, model: str, dimension: int, max_memory_entries: int, store: EmbeddingStore | None = None):
+        self.model = model
+        self.dimension = dimension
+        # The dimension is part of the key, so a resized embedder never reads old vectors
+        self.namespace = f"{model}/{dimension}"
+        self.max_memory_entries = max_memory_entries
+        self.store = store
+        self._memory: OrderedDict[bytes, array] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, digest: bytes, vector: array) -> None:
+        with self._lock:
+            self._memory[digest] = vector
+            self._memory.move_to_end(digest)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def lookup_memory(self, text: str) -> Vector | None:
+        """Return the vector of a text from the memory tier only, or None."""
+        digest = text_digest(text)
+        with self._lock:
+            vector = self._memory.get(digest)
+            if vector is not None:
+                self._memory.move_to_end(digest)
+        CACHE_REQUESTS.labels(cache="embeddings", tier="memory", result="hit" if vector is not None else "miss").inc()
+        return vector.tolist() if vector is not None else None
+
+    def get_many(self, texts: Sequence[str], count_memory: bool = True) -> Dict[str, Vector]:
+        """
+        Return the cached vectors of those texts found in memory or on disk.
+
+        Vectors found on disk are promoted to the memory tier. ``count_memory``
+        is off when the caller already counted the memory lookups.
+        """
+        found: Dict[str, Vector] = {}
+        missing: Dict[bytes, str] = {}
+        with self._lock:
+            for text in texts:
+                digest = text_digest(text)
+                vector = self._memory.get(digest)
+                if vector is None:
+                    missing[digest] = text
+                else:
+                    self._memory.move_to_end(digest)
+                    found[text] = vector.tolist()
+        if count_memory:
+            CACHE_REQUESTS.labels(cache="embeddings", tier="memory", result="hit").inc(len(found))
+            CACHE_REQUESTS.labels(cache="embeddings", tier="memory", result="miss").inc(len(missing))
+
+        if missing and self.store is not None:
+            try:
+                stored = self.store.get_many(self.namespace, list(missing))
+            except sqlite3.Error as e:
+                logger.warning("Embedding store lookup failed, treating as a miss: %s", e)
+                stored = {}
+            for digest, vector in stored.items():
+                self._remember(digest, vector)
+                found[missing[digest]] = vector.tolist()
+            CACHE_REQUESTS.labels(cache="embeddings", tier="sqlite", result="hit").inc(len(stored))
+            CACHE_REQUESTS.labels(cache="embeddings", tier="sqlite", result="miss").inc(len(missing) - len(stored))
+        return found
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Vector]) -> None:
+        """Cache freshly computed vectors in memory and on disk."""
+        items = {}
+        for text, vector in zip(texts, vectors):
+            if len(vector) != self.dimension:
+                logger.warning("Not caching a %s-dimension vector under %s", len(vector), self.namespace)
+                continue
+            items[text_digest(text)] = array("f", vector)
+        for digest, vector in items.items():
+            self._remember(digest, vector)
+        if items and self.store is not None:
+            try:
+                self.store.put_many(self.namespace, items)
+            except sqlite3.Error as e:
+                logger.warning("Embedding store write failed: %s", e)
+
+    def embed(self, texts: Sequence[str], embed_fn: Callable[[List[str]], List[Vector]]) -> List[Vector]:
+        """Embed texts synchronously, calling ``embed_fn`` only for the distinct texts not cached yet."""
+        found = self.get_many(texts)
+        missing = [text for text in dict.fromkeys(texts) if text not in found]
+        if missing:
+            vectors = embed_fn(missing)
+            self.put_many(missing, vectors)
+            found.update(zip(missing, vectors))
+        logger.debug("Embedded %s texts, %s from the cache", len(missing), len(texts) - len(missing))
+        return [found[text] for text in texts]
+
+
+@lru_cache(maxsize=None)
+def get_embedding_cache(model: str, dimension: int) -> EmbeddingCache | None:
+    """
+    Return this process's embedding cache for a model, or None when
+    EMBEDDING_CACHE_ENABLED is off.
+
+    Every model gets its own memory tier; all of them share the store at
+    EMBEDDING_CACHE_PATH. A store that cannot be opened leaves the cache in
+    memory only.
+    """
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    store = None
+    if EMBEDDING_CACHE_PATH:
+        try:
+            store = EmbeddingStore(EMBEDDING_CACHE_PATH)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Could not open the embedding store at %s, caching in memory only: %s", EMBEDDING_CACHE_PATH, e)
+    return EmbeddingCache(model, dimension, EMBEDDING_CACHE_MAX_ENTRIES, store)
+
+
+def embed_texts(texts: Sequence[str]) -> List[Vector]:
+    """
+    Embed texts in this process through the embedding cache.
+
+    Used by scripts such as populate_qdrant.py, so re-running ingestion only
+    embeds posts that changed, and reuses vectors the server already computed.
+    """
+    embedder = get_local_embedder()
+    cache = get_embedding_cache(embedder.name, embedder.dimension)
+    if cache is None:
+        return embedder.embed(texts)
+    return cache.embed(texts, embedder.embed)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Worker Pool and Micro-batching
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+@lru_cache(maxsize=1)
+def get_embedding_pool() -> ProcessPoolExecutor:
+    """
+    Return the singleton process pool that runs the embedder.
+
+    Embedding is CPU-bound, so it runs outside the event loop's process. Each
+    worker loads the model once, on its first batch. Workers are spawned rather
+    than forked, for the same reason as the image pool.
+    """
+    logger.info("Starting embedding pool with %s workers", EMBEDDING_WORKERS)
+    return ProcessPoolExecutor(
+        max_workers=EMBEDDING_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+def shutdown_embedding_pool() -> None:
+    """Stop the embedding workers if the pool was started."""
+    if get_embedding_pool.cache_info().currsize:
+        get_embedding_pool().shutdown(cancel_futures=True)
+        get_embedding_pool.cache_clear()
+
+
+class EmbeddingBatcher:
+    """
+    Collects embedding requests for a short window and sends them to the worker
+    pool as one batch.
+
+    The three per-platform retrievals of a /generate request (and those of
+    concurrent requests) arrive within milliseconds of each other, so they cost
+    one round trip to a worker instead of three. Texts already in the embedding
+    cache are answered from memory without waiting for the window, or from disk
+    before the batch goes to the worker.
+    """
+
+    def __init__(self, max_batch_size: int, window_seconds: float, use_cache: bool = EMBEDDING_CACHE_ENABLED):
+        self.max_batch_size = max_batch_size
+        self.window_seconds = window_seconds
+        self.use_cache = use_cache
+        self._cache: EmbeddingCache | None = None
+        self._cache_lock = asyncio.Lock()
+        self._pending: list[tuple[str, asyncio.Future]] = []
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def embed_many(self, texts: Sequence[str]) -> List[Vector]:
+        """Embed texts, batched with any other requests made within the window."""
+        loop = asyncio.get_running_loop()
+        results: List[Vector | None] = [None] * len(texts)
+        if self._cache is not None:
+            results = [self._cache.lookup_memory(text) for text in texts]
+        futures = []
+        for text, result in zip(texts, results):
+            if result is None:
+                future = loop.create_future()
+                self._pending.append((text, future))
+                futures.append(future)
+        if not futures:
+            return results
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window_seconds, self._flush)
+        embedded = iter(await asyncio.gather(*futures))
+        return [result if result is not None else next(embedded) for result in results]
+
+    async def embed(self, text: str) -> Vector:
+        """Embed a single text."""
+        return (await self.embed_many([text]))[0]
+
+    async def _get_cache(self, pool: ProcessPoolExecutor) -> EmbeddingCache | None:
+        if not self.use_cache:
+            return None
+        async with self._cache_lock:
+            if self._cache is None:
+                # Key the cache by what the workers actually load, without loading the model here
+                loop = asyncio.get_running_loop()
+                model, dimension = await loop.run_in_executor(pool, _describe_in_worker)
+                self._cache = await asyncio.to_thread(get_embedding_cache, model, dimension)
+        return self._cache
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._pending:
+            batch = self._pending[:self.max_batch_size]
+            self._pending = self._pending[self.max_batch_size:]
+            task = asyncio.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[str, asyncio.Future]]) -> None:
+        # Identical texts (e.g. the same draft for two requests) are embedded once
+        unique_texts = list(dict.fromkeys(text for text, _ in batch))
+        pool = get_embedding_pool()
+        try:
+            cache = await self._get_cache(pool)
+            # These texts already missed the memory tier in embed_many (unless cached since)
+            by_text = await asyncio.to_thread(cache.get_many, unique_texts, False) if cache is not None else {}
+            missing = [text for text in unique_texts if text not in by_text]
+            if missing:
+                loop = asyncio.get_running_loop()
+                vectors = await loop.run_in_executor(pool, _embed_in_worker, missing)
+                by_text.update(zip(missing, vectors))
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # A worker died (e.g. killed for memory); the pool refuses all further
+                # work, so start a fresh one for the next batch. Other batches that hit
+                # the same broken pool must not drop a pool started since.
+                logger.error("Embedding pool failed, replacing it: %s", e)
+                if get_embedding_pool.cache_info().currsize and get_embedding_pool() is pool:
+                    get_embedding_pool.cache_clear()
+            logger.error("Embedding batch of %s texts failed: %s", len(unique_texts), e)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+        logger.debug("Embedded batch of %s texts (%s requests, %s cached)", len(missing), len(batch), len(unique_texts) - len(missing))
+        if missing and cache is not None:
+            # Callers already have their vectors; the disk write happens after
+            await asyncio.to_thread(cache.put_many, missing, vectors)
+
+
+@lru_cache(maxsize=1)
+def get_embedder() -> EmbeddingBatcher:
+    """Return the singleton batching embedder used by the retrieval path."""
+    return EmbeddingBatcher(EMBEDDING_MAX_BATCH_SIZE, EMBEDDING_BATCH_WINDOW_MS / 1000)
@@ -0,0 +1,184 @@
+"""
+Hedged requests for text agent calls
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Deque, Dict
+
+from prometheus_client import Counter
+
+from constants import (
+    HEDGE_MAX_RATIO,
+    HEDGE_MIN_DELAY_SECONDS,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_PERCENTILE,
+    get_fallback_model,
+)
+
+logger = logging.getLogger(__name__)
+
+HEDGE_CALLS = Counter(
+    "viral_spark_hedge_calls_total",
+    "Agent calls made through the hedger",
+    ["key"],
+)
+
+HEDGE_ATTEMPTS = Counter(
+    "viral_spark_hedge_attempts_total",
+    "Extra attempts started by the hedger, by kind (hedge or fallback)",
+    ["key", "kind"],
+)
+
+HEDGE_WINS = Counter(
+    "viral_spark_hedge_wins_total",
+    "Calls whose hedge finished before the primary attempt",
+    ["key"],
+)
+
+HEDGE_CANCELLED = Counter(
+    "viral_spark_hedge_cancelled_total",
+    "Attempts cancelled because another attempt of the same call finished first",
+    ["key", "attempt"],
+)
+
+
+class Hedger:
+    """
+    Send a backup request when a call runs past the usual latency for its key.
+
+    Latencies of recent calls are tracked per key (one key per agent). Once a key
+    has enough samples, a call still running after the configured percentile gets
+    a second attempt, made with the fallback model when one is configured. The
+    first attempt to succeed wins and the other is cancelled. If the primary
+    attempt fails before it was hedged and a fallback model is configured, the
+    fallback is tried straight away.
+
+    Hedges are capped at ``max_ratio`` of all calls so a provider-wide slowdown
+    cannot double the load on it. Calls, extra attempts, hedge wins and
+    cancelled losers are counted per key on /metrics.
+    """
+
+    def __init__(
+        self,
+        percentile: float,
+        min_samples: int,
+        min_delay_seconds: float,
+        max_ratio: float,
+        fallback_model: Any = None,
+        window_size: int = 200,
+    ):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay_seconds = min_delay_seconds
+        self.max_ratio = max_ratio
+        self.fallback_model = fallback_model
+        self.window_size = window_size
+
+        self._latencies: Dict[str, Deque[float]] = {}
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+
+    def hedge_delay(self, key: str) -> float | None:
+        """Return how long to wait before hedging a call for ``key``, or None if it should not be hedged."""
+        samples = self._latencies.get(key)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(self.percentile * len(ordered)))
+        return max(self.min_delay_seconds, ordered[index])
+
+    def _record(self, key: str, seconds: float) -> None:
+        samples = self._latencies.setdefault(key, deque(maxlen=self.window_size))
+        samples.append(seconds)
+
+    def _within_budget(self) -> bool:
+        return self.hedges < self.max_ratio * self.calls
+
+    async def run(self, key: str, call: Callable[[Any], Awaitable[Any]]) -> Any:
+        """
+        Run ``call(model)`` with hedging.
+
+        Args:
+            key: Latency tracking key, e.g. the agent's name
+            call: Makes one attempt; receives None for the agent's own model or the fallback model
+
+        Returns:
+            The result of the first attempt to succeed
+        """
+        self.calls += 1
+        HEDGE_CALLS.labels(key=key).inc()
+        delay = self.hedge_delay(key)
+        start = time.monotonic()
+        primary = asyncio.create_task(call(None))
+        attempts = {primary: "primary"}
+        pending = {primary}
+        hedged = False
+        error: BaseException | None = None
+
+        try:
+            while pending:
+                timeout = None
+                if not hedged and delay is not None:
+                    timeout = max(0.0, start + delay - time.monotonic())
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    hedged = True
+                    if self._within_budget():
+                        self.hedges += 1
+                        HEDGE_ATTEMPTS.labels(key=key, kind="hedge").inc()
+                        logger.info("Hedging %s: no response after %.1fs", key, delay)
+                        hedge = asyncio.create_task(call(self.fallback_model))
+                        attempts[hedge] = "hedge"
+                        pending.add(hedge)
+                    continue
+
+                for task in done:
+                    if task.exception() is None:
+                        elapsed = time.monotonic() - start
+                        if attempts[task] == "hedge":
+                            self.hedge_wins += 1
+                            HEDGE_WINS.labels(key=key).inc()
+                            logger.info("Hedge won for %s after %.1fs (%s/%s hedges won, %s calls)",
+                                        key, elapsed, self.hedge_wins, self.hedges, self.calls)
+                        if attempts[task] != "fallback":
+                            # When the hedge wins this is a lower bound on the primary's latency;
+                            # recording it keeps the percentile from drifting down as slow
+                            # primaries get cancelled
+                            self._record(key, elapsed)
+                        return task.result()
+                    error = error or task.exception()
+                    if attempts[task] == "primary" and not hedged and self.fallback_model is not None:
+                        hedged = True
+                        self.fallbacks += 1
+                        HEDGE_ATTEMPTS.labels(key=key, kind="fallback").inc()
+                        logger.warning("%s failed (%s), retrying with fallback model", key, task.exception())
+                        fallback = asyncio.create_task(call(self.fallback_model))
+                        attempts[fallback] = "fallback"
+                        pending.add(fallback)
+            raise error
+        finally:
+            for task, attempt in attempts.items():
+                if not task.done():
+                    HEDGE_CANCELLED.labels(key=key, attempt=attempt).inc()
+                    task.cancel()
+
+
+@lru_cache(maxsize=1)
+def get_hedger() -> Hedger:
+    """Return the singleton hedger for text agent calls."""
+    logger.info("Initializing hedger (percentile=%s, max_ratio=%s)", HEDGE_PERCENTILE, HEDGE_MAX_RATIO)
+    return Hedger(
+        percentile=HEDGE_PERCENTILE,
+        min_samples=HEDGE_MIN_SAMPLES,
+        min_delay_seconds=HEDGE_MIN_DELAY_SECONDS,
+        max_ratio=HEDGE_MAX_RATIO,
+        fallback_model=get_fallback_model(),
+    )
+
@@ -0,0 +1,125 @@
+"""
+Shared pooled HTTP clients for OpenRouter and Fal
+"""
+
+import asyncio
+import importlib.util
+import logging
+import sys
+import time
+from functools import cached_property, lru_cache
+from typing import Dict
+
+import httpx
+
+from constants import (
+    HTTP2_ENABLED,
+    HTTP_CLIENT_LIMITS,
+    HTTP_CONNECT_TIMEOUT_SECONDS,
+    HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    HTTP_WARMUP_URLS,
+    get_fal_key,
+    get_fallback_model,
+    get_model,
+)
+
+logger = logging.getLogger(__name__)
+
+# Provider name -> shared client, created on first use
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _http2_available() -> bool:
+    # httpx only speaks HTTP/2 when the optional h2 package is installed
+    return HTTP2_ENABLED and importlib.util.find_spec("h2") is not None
+
+
+def get_http_client(provider: str) -> httpx.AsyncClient:
+    """
+    Return the singleton keep-alive HTTP client for a provider.
+
+    One client per provider means every agent run (or Fal call) reuses warm
+    connections instead of paying a TLS handshake, and with HTTP/2 many
+    concurrent calls share a single connection.
+    """
+    if provider in _clients:
+        return _clients[provider]
+    if provider not in HTTP_CLIENT_LIMITS:
+        raise ValueError(f"Unknown provider: {provider}")
+    config = HTTP_CLIENT_LIMITS[provider]
+    http2 = _http2_available()
+    logger.info("Creating %s HTTP client (http2=%s, max_connections=%s)", provider, http2, config["max_connections"])
+    headers = {"Authorization": f"Key {get_fal_key()}"} if provider == "fal" else None
+    _clients[provider] = httpx.AsyncClient(
+        http2=http2,
+        headers=headers,
+        limits=httpx.Limits(
+            max_connections=config["max_connections"],
+            max_keepalive_connections=config["max_keepalive_connections"],
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        timeout=httpx.Timeout(config["read_timeout_seconds"], connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+    )
+    return _clients[provider]
+
+
+@lru_cache(maxsize=1)
+def get_fal_client():
+    """
+    Return the singleton Fal async client, backed by the shared Fal HTTP client.
+
+    fal_client builds its own httpx client lazily in the ``_client`` cached
+    property; seeding that property makes every submit, status poll and upload go
+    through the shared pool. That property is private, so requirements.txt pins
+    the fal-client version this was checked against.
+    """
+    import fal_client
+
+    client = fal_client.AsyncClient(key=get_fal_key())
+    if isinstance(getattr(type(client), "_client", None), cached_property):
+        client.__dict__["_client"] = get_http_client("fal")
+    else:
+        logger.warning(
+            "fal_client %s has no _client property to seed (pinned version is in requirements.txt); "
+            "Fal calls use their own connection pool",
+            getattr(fal_client, "__version__", "?"),
+        )
+    return client
+
+
+async def warmup_http_clients() -> None:
+    """
+    Open a connection to each provider so the first request skips DNS and the
+    TLS handshake. Failures are logged, not raised: the server can still start
+    and connect on first use.
+    """
+    async def warm(provider: str, url: str) -> None:
+        start = time.perf_counter()
+        try:
+            await get_http_client(provider).head(url)
+            logger.info("Warmed up %s connection in %.0f ms", provider, (time.perf_counter() - start) * 1000)
+        except httpx.HTTPError as e:
+            logger.warning("Could not warm up %s connection: %s", provider, e)
+
+    await asyncio.gather(*(warm(provider, url) for provider, url in HTTP_WARMUP_URLS.items()))
+
+
+async def close_http_clients() -> None:
+    """
+    Close the shared HTTP clients that have been created.
+
+    The Fal client, the OpenRouter models and the agents built on them hold
+    these clients, so their caches are cleared too: anything used after this
+    (e.g. by a later lifespan in the same process) is rebuilt on new clients
+    instead of failing on a closed one.
+    """
+    clients = list(_clients.values())
+    _clients.clear()
+    get_fal_client.cache_clear()
+    get_model.cache_clear()
+    get_fallback_model.cache_clear()
+    # Agents import this module, so they are only reached once they have been loaded
+    agents = sys.modules.get("agents")
+    if agents is not None:
+        agents.clear_agents()
+    await asyncio.gather(*(client.aclose() for client in clients))
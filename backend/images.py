@@ -0,0 +1,323 @@
+"""
+Product image preprocessing: EXIF rotation, downscaling and re-encoding before upload
+"""
+
+import asyncio
+import io
+import logging
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Sequence
+
+from prometheus_client import Counter
+
+from constants import (
+    IMAGE_DEDUPE_MAX_DISTANCE,
+    IMAGE_MAX_EDGE,
+    IMAGE_OUTPUT_FORMAT,
+    IMAGE_OUTPUT_QUALITY,
+    IMAGE_PREPROCESS_ENABLED,
+    IMAGE_PREPROCESS_WORKERS,
+    IMAGE_SHEET_MAX_EDGE,
+)
+from metrics import span
+
+logger = logging.getLogger(__name__)
+
+IMAGE_BYTES = Counter(
+    "viral_spark_image_bytes_total",
+    "Product image bytes received and uploaded after preprocessing",
+    ["kind"],
+)
+
+CONTENT_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg", "PNG": "image/png"}
+
+
+@dataclass
+class PreparedImage:
+    """Image bytes ready for upload."""
+    data: bytes
+    content_type: str
+    original_size: int
+    width: int | None = None
+    height: int | None = None
+    processed: bool = False
+
+    @property
+    def saved_bytes(self) -> int:
+        return self.original_size - len(self.data)
+
+
+@dataclass
+class ReferenceSheet:
+    """Deduplicated product images, packed into one contact sheet when more than one remains."""
+    kept: List[int] = field(default_factory=list)
+    data: bytes | None = None
+    content_type: str | None = None
+
+
+def preprocess_variant() -> str:
+    """
+    Return a tag for the current preprocessing settings.
+
+    Upload cache keys include it, so changing the settings never serves a URL
+    produced with the old ones.
+    """
+    if not IMAGE_PREPROCESS_ENABLED:
+        return "original"
+    return f"{IMAGE_OUTPUT_FORMAT.lower()}-{IMAGE_MAX_EDGE}-q{IMAGE_OUTPUT_QUALITY}"
+
+
+def preprocess_image_bytes(
+    data: bytes,
+    content_type: str,
+    max_edge: int,
+    output_format: str,
+    quality: int,
+) -> PreparedImage:
+    """
+    Rotate image bytes upright, downscale them to ``max_edge`` and re-encode them.
+
+    Runs in a worker process. Metadata (including EXIF location) is dropped. The
+    original bytes are kept when Pillow cannot decode them (e.g. HEIC without a
+    plugin), or when they need no rotation or downscaling and re-encoding would
+    not make them smaller.
+
+    Args:
+        data: Original image bytes
+        content_type: Content type of the original bytes
+        max_edge: Longest edge of the output in pixels
+        output_format: Pillow format name (WEBP, JPEG or PNG)
+        quality: Quality for lossy formats
+
+    Returns:
+        The prepared image
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            original_size = image.size
+            # Let the JPEG decoder skip straight to a nearby scale instead of decoding every pixel
+            image.draft("RGB", (max_edge, max_edge))
+            oriented = ImageOps.exif_transpose(image)
+            rotated = oriented.size != original_size or image.getexif().get(0x0112, 1) != 1
+
+            has_alpha = oriented.mode in ("RGBA", "LA") or (oriented.mode == "P" and "transparency" in oriented.info)
+            mode = "RGBA" if has_alpha and output_format != "JPEG" else "RGB"
+            if oriented.mode != mode:
+                oriented = oriented.convert(mode)
+
+            oriented.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+            resized = max(original_size) > max_edge
+
+            buffer = io.BytesIO()
+            if output_format == "PNG":
+                oriented.save(buffer, format="PNG", optimize=True)
+            else:
+                oriented.save(buffer, format=output_format, quality=quality, optimize=True)
+            width, height = oriented.size
+    except (UnidentifiedImageError, OSError) as e:
+        logger.warning("Could not preprocess %s image, uploading it unchanged: %s", content_type, e)
+        return PreparedImage(data=data, content_type=content_type, original_size=len(data))
+
+    encoded = buffer.getvalue()
+    if not (rotated or resized) and len(encoded) >= len(data):
+        return PreparedImage(data=data, content_type=content_type, original_size=len(data), width=width, height=height)
+    return PreparedImage(
+        data=encoded,
+        content_type=CONTENT_TYPES.get(output_format, f"image/{output_format.lower()}"),
+        original_size=len(data),
+        width=width,
+        height=height,
+        processed=True,
+    )
+
+
+def difference_hash(image, hash_size: int = 8) -> int:
+    """
+    Return the 64-bit difference hash (dHash) of a Pillow image.
+
+    Each bit says whether a pixel of a tiny grayscale thumbnail is brighter than
+    its right neighbour, so re-encoded, resized or slightly retouched copies of a
+    photo hash to (nearly) the same value.
+    """
+    from PIL import Image
+
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            offset = row * (hash_size + 1) + col
+            bits = (bits << 1) | (pixels[offset] > pixels[offset + 1])
+    return bits
+
+
+def build_reference_sheet(
+    images: Sequence[bytes],
+    max_distance: int,
+    sheet_edge: int,
+    output_format: str,
+    quality: int,
+) -> ReferenceSheet | None:
+    """
+    Drop near-duplicate images and tile the rest into one contact sheet.
+
+    Runs in a worker process. Images are rotated upright and fitted into equal
+    square cells on a white background, in upload order.
+
+    Args:
+        images: Original image bytes, in upload order
+        max_distance: Largest dHash distance (in bits) at which two images are duplicates
+        sheet_edge: Longest edge of the sheet in pixels
+        output_format: Pillow format name of the sheet
+        quality: Quality for lossy formats
+
+    Returns:
+        The indices of the kept images and, if more than one was kept, the encoded
+        sheet; None if any image could not be decoded
+    """
+    from PIL import Image, ImageOps, UnidentifiedImageError
+
+    decoded = []
+    hashes: List[int] = []
+    kept: List[int] = []
+    try:
+        for idx, data in enumerate(images):
+            with Image.open(io.BytesIO(data)) as image:
+                image.draft("RGB", (sheet_edge, sheet_edge))
+                oriented = ImageOps.exif_transpose(image)
+                oriented.load()
+            image_hash = difference_hash(oriented)
+            if any(bin(image_hash ^ other).count("1") <= max_distance for other in hashes):
+                continue
+            hashes.append(image_hash)
+            kept.append(idx)
+            decoded.append(oriented)
+    except (UnidentifiedImageError, OSError) as e:
+        logger.warning("Could not decode product image for the reference sheet: %s", e)
+        return None
+
+    if len(decoded) < 2:
+        return ReferenceSheet(kept=kept)
+
+    columns = math.ceil(math.sqrt(len(decoded)))
+    rows = math.ceil(len(decoded) / columns)
+    cell = sheet_edge // columns
+    gap = max(4, cell // 64)
+    sheet = Image.new("RGB", (columns * cell, rows * cell), "white")
+    for position, image in enumerate(decoded):
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+        else:
+            image = image.convert("RGB")
+        image.thumbnail((cell - 2 * gap, cell - 2 * gap), Image.Resampling.LANCZOS)
+        row, column = divmod(position, columns)
+        x = column * cell + (cell - image.width) // 2
+        y = row * cell + (cell - image.height) // 2
+        sheet.paste(image, (x, y), image if image.mode == "RGBA" else None)
+
+    buffer = io.BytesIO()
+    if output_format == "PNG":
+        sheet.save(buffer, format="PNG", optimize=True)
+    else:
+        sheet.save(buffer, format=output_format, quality=quality, optimize=True)
+    return ReferenceSheet(
+        kept=kept,
+        data=buffer.getvalue(),
+        content_type=CONTENT_TYPES.get(output_format, f"image/{output_format.lower()}"),
+    )
+
+
+@lru_cache(maxsize=1)
+def get_image_pool() -> ProcessPoolExecutor:
+    """
+    Return the singleton process pool for image preprocessing.
+
+    Decoding and re-encoding are CPU-bound, so they run in separate processes to
+    keep the event loop and the GIL free. Workers are spawned rather than forked,
+    since forking a process with running threads (the logging listener, thread
+    pools) can deadlock the child.
+    """
+    logger.info("Starting image preprocessing pool with %s workers", IMAGE_PREPROCESS_WORKERS)
+    return ProcessPoolExecutor(
+        max_workers=IMAGE_PREPROCESS_WORKERS,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+def shutdown_image_pool() -> None:
+    """Stop the preprocessing workers if the pool was started."""
+    if get_image_pool.cache_info().currsize:
+        get_image_pool().shutdown(cancel_futures=True)
+        get_image_pool.cache_clear()
+
+
+async def prepare_image(data: bytes, content_type: str, filename: str | None = None) -> PreparedImage:
+    """
+    Preprocess image bytes for upload on the worker pool.
+
+    Falls back to the original bytes when preprocessing is disabled or the pool
+    has died (e.g. a worker was killed for using too much memory).
+    """
+    IMAGE_BYTES.labels(kind="original").inc(len(data))
+    prepared = PreparedImage(data=data, content_type=content_type, original_size=len(data))
+    if IMAGE_PREPROCESS_ENABLED:
+        with span("preprocess"):
+            loop = asyncio.get_running_loop()
+            try:
+                prepared = await loop.run_in_executor(
+                    get_image_pool(),
+                    preprocess_image_bytes,
+                    data,
+                    content_type,
+                    IMAGE_MAX_EDGE,
+                    IMAGE_OUTPUT_FORMAT,
+                    IMAGE_OUTPUT_QUALITY,
+                )
+            except BrokenProcessPool as e:
+                logger.error("Image preprocessing pool failed, uploading %s unchanged: %s", filename, e)
+                get_image_pool.cache_clear()
+        if prepared.processed:
+            logger.info(
+                "Preprocessed %s: %s -> %s bytes (%sx%s %s)",
+                filename, prepared.original_size, len(prepared.data), prepared.width, prepared.height, prepared.content_type,
+            )
+    IMAGE_BYTES.labels(kind="uploaded").inc(len(prepared.data))
+    return prepared
+
+
+async def prepare_reference_sheet(images: Sequence[bytes]) -> ReferenceSheet | None:
+    """
+    Deduplicate product images and pack them into a contact sheet on the worker pool.
+
+    Returns None when the sheet cannot be built, in which case callers should use
+    the individual images.
+    """
+    with span("reference_sheet"):
+        loop = asyncio.get_running_loop()
+        try:
+            sheet = await loop.run_in_executor(
+                get_image_pool(),
+                build_reference_sheet,
+                list(images),
+                IMAGE_DEDUPE_MAX_DISTANCE,
+                IMAGE_SHEET_MAX_EDGE,
+                IMAGE_OUTPUT_FORMAT,
+                IMAGE_OUTPUT_QUALITY,
+            )
+        except BrokenProcessPool as e:
+            logger.error("Image preprocessing pool failed, skipping the reference sheet: %s", e)
+            get_image_pool.cache_clear()
+            return None
+    if sheet is not None:
+        logger.info(
+            "Reference sheet: kept %s of %s images%s",
+            len(sheet.kept), len(images), f" ({len(sheet.data)} bytes)" if sheet.data else "",
+        )
+    return sheet
@@ -0,0 +1,235 @@
+"""
+In-process background job queue with a bounded worker pool
+
+Jobs run on the worker process that accepted them. With a shared cache backend
+(see cache.py) each job's state is also published there, so any worker can
+answer status and result polls.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from enum import Enum
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict
+
+from cache import TieredCache, get_cache
+from constants import JOB_MAX_QUEUE_SIZE, JOB_RESULT_TTL_SECONDS, JOB_WORKER_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+
+class JobStatus(str, Enum):
+    """Lifecycle states of a background job."""
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Exception raised when a job is submitted while the queue is at capacity."""
+    pass
+
+
+@dataclass
+class Job:
+    """A unit of background work and its outcome."""
+    id: str
+    fn: Callable[[], Awaitable[Any]] = field(repr=False)
+    status: JobStatus = JobStatus.QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    result: Any = None
+    error: str | None = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (JobStatus.SUCCEEDED, JobStatus.FAILED)
+
+    def snapshot(self) -> dict:
+        """Return the job's state as a JSON-serializable dict."""
+        result = self.result
+        if hasattr(result, "model_dump"):
+            result = result.model_dump(mode="json")
+        return {
+            "id": self.id,
+            "status": self.status.value,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": result,
+            "error": self.error,
+        }
+
+    @classmethod
+    def from_snapshot(cls, data: dict) -> "Job":
+        """Rebuild a (read-only) job published by another worker."""
+        return cls(
+            id=data["id"],
+            fn=None,
+            status=JobStatus(data["status"]),
+            created_at=data["created_at"],
+            started_at=data["started_at"],
+            finished_at=data["finished_at"],
+            result=data["result"],
+            error=data["error"],
+        )
+
+
+class JobManager:
+    """
+    Runs submitted jobs on a fixed number of worker tasks.
+
+    The queue is bounded: once ``max_queue_size`` jobs are waiting, further
+    submissions are rejected with QueueFullError so callers can shed load instead
+    of piling up work the workers cannot reach. Finished jobs are kept for
+    ``result_ttl_seconds`` so clients can fetch their results.
+
+    When ``store`` is shared across processes, every state change is written to
+    it and ``lookup`` falls back to it for jobs owned by other workers.
+    """
+
+    def __init__(
+        self,
+        concurrency: int,
+        max_queue_size: int,
+        result_ttl_seconds: float,
+        store: TieredCache | None = None,
+    ):
+        self.concurrency = concurrency
+        self.max_queue_size = max_queue_size
+        self.result_ttl_seconds = result_ttl_seconds
+        self.store = store if store is not None and store.shared else None
+        self._jobs: Dict[str, Job] = {}
+        # Job id -> write of its QUEUED snapshot, which the worker waits for
+        self._queued_publishes: Dict[str, asyncio.Task] = {}
+        self._queue: asyncio.Queue[Job] | None = None
+        self._workers: list[asyncio.Task] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    @property
+    def queued(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self) -> None:
+        """Start the worker tasks on the running event loop."""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._workers = [
+            asyncio.create_task(self._worker(idx), name=f"job-worker-{idx}")
+            for idx in range(self.concurrency)
+        ]
+        logger.info("Started %s job workers (max queue size: %s)", self.concurrency, self.max_queue_size)
+
+    async def stop(self) -> None:
+        """Cancel the worker tasks; jobs still running are marked as failed."""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("Stopped job workers")
+
+    async def submit(self, fn: Callable[[], Awaitable[Any]]) -> Job:
+        """
+        Queue a coroutine function for background execution.
+
+        With a shared store, returns once the QUEUED snapshot is written, so the
+        job id handed to the client can be looked up from any process. The
+        worker waits for that write before publishing RUNNING, so the stale
+        QUEUED state can never overwrite it.
+
+        Raises:
+            QueueFullError: If the queue is at capacity
+            RuntimeError: If the workers have not been started
+        """
+        if not self.running:
+            raise RuntimeError("Job workers are not running")
+        self._evict_expired()
+
+        job = Job(id=uuid.uuid4().hex, fn=fn)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            logger.warning("Job queue full (%s queued), rejecting submission", self.max_queue_size)
+            raise QueueFullError(f"Job queue is full ({self.max_queue_size} jobs waiting)")
+        self._jobs[job.id] = job
+        logger.info("Queued job %s (%s waiting)", job.id, self.queued)
+        if self.store is not None:
+            task = asyncio.create_task(self._publish(job))
+            self._queued_publishes[job.id] = task
+            task.add_done_callback(lambda t, job_id=job.id: self._queued_publishes.pop(job_id, None))
+            # Shielded: a caller that goes away must not cancel the write the worker waits for
+            await asyncio.shield(task)
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        """Return a job owned by this process by id, or None if it is unknown or has expired."""
+        self._evict_expired()
+        return self._jobs.get(job_id)
+
+    async def lookup(self, job_id: str) -> Job | None:
+        """Return a job by id from this process or, failing that, the shared store."""
+        job = self.get(job_id)
+        if job is not None or self.store is None:
+            return job
+        data = await self.store.get(job_id)
+        return Job.from_snapshot(data) if data is not None else None
+
+    async def _publish(self, job: Job) -> None:
+        if self.store is not None:
+            await self.store.set(job.id, job.snapshot(), self.result_ttl_seconds)
+
+    def _evict_expired(self) -> None:
+        cutoff = time.time() - self.result_ttl_seconds
+        expired = [job_id for job_id, job in self._jobs.items() if job.done and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if expired:
+            logger.debug("Evicted %s expired jobs", len(expired))
+
+    async def _worker(self, idx: int) -> None:
+        while True:
+            job = await self._queue.get()
+            job.status = JobStatus.RUNNING
+            job.started_at = time.time()
+            logger.info("Worker %s running job %s (waited %.1fs)", idx, job.id, job.started_at - job.created_at)
+            queued_publish = self._queued_publishes.get(job.id)
+            if queued_publish is not None:
+                await asyncio.wait({queued_publish})
+            await self._publish(job)
+            try:
+                job.result = await job.fn()
+                job.status = JobStatus.SUCCEEDED
+            except asyncio.CancelledError:
+                job.status = JobStatus.FAILED
+                job.error = "Job was cancelled during shutdown"
+                job.finished_at = time.time()
+                raise
+            except Exception as e:
+                logger.error("Job %s failed: %s", job.id, e, exc_info=True)
+                job.status = JobStatus.FAILED
+                job.error = str(e)
+            job.finished_at = time.time()
+            logger.info("Job %s %s in %.1fs", job.id, job.status.value, job.finished_at - job.started_at)
+            await self._publish(job)
+            self._queue.task_done()
+
+
+@lru_cache(maxsize=1)
+def get_job_manager() -> JobManager:
+    """Return a singleton job manager for the generate job API."""
+    return JobManager(
+        concurrency=JOB_WORKER_CONCURRENCY,
+        max_queue_size=JOB_MAX_QUEUE_SIZE,
+        result_ttl_seconds=JOB_RESULT_TTL_SECONDS,
+        # No memory tier: job state changes, so always read the shared copy
+        store=get_cache("jobs", JOB_RESULT_TTL_SECONDS),
+    )
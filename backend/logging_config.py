@@ -0,0 +1,156 @@
+"""
+Queue-backed logging with request ids, sampling and JSON output
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict
+
+# Id of the request being handled; "-" outside a request
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+_listener: QueueListener | None = None
+
+
+def parse_sample_rates(spec: str | None) -> Dict[str, float]:
+    """Parse ``"agents=0.1,uploads=0.5"`` into a logger name -> keep rate mapping."""
+    rates = {}
+    for item in (spec or "").split(","):
+        name, sep, rate = item.strip().partition("=")
+        if sep and name:
+            rates[name.strip()] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp each record with the current request id (runs on the logging thread of the caller)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of DEBUG and INFO records from high-volume loggers.
+
+    Rates apply to a logger and its children (``agents`` also covers
+    ``agents.images``). Warnings and errors are never sampled out.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def _rate(self, name: str) -> float:
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves record formatting to the listener thread.
+
+    The stock handler runs the whole formatter (including tracebacks) on the
+    calling thread. Here only ``msg % args`` is merged before the record is
+    queued, so the message is frozen at the time of the call even if its
+    arguments are mutated afterwards; timestamps, JSON encoding and tracebacks
+    are formatted by the listener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+
+
+def configure_logging(
+    level: str | int | None = None,
+    log_format: str | None = None,
+    sample_rates: Dict[str, float] | None = None,
+) -> None:
+    """
+    Configure root logging for an entry point (server, CLI or script).
+
+    Records are put on an in-memory queue by the calling thread and formatted and
+    written by a background listener thread, so logging never blocks the event
+    loop on stream I/O.
+
+    Args:
+        level: Root log level (default: LOG_LEVEL env var or INFO)
+        log_format: "json" or "text" (default: LOG_FORMAT env var or json)
+        sample_rates: Logger name -> fraction of DEBUG/INFO records to keep
+            (default: parsed from LOG_SAMPLE_RATES, e.g. "agents=0.1")
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    level = level or os.getenv("LOG_LEVEL", "INFO").upper()
+    log_format = (log_format or os.getenv("LOG_FORMAT", "json")).lower()
+    if sample_rates is None:
+        sample_rates = parse_sample_rates(os.getenv("LOG_SAMPLE_RATES"))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rates))
+    queue_handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+
+    # Reduce noise from httpx and other libraries
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("httpcore").setLevel(logging.WARNING)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
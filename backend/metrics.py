@@ -0,0 +1,126 @@
+"""
+Per-stage timing spans, Server-Timing headers and Prometheus metrics
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterator, List
+
+from prometheus_client import CONTENT_TYPE_LATEST, Histogram, generate_latest
+
+from deadlines import DeadlineExceededError
+
+logger = logging.getLogger(__name__)
+
+# Stage timings span from sub-second LLM calls to multi-minute image jobs
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
+
+STAGE_DURATION = Histogram(
+    "viral_spark_stage_duration_seconds",
+    "Duration of pipeline stages",
+    ["stage", "platform", "outcome"],
+    buckets=STAGE_BUCKETS,
+)
+
+REQUEST_DURATION = Histogram(
+    "viral_spark_http_request_duration_seconds",
+    "Duration of HTTP requests until the response starts",
+    ["method", "route", "status"],
+    buckets=STAGE_BUCKETS,
+)
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+@dataclass
+class Span:
+    """A finished (or running) timed stage."""
+    stage: str
+    platform: str = ""
+    outcome: str = "ok"
+    duration_ms: float = 0.0
+
+
+# Spans recorded during the current request; None outside a request
+_request_spans: ContextVar[List[Span] | None] = ContextVar("request_spans", default=None)
+
+
+def start_request_timing() -> List[Span]:
+    """Start collecting spans for the current request and return the list they go into."""
+    spans: List[Span] = []
+    _request_spans.set(spans)
+    return spans
+
+
+def outcome_for(exc: BaseException) -> str:
+    """Return the outcome label for a stage that raised ``exc``."""
+    if isinstance(exc, asyncio.CancelledError):
+        return "cancelled"
+    if isinstance(exc, (DeadlineExceededError, asyncio.TimeoutError)):
+        return "timeout"
+    return "error"
+
+
+def record(stage: str, seconds: float, platform: str | None = None, outcome: str = "ok") -> None:
+    """Record a stage duration measured by the caller."""
+    span = Span(stage=stage, platform=platform or "", outcome=outcome, duration_ms=seconds * 1000)
+    STAGE_DURATION.labels(stage=stage, platform=span.platform, outcome=outcome).observe(seconds)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append(span)
+
+
+@contextmanager
+def span(stage: str, platform: str | None = None) -> Iterator[Span]:
+    """
+    Time a block as one stage.
+
+    The outcome is ``ok`` unless the block raises (``error``, ``timeout`` or
+    ``cancelled``); the block may set ``outcome`` on the yielded span itself,
+    e.g. to mark a cache hit.
+    """
+    current = Span(stage=stage, platform=platform or "")
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.outcome = outcome_for(e)
+        raise
+    finally:
+        record(stage, time.perf_counter() - start, platform, current.outcome)
+
+
+def _server_timing_name(span: Span) -> str:
+    name = f"{span.stage}-{span.platform}" if span.platform else span.stage
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+
+
+def server_timing_header(spans: List[Span], total_seconds: float | None = None) -> str:
+    """
+    Format spans as a Server-Timing header value.
+
+    Spans with the same stage and platform (e.g. one per uploaded image) are
+    summed into one entry.
+    """
+    durations: dict[str, float] = {}
+    for item in spans:
+        name = _server_timing_name(item)
+        durations[name] = durations.get(name, 0.0) + item.duration_ms
+    entries = [f"{name};dur={duration:.1f}" for name, duration in durations.items()]
+    if total_seconds is not None:
+        entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def observe_request(method: str, route: str, status: int, seconds: float) -> None:
+    """Record the duration of an HTTP request."""
+    REQUEST_DURATION.labels(method=method, route=route, status=str(status)).observe(seconds)
+
+
+def render_metrics() -> bytes:
+    """Return all metrics in the Prometheus text exposition format."""
+    return generate_latest()
@@ -2,7 +2,7 @@
 Pydantic models and dataclasses for the AI Marketing Tool API
 """
 
-from typing import List
+from typing import Dict, List
 from dataclasses import dataclass
 from pydantic import BaseModel, Field
 
@@ -20,15 +20,17 @@ class PlatformContent(BaseModel):
 
 
 class GeneratedContent(BaseModel):
-    """Generated social media content for all platforms."""
-    linkedin: PlatformContent = Field(description="Professional LinkedIn post content")
-    x: PlatformContent = Field(description="Concise X (formerly Twitter) post content")
-    instagram: PlatformContent = Field(description="Engaging Instagram caption content")
+    """Generated social media content for the requested platforms (None if not requested)."""
+    linkedin: PlatformContent | None = Field(default=None, description="Professional LinkedIn post content")
+    x: PlatformContent | None = Field(default=None, description="Concise X (formerly Twitter) post content")
+    instagram: PlatformContent | None = Field(default=None, description="Engaging Instagram caption content")
 
 
 class EditedContent(BaseModel):
-    """Edited social media content."""
-    edited_text: str = Field(description="The edited post text")
+    """Edited social media content, all three parts at once."""
+    hook: str = Field(description="The edited attention-grabbing opening line")
+    body: str = Field(description="The edited main content")
+    outro: str = Field(description="The edited closing statement with call-to-action")
 
 
 class EditedPartContent(BaseModel):
@@ -53,14 +55,98 @@ class PlatformContentResponse(BaseModel):
     outro: str
 
 
+class CriticalPathResponse(BaseModel):
+    """Critical path of a single platform's generation chain."""
+    total_ms: float = Field(description="Milliseconds from pipeline start until the platform finished")
+    stages: Dict[str, float] = Field(description="Duration in milliseconds of each stage on the critical path")
+
+
+class PlatformStatus(BaseModel):
+    """Outcome of a platform's text and image stages: ok, timeout, error, skipped or cancelled."""
+    content: str
+    image: str
+    detail: str | None = None
+
+
+class UsageEntry(BaseModel):
+    """Token usage of one agent run."""
+    stage: str = Field(description="Pipeline stage, e.g. text, rag_initial, image_prompt, edit_body")
+    platform: str | None = None
+    model: str
+    requests: int = 0
+    request_tokens: int = 0
+    response_tokens: int = 0
+    total_tokens: int = 0
+    cost_usd: float | None = Field(default=None, description="Estimated cost; None when the model has no configured price")
+
+
+class UsageSummary(BaseModel):
+    """Token usage and estimated cost of all agent runs in a request."""
+    requests: int = 0
+    request_tokens: int = 0
+    response_tokens: int = 0
+    total_tokens: int = 0
+    cost_usd: float = Field(default=0.0, description="Estimated cost of the runs whose model has a configured price")
+    entries: List[UsageEntry] = Field(default_factory=list)
+
+
 class GenerateResponse(BaseModel):
-    """Response from the generate endpoint."""
-    linkedin: PlatformContentResponse
-    x: PlatformContentResponse
-    instagram: PlatformContentResponse
-    linkedin_image_url: str
-    x_image_url: str
-    instagram_image_url: str
+    """Response from the generate endpoint. Platforms that were not requested are None."""
+    platforms: List[str] = Field(description="Platforms that were generated")
+    linkedin: PlatformContentResponse | None = None
+    x: PlatformContentResponse | None = None
+    instagram: PlatformContentResponse | None = None
+    linkedin_image_url: str | None = None
+    x_image_url: str | None = None
+    instagram_image_url: str | None = None
+    status: Dict[str, PlatformStatus] | None = Field(default=None, description="Per-platform outcome; failed or late stages leave their fields None")
+    critical_paths: Dict[str, CriticalPathResponse] | None = None
+    usage: UsageSummary | None = None
+
+
+class StreamEvent(BaseModel):
+    """A single Server-Sent Event emitted by the streaming generate endpoint."""
+    event: str = Field(description="Event type: content, image, error or done")
+    platform: str | None = None
+    stage: str | None = None
+    status: str | None = None
+    elapsed_ms: float = Field(description="Milliseconds since the generation started")
+    content: PlatformContentResponse | None = None
+    image_url: str | None = None
+    detail: str | None = None
+    time_to_first_content_ms: float | None = None
+    platform_status: Dict[str, PlatformStatus] | None = None
+    critical_paths: Dict[str, CriticalPathResponse] | None = None
+    usage: UsageSummary | None = None
+
+
+class BatchItemResult(BaseModel):
+    """Result of a single campaign in a batch, streamed as one JSON line."""
+    index: int = Field(description="Position of the item in the batch request")
+    id: str
+    status: str = Field(description="succeeded or failed")
+    elapsed_ms: float
+    result: GenerateResponse | None = None
+    error: str | None = None
+
+
+class JobStatusResponse(BaseModel):
+    """Status of a background generate job."""
+    job_id: str
+    status: str = Field(description="queued, running, succeeded or failed")
+    created_at: float
+    started_at: float | None = None
+    finished_at: float | None = None
+    error: str | None = None
+
+
+class DirectUploadResponse(BaseModel):
+    """Parameters for uploading a product image straight to the Fal CDN."""
+    file_url: str = Field(description="URL of the image once uploaded; pass it to /generate as image_urls")
+    upload_url: str | None = Field(default=None, description="Presigned URL to PUT the image bytes to; None when the digest is already known")
+    cached: bool = Field(default=False, description="True when the image was uploaded before and needs no upload")
+    max_edge: int = Field(description="Longest edge to downscale to before uploading")
+    format: str = Field(description="Suggested upload format")
 
 
 class EditResponse(BaseModel):
@@ -69,6 +155,8 @@ class EditResponse(BaseModel):
     body: str
     outro: str
     image_url: str | None = None
+    status: Dict[str, str] | None = Field(default=None, description="Per-part outcome: edited, unchanged, timeout or error")
+    usage: UsageSummary | None = None
 
 
 # ──────────────────────────────────────────────────────────────────────────────
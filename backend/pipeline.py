@@ -0,0 +1,530 @@
+"""
+Per-platform task graph for the generate pipeline (text -> image prompt -> image)
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Sequence
+
+from constants import PLATFORMS
+from deadlines import Deadline, DeadlineExceededError
+from models import (
+    AgentDeps,
+    CriticalPathResponse,
+    GenerateResponse,
+    PlatformContent,
+    PlatformContentResponse,
+    PlatformStatus,
+    StreamEvent,
+    UsageSummary,
+)
+from usage import UsageLedger, usage_ledger
+from agents import (
+    create_retrieval_batch,
+    generate_platform_content,
+    generate_platform_image_prompt,
+    generate_image,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Task Graph
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+class DependencyFailedError(Exception):
+    """Exception recorded on a graph node that was skipped because a dependency failed."""
+    pass
+
+
+@dataclass
+class GraphNode:
+    """A single stage in the task graph and its timing once it has run."""
+    name: str
+    fn: Callable[[Dict[str, Any]], Awaitable[Any]]
+    depends_on: List[str]
+    platform: str | None = None
+    stage: str | None = None
+    start_ms: float | None = None
+    end_ms: float | None = None
+    result: Any = None
+    error: BaseException | None = None
+
+    @property
+    def duration_ms(self) -> float | None:
+        if self.start_ms is None or self.end_ms is None:
+            return None
+        return self.end_ms - self.start_ms
+
+
+@dataclass
+class CriticalPath:
+    """The chain of stages that determined when a platform finished."""
+    platform: str
+    total_ms: float
+    nodes: List[GraphNode] = field(default_factory=list)
+
+    def to_response(self) -> CriticalPathResponse:
+        return CriticalPathResponse(
+            total_ms=round(self.total_ms, 1),
+            stages={node.stage or node.name: round(node.duration_ms or 0.0, 1) for node in self.nodes},
+        )
+
+    def describe(self) -> str:
+        stages = " -> ".join(f"{node.stage or node.name} {node.duration_ms or 0.0:.0f} ms" for node in self.nodes)
+        return f"{self.total_ms:.0f} ms ({stages})"
+
+
+class TaskGraph:
+    """
+    A small dependency graph of async stages.
+
+    Every node is started as its own task as soon as all of its dependencies have
+    completed, so independent chains (one per platform) progress at their own pace
+    instead of waiting on per-stage barriers.
+    """
+
+    def __init__(self):
+        self.nodes: Dict[str, GraphNode] = {}
+
+    def add(
+        self,
+        name: str,
+        fn: Callable[[Dict[str, Any]], Awaitable[Any]],
+        depends_on: Sequence[str] = (),
+        platform: str | None = None,
+        stage: str | None = None,
+    ) -> str:
+        """
+        Add a node to the graph.
+
+        Args:
+            name: Unique node name
+            fn: Coroutine function called with a dict of dependency results
+            depends_on: Names of nodes that must complete first (must already be added)
+            platform: Platform this node belongs to, used for critical path reporting
+            stage: Stage label, used for critical path reporting
+
+        Returns:
+            The node name, for use in later depends_on lists
+        """
+        if name in self.nodes:
+            raise ValueError(f"Duplicate graph node: {name}")
+        missing = [dep for dep in depends_on if dep not in self.nodes]
+        if missing:
+            raise ValueError(f"Graph node {name} depends on unknown nodes: {missing}")
+        self.nodes[name] = GraphNode(
+            name=name,
+            fn=fn,
+            depends_on=list(depends_on),
+            platform=platform,
+            stage=stage,
+        )
+        return name
+
+    async def run(
+        self,
+        on_complete: Callable[[GraphNode], Awaitable[None]] | None = None,
+        fail_fast: bool = True,
+        deadline: Deadline | None = None,
+    ) -> None:
+        """
+        Run every node in the graph.
+
+        Args:
+            on_complete: Awaited after each node finishes or fails (not for skipped nodes)
+            fail_fast: If True, the first failure cancels all remaining nodes and is raised.
+                If False, failures are recorded on the node and their dependents are skipped.
+            deadline: Request deadline; a node still running when it passes is cancelled
+                and fails with DeadlineExceededError
+        """
+        start = time.perf_counter()
+        tasks: Dict[str, asyncio.Task] = {}
+
+        def elapsed_ms() -> float:
+            return (time.perf_counter() - start) * 1000
+
+        async def run_node(node: GraphNode) -> None:
+            if node.depends_on:
+                await asyncio.wait([tasks[dep] for dep in node.depends_on])
+            failed = [dep for dep in node.depends_on if self.nodes[dep].error is not None]
+            if failed:
+                node.error = DependencyFailedError(f"{node.name} skipped because {', '.join(failed)} failed")
+                return
+
+            node.start_ms = elapsed_ms()
+            try:
+                work = node.fn({dep: self.nodes[dep].result for dep in node.depends_on})
+                if deadline is not None:
+                    work = deadline.run(work, stage=node.name)
+                node.result = await work
+            except Exception as e:
+                node.end_ms = elapsed_ms()
+                node.error = e
+                if on_complete:
+                    await on_complete(node)
+                if fail_fast:
+                    raise
+                logger.error("Graph node %s failed: %s", node.name, e)
+                return
+            node.end_ms = elapsed_ms()
+            logger.debug("Graph node %s completed in %.0f ms", node.name, node.duration_ms)
+            if on_complete:
+                await on_complete(node)
+
+        # Nodes can only depend on earlier nodes, so insertion order is a topological order
+        for name, node in self.nodes.items():
+            tasks[name] = asyncio.create_task(run_node(node), name=f"graph:{name}")
+
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
+
+    def critical_path(self, platform: str) -> CriticalPath | None:
+        """
+        Return the critical path that ends at the platform's last finished node.
+
+        Walking back from that node, the dependency that finished last is the one
+        that gated it, so the resulting chain explains the platform's total latency.
+        """
+        finished = [
+            node for node in self.nodes.values()
+            if node.platform == platform and node.end_ms is not None
+        ]
+        if not finished:
+            return None
+
+        node = max(finished, key=lambda n: n.end_ms)
+        total_ms = node.end_ms
+        path = [node]
+        while node.depends_on:
+            node = max(
+                (self.nodes[dep] for dep in node.depends_on),
+                key=lambda n: n.end_ms if n.end_ms is not None else -1.0,
+            )
+            path.append(node)
+        path.reverse()
+        return CriticalPath(platform=platform, total_ms=total_ms, nodes=path)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Generate Pipeline
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+@dataclass
+class GenerationResult:
+    """Outputs, per-platform statuses and critical paths of a generate pipeline run."""
+    contents: Dict[str, PlatformContent] = field(default_factory=dict)
+    image_urls: Dict[str, str] = field(default_factory=dict)
+    statuses: Dict[str, PlatformStatus] = field(default_factory=dict)
+    critical_paths: Dict[str, CriticalPath] = field(default_factory=dict)
+    errors: List[BaseException] = field(default_factory=list)
+
+    def critical_path_responses(self) -> Dict[str, CriticalPathResponse]:
+        return {platform: path.to_response() for platform, path in self.critical_paths.items()}
+
+
+def normalize_platforms(platforms: Sequence[str] | None) -> tuple[str, ...]:
+    """
+    Validate a list of platform names and return them in canonical order.
+    Returns all platforms when the list is empty; raises ValueError for unknown names.
+    """
+    requested = {name.strip().lower() for name in platforms or () if name.strip()}
+    if not requested:
+        return PLATFORMS
+    unknown = requested - set(PLATFORMS)
+    if unknown:
+        raise ValueError(
+            f"Unknown platform(s): {', '.join(sorted(unknown))}. Valid platforms: {', '.join(PLATFORMS)}"
+        )
+    return tuple(platform for platform in PLATFORMS if platform in requested)
+
+
+def build_generation_prompt(prompt: str, product_image_urls: list[str]) -> str:
+    """Build the full content generation prompt with image context."""
+    return f"{prompt}\n\n[User has provided {len(product_image_urls)} product image(s) for reference]"
+
+
+def build_generation_graph(
+    prompt: str,
+    product_description: str,
+    deps: AgentDeps,
+    product_image_urls: list[str],
+    platforms: Sequence[str] = PLATFORMS,
+) -> TaskGraph:
+    """
+    Build the generate task graph: one independent text -> image prompt -> image
+    chain per platform. The text nodes share one batched RAG retrieval.
+    """
+    graph = TaskGraph()
+    retrieval = create_retrieval_batch(platforms)
+    for platform in platforms:
+        text_node = graph.add(
+            f"{platform}:text",
+            lambda results, platform=platform: generate_platform_content(prompt, platform, deps, retrieval),
+            platform=platform,
+            stage="text",
+        )
+        image_prompt_node = graph.add(
+            f"{platform}:image_prompt",
+            lambda results, platform=platform, text_node=text_node: generate_platform_image_prompt(
+                product_description, platform, results[text_node]
+            ),
+            depends_on=[text_node],
+            platform=platform,
+            stage="image_prompt",
+        )
+        graph.add(
+            f"{platform}:image",
+            lambda results, image_prompt_node=image_prompt_node, platform=platform: generate_image(
+                results[image_prompt_node], product_image_urls, platform
+            ),
+            depends_on=[image_prompt_node],
+            platform=platform,
+            stage="image",
+        )
+    return graph
+
+
+def _node_status(node: GraphNode) -> str:
+    """Summarize a node's outcome as ok, timeout, error, skipped or cancelled."""
+    if node.error is None:
+        return "ok" if node.end_ms is not None else "cancelled"
+    if isinstance(node.error, DeadlineExceededError):
+        return "timeout"
+    if isinstance(node.error, DependencyFailedError):
+        return "skipped"
+    return "error"
+
+
+def _chain_status(nodes: Sequence[GraphNode]) -> tuple[str, str | None]:
+    """Return the status of a chain of nodes: that of the first node that did not succeed."""
+    for node in nodes:
+        status = _node_status(node)
+        if status != "ok":
+            return status, str(node.error) if node.error is not None else None
+    return "ok", None
+
+
+def _collect_result(graph: TaskGraph, platforms: Sequence[str]) -> GenerationResult:
+    """Gather node outputs, per-platform statuses and critical paths from a finished generation graph."""
+    result = GenerationResult()
+    for platform in platforms:
+        text_node = graph.nodes[f"{platform}:text"]
+        image_prompt_node = graph.nodes[f"{platform}:image_prompt"]
+        image_node = graph.nodes[f"{platform}:image"]
+        if _node_status(text_node) == "ok":
+            result.contents[platform] = text_node.result
+        if _node_status(image_node) == "ok":
+            result.image_urls[platform] = image_node.result
+
+        content_status, content_detail = _chain_status([text_node])
+        image_status, image_detail = _chain_status([text_node, image_prompt_node, image_node])
+        if content_status != "ok":
+            # The image was never attempted; the content status explains why
+            image_status, image_detail = "skipped", None
+        result.statuses[platform] = PlatformStatus(
+            content=content_status,
+            image=image_status,
+            detail=content_detail or image_detail,
+        )
+        if content_detail:
+            result.errors.append(text_node.error)
+        path = graph.critical_path(platform)
+        if path is not None:
+            result.critical_paths[platform] = path
+            logger.info("Critical path for %s: %s", platform, path.describe())
+    return result
+
+
+async def run_generation_pipeline(
+    prompt: str,
+    product_description: str,
+    deps: AgentDeps,
+    product_image_urls: list[str],
+    platforms: Sequence[str] = PLATFORMS,
+    deadline: Deadline | None = None,
+) -> GenerationResult:
+    """
+    Run the generate pipeline for the requested platforms and return whatever finished.
+
+    Each platform advances through its own chain, so end-to-end latency is that of
+    the slowest single chain rather than the sum of per-stage maxima. A failing or
+    late stage only affects its own platform: stages still running at the deadline
+    are cancelled, and the result carries every finished text and image along with
+    a status per platform.
+    """
+    logger.info("Running per-platform generation graph for %s (deadline: %s)",
+                ", ".join(platforms), f"{deadline.budget_seconds:.0f}s" if deadline else "none")
+    graph = build_generation_graph(prompt, product_description, deps, product_image_urls, platforms)
+    await graph.run(fail_fast=False, deadline=deadline)
+    return _collect_result(graph, platforms)
+
+
+def build_generate_response(
+    result: GenerationResult,
+    platforms: Sequence[str],
+    usage: UsageSummary | None = None,
+) -> GenerateResponse:
+    """Build the API response for a pipeline run; platforms not requested or not finished are None."""
+    fields = {}
+    for platform in platforms:
+        content = result.contents.get(platform)
+        if content is not None:
+            logger.debug("%s hook: %.50s", platform, content.hook)
+            fields[platform] = PlatformContentResponse(
+                hook=content.hook,
+                body=content.body,
+                outro=content.outro,
+            )
+        fields[f"{platform}_image_url"] = result.image_urls.get(platform)
+
+    return GenerateResponse(
+        platforms=list(platforms),
+        status=result.statuses,
+        critical_paths=result.critical_path_responses(),
+        usage=usage,
+        **fields,
+    )
+
+
+async def generate_campaign(
+    prompt: str,
+    product_image_urls: list[str],
+    platforms: Sequence[str] = PLATFORMS,
+    deadline: Deadline | None = None,
+) -> GenerateResponse:
+    """
+    Run the full generate flow for a user prompt and its uploaded product images.
+
+    Shared by the synchronous /generate endpoint and the background job workers.
+    Only the requested platforms' pipelines are scheduled. Partial results are
+    returned as long as at least one platform produced its text; otherwise the
+    first platform error is raised.
+    """
+    deps = AgentDeps(product_images_base64=[])  # URLs are used instead now
+    with usage_ledger() as ledger:
+        result = await run_generation_pipeline(
+            prompt=build_generation_prompt(prompt, product_image_urls),
+            product_description=prompt,
+            deps=deps,
+            product_image_urls=product_image_urls,
+            platforms=platforms,
+            deadline=deadline,
+        )
+    usage = ledger.summary()
+    logger.info("Generation used %s tokens in %s model requests (~$%.4f)", usage.total_tokens, usage.requests, usage.cost_usd)
+    if not result.contents:
+        logger.error("No platform produced content")
+        raise result.errors[0] if result.errors else RuntimeError("No platform produced content")
+    return build_generate_response(result, platforms, usage)
+
+
+async def stream_generation_pipeline(
+    prompt: str,
+    product_description: str,
+    deps: AgentDeps,
+    product_image_urls: list[str],
+    platforms: Sequence[str] = PLATFORMS,
+    deadline: Deadline | None = None,
+) -> AsyncIterator[StreamEvent]:
+    """
+    Run the generate pipeline and yield events as soon as each result is ready.
+
+    Each platform's text is emitted the moment its agent run resolves, and its image
+    event follows as soon as that platform's fal job completes. A failing platform
+    yields an error event without affecting the others. A final ``done`` event
+    reports total elapsed time, time to first content, per-platform critical paths
+    and token usage.
+
+    Args:
+        prompt: Full prompt passed to the content agents
+        product_description: User's original product description for image prompts
+        deps: Agent dependencies
+        product_image_urls: Uploaded product image URLs used as image references
+        platforms: Platforms to generate
+        deadline: Request deadline; stages still running when it passes emit timeout errors
+
+    Yields:
+        StreamEvent objects in completion order
+    """
+    start = time.perf_counter()
+    queue: asyncio.Queue[StreamEvent | None] = asyncio.Queue()
+    graph = build_generation_graph(prompt, product_description, deps, product_image_urls, platforms)
+
+    def elapsed_ms() -> float:
+        return (time.perf_counter() - start) * 1000
+
+    async def on_complete(node: GraphNode) -> None:
+        if node.error is not None:
+            logger.error("Streaming %s %s failed: %s", node.platform, node.stage, node.error)
+            await queue.put(StreamEvent(
+                event="error",
+                platform=node.platform,
+                stage=node.stage,
+                status=_node_status(node),
+                elapsed_ms=elapsed_ms(),
+                detail=f"{node.stage} failed: {str(node.error)}",
+            ))
+        elif node.stage == "text":
+            await queue.put(StreamEvent(
+                event="content",
+                platform=node.platform,
+                elapsed_ms=elapsed_ms(),
+                content=PlatformContentResponse(
+                    hook=node.result.hook,
+                    body=node.result.body,
+                    outro=node.result.outro,
+                ),
+            ))
+        elif node.stage == "image":
+            await queue.put(StreamEvent(
+                event="image",
+                platform=node.platform,
+                elapsed_ms=elapsed_ms(),
+                image_url=node.result,
+            ))
+
+    ledger = UsageLedger()
+    
+    async def run_graph() -> None:
+        try:
+            # Set inside the task: the generator's own context changes between yields
+            with usage_ledger(ledger):
+                await graph.run(on_complete=on_complete, fail_fast=False, deadline=deadline)
+        finally:
+            await queue.put(None)
+
+    runner = asyncio.create_task(run_graph())
+    time_to_first_content_ms = None
+    try:
+        while (event := await queue.get()) is not None:
+            if event.event == "content" and time_to_first_content_ms is None:
+                time_to_first_content_ms = event.elapsed_ms
+                logger.info("Time to first content: %.0f ms (%s)", time_to_first_content_ms, event.platform)
+            yield event
+
+        result = _collect_result(graph, platforms)
+        total_ms = elapsed_ms()
+        logger.info("Streaming generation completed in %.0f ms", total_ms)
+        yield StreamEvent(
+            event="done",
+            elapsed_ms=total_ms,
+            time_to_first_content_ms=time_to_first_content_ms,
+            platform_status=result.statuses,
+            critical_paths=result.critical_path_responses(),
+            usage=ledger.summary(),
+        )
+    finally:
+        # Client disconnected or generation finished: never leave work running
+        if not runner.done():
+            logger.info("Streaming generation aborted, cancelling in-flight platform tasks")
+            runner.cancel()
@@ -9,7 +9,8 @@ Usage:
 The script will:
     - Load all .txt files from linkedin_dataset/
     - Parse each post into hook, body, and outro
-    - Create embeddings and upload to Qdrant
+    - Embed them with the CPU embedder the server retrieves with (embeddings.py)
+      and upload them to Qdrant
     - Also include sample X and Instagram posts
 """
 
@@ -21,6 +22,9 @@ from dotenv import load_dotenv
 from qdrant_client import QdrantClient
 from qdrant_client.models import Distance, VectorParams, PointStruct
 
+from embeddings import embed_texts, get_local_embedder
+from logging_config import configure_logging
+
 # Load environment variables
 load_dotenv()
 
@@ -206,38 +210,6 @@ Tag a founder who needs to hear this! 👋
 ]
 
 
-def create_dummy_embedding(text: str, size: int = 1536) -> List[float]:
-    """
-    Create a dummy embedding vector for demonstration.
-    In production, replace this with actual embedding generation using:
-    - OpenAI embeddings API
-    - Sentence transformers
-    - Cohere embeddings
-    - etc.
-    """
-    import hashlib
-    import struct
-    
-    # Create deterministic "embedding" from text hash
-    # This is just for demonstration - use real embeddings in production!
-    hash_bytes = hashlib.sha256(text.encode()).digest()
-    
-    # Generate pseudo-random vector from hash
-    vector = []
-    for i in range(size):
-        # Use hash to seed values
-        idx = (i * 16) % len(hash_bytes)
-        value = struct.unpack('f', hash_bytes[idx:idx+4] + b'\x00' * (4 - min(4, len(hash_bytes) - idx)))[0]
-        vector.append(value)
-    
-    # Normalize to unit vector
-    magnitude = sum(x * x for x in vector) ** 0.5
-    if magnitude > 0:
-        vector = [x / magnitude for x in vector]
-    
-    return vector
-
-
 async def populate_qdrant():
     """Populate Qdrant with LinkedIn posts from dataset and sample X/Instagram posts."""
     
@@ -268,12 +240,15 @@ async def populate_qdrant():
             print("Keeping existing collection. Exiting.")
             return
     
+    # The collection's vector size must match the embedder the server queries with
+    embedder = get_local_embedder()
+    
     # Create collection
-    print(f"📦 Creating collection '{collection_name}'...")
+    print(f"📦 Creating collection '{collection_name}' for {embedder.name} ({embedder.dimension} dimensions)...")
     client.create_collection(
         collection_name=collection_name,
         vectors_config=VectorParams(
-            size=1536,  # Standard size for many embedding models
+            size=embedder.dimension,
             distance=Distance.COSINE,
         ),
     )
@@ -292,11 +267,10 @@ async def populate_qdrant():
     # Add posts to collection
     print(f"\n📝 Adding {len(all_posts)} sample posts...")
     points = []
+    # Posts embedded by an earlier run (same text and model) come from the embedding cache
+    embeddings = embed_texts([post["text"] for post in all_posts])
     
-    for idx, post in enumerate(all_posts):
-        # Generate embedding (replace with real embeddings in production)
-        embedding = create_dummy_embedding(post["text"])
-        
+    for idx, (post, embedding) in enumerate(zip(all_posts, embeddings)):
         # Create point
         point = PointStruct(
             id=idx,
@@ -321,20 +295,19 @@ async def populate_qdrant():
     print(f"  🐦 X: {len(SAMPLE_X_POSTS)} posts")
     print(f"  📸 Instagram: {len(SAMPLE_INSTAGRAM_POSTS)} posts")
     
-    print(f"\n⚠️  IMPORTANT: These posts use dummy embeddings!")
-    print("For production use, implement real embeddings in qdrant_client_helper.py")
-    print("See documentation for details on embedding implementation.")
+    print(f"\n🧮 Embedded with {embedder.name}. Run the server with the same EMBEDDING_BACKEND")
+    print("(and EMBEDDING_MODEL / EMBEDDING_DIMENSION), or re-run this script after changing them.")
     
     # Test retrieval
     print(f"\n🔍 Testing retrieval...")
     test_query = "AI analytics tool for faster decisions"
-    test_embedding = create_dummy_embedding(test_query)
+    test_embedding = embed_texts([test_query])[0]
     
     from qdrant_client.models import Filter, FieldCondition, MatchValue
     
-    results = client.search(
+    results = client.query_points(
         collection_name=collection_name,
-        query_vector=test_embedding,
+        query=test_embedding,
         query_filter=Filter(
             must=[
                 FieldCondition(
@@ -344,7 +317,8 @@ async def populate_qdrant():
             ]
         ),
         limit=3,
-    )
+        with_payload=True,
+    ).points
     
     print(f"\nQuery: '{test_query}'")
     print(f"Found {len(results)} similar LinkedIn posts:")
@@ -364,5 +338,6 @@ async def populate_qdrant():
 
 
 if __name__ == "__main__":
+    configure_logging()
     asyncio.run(populate_qdrant())
 
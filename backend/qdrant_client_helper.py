@@ -1,21 +1,39 @@
 """
 Qdrant vector database client and helper functions for RAG
+
+All Qdrant access goes through one pooled AsyncQdrantClient, so searches never
+block the event loop and the per-platform retrievals of a request overlap.
 """
 
 import os
 import logging
-from typing import List
+from dataclasses import dataclass
+from typing import List, Sequence
 from functools import lru_cache
 
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, VectorParams, PointStruct, ScoredPoint
+import httpx
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.http.exceptions import UnexpectedResponse
 from dotenv import load_dotenv
 
+from cache import TTLCache
+from constants import (
+    HTTP_CLIENT_LIMITS,
+    HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    QDRANT_COLLECTION_INFO_TTL_SECONDS,
+    QDRANT_MISSING_COLLECTION_TTL_SECONDS,
+)
+from metrics import span
+from singleflight import SingleFlight
+
 # Load environment variables
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Collection holding the example posts (see populate_qdrant.py)
+COLLECTION_NAME = os.getenv("QDRANT_COLLECTION_NAME", "social_media_posts")
+
 
 def get_chunks(content: str, n_lines_per_chunk: int = 3) -> List[str]:
     """
@@ -30,8 +48,14 @@ def get_chunks(content: str, n_lines_per_chunk: int = 3) -> List[str]:
 
 
 @lru_cache(maxsize=1)
-def get_qdrant_client() -> QdrantClient:
-    """Return a singleton Qdrant client instance for reuse across calls."""
+def get_qdrant_client() -> AsyncQdrantClient | None:
+    """
+    Return a singleton async Qdrant client for reuse across calls, or None when
+    QDRANT_API_KEY is not set.
+    
+    The client keeps a bounded pool of keep-alive connections, and every request
+    is limited by the Qdrant read timeout in HTTP_CLIENT_LIMITS.
+    """
     qdrant_api_key = os.getenv("QDRANT_API_KEY")
     qdrant_url = os.getenv("QDRANT_URL", "https://a8f15c78-eed9-4352-b360-cc39bddf7d45.eu-central-1-0.aws.cloud.qdrant.io:6333")
     
@@ -39,89 +63,223 @@ def get_qdrant_client() -> QdrantClient:
         logger.warning("QDRANT_API_KEY is not set. RAG functionality will be disabled.")
         return None
     
-    logger.info(f"Initializing Qdrant client with URL: {qdrant_url}")
-    return QdrantClient(
-        url=qdrant_url, 
+    config = HTTP_CLIENT_LIMITS["qdrant"]
+    logger.info("Initializing async Qdrant client with URL: %s (max_connections=%s)", qdrant_url, config["max_connections"])
+    return AsyncQdrantClient(
+        url=qdrant_url,
         api_key=qdrant_api_key,
+        timeout=int(max(1, config["read_timeout_seconds"])),
+        # Passed through to the underlying httpx client
+        limits=httpx.Limits(
+            max_connections=config["max_connections"],
+            max_keepalive_connections=config["max_keepalive_connections"],
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        ),
     )
 
 
+async def close_qdrant_client() -> None:
+    """Close the Qdrant client's connections if it was created."""
+    get_collection_info_cache.cache_clear()
+    if get_qdrant_client.cache_info().currsize:
+        client = get_qdrant_client()
+        get_qdrant_client.cache_clear()
+        if client is not None:
+            await client.close()
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Collection Metadata
+# ──────────────────────────────────────────────────────────────────────────────
+
+# Distances under which the unit-length vectors from embeddings.py rank as intended
+EXPECTED_DISTANCES = ("Cosine", "Dot")
+
+
+@dataclass(frozen=True)
+class CollectionInfo:
+    """What retrieval needs to know about a collection."""
+    name: str
+    exists: bool
+    vector_size: int | None = None
+    distance: str | None = None
+
+    def validate_query(self, embedding: Sequence[float]) -> str | None:
+        """Return why the embedding cannot be searched in this collection, or None if it can."""
+        if not self.exists:
+            return f"collection '{self.name}' does not exist"
+        if self.vector_size is not None and len(embedding) != self.vector_size:
+            return (
+                f"query has {len(embedding)} dimensions but collection '{self.name}' holds "
+                f"{self.vector_size}; re-run populate_qdrant.py with the current EMBEDDING_* settings"
+            )
+        return None
+
+
+def parse_collection_info(name: str, response) -> CollectionInfo:
+    """Build a CollectionInfo from a get_collection response."""
+    vectors = response.config.params.vectors
+    if isinstance(vectors, dict):
+        # Named vectors: searches here use the unnamed default vector, so there is nothing to check against
+        return CollectionInfo(name=name, exists=True)
+    distance = getattr(vectors.distance, "value", vectors.distance)
+    return CollectionInfo(name=name, exists=True, vector_size=vectors.size, distance=str(distance))
+
+
+class CollectionInfoCache:
+    """
+    Per-process cache of collection metadata.
+
+    Retrieval used to list every collection on each search just to check that
+    its own exists. The metadata is now fetched once per TTL with a single
+    get_collection call, shared by concurrent lookups. A missing collection is
+    remembered for a shorter time, so one created by populate_qdrant.py is
+    picked up soon after.
+    """
+
+    def __init__(self, ttl_seconds: float, missing_ttl_seconds: float, max_entries: int = 64):
+        self.missing_ttl_seconds = missing_ttl_seconds
+        self._entries = TTLCache(max_entries, ttl_seconds)
+        self._flight = SingleFlight()
+
+    async def get(self, client: AsyncQdrantClient, name: str) -> CollectionInfo:
+        info = self._entries.get(name)
+        if info is None:
+            info = await self._flight.do(f"collection:{name}", lambda: self._fetch(client, name))
+        return info
+
+    def invalidate(self, name: str) -> None:
+        self._entries.delete(name)
+
+    async def _fetch(self, client: AsyncQdrantClient, name: str) -> CollectionInfo:
+        try:
+            with span("qdrant_collection"):
+                response = await client.get_collection(name)
+        except UnexpectedResponse as e:
+            if e.status_code != 404:
+                raise
+            logger.warning("Collection '%s' does not exist", name)
+            info = CollectionInfo(name=name, exists=False)
+            self._entries.set(name, info, self.missing_ttl_seconds)
+            return info
+
+        info = parse_collection_info(name, response)
+        logger.info("Collection '%s': vector size %s, distance %s", name, info.vector_size, info.distance)
+        if info.distance is not None and info.distance not in EXPECTED_DISTANCES:
+            logger.warning(
+                "Collection '%s' uses %s distance; the embeddings are meant for %s",
+                name, info.distance, " or ".join(EXPECTED_DISTANCES),
+            )
+        self._entries.set(name, info)
+        return info
+
+
+@lru_cache(maxsize=1)
+def get_collection_info_cache() -> CollectionInfoCache:
+    """Return the singleton collection metadata cache."""
+    return CollectionInfoCache(QDRANT_COLLECTION_INFO_TTL_SECONDS, QDRANT_MISSING_COLLECTION_TTL_SECONDS)
+
+
+async def get_collection_info(collection_name: str = COLLECTION_NAME) -> CollectionInfo | None:
+    """
+    Return the (cached) metadata of a collection, or None when Qdrant is not configured.
+
+    Raises whatever the Qdrant client raises for errors other than "not found".
+    """
+    client = get_qdrant_client()
+    if client is None:
+        return None
+    return await get_collection_info_cache().get(client, collection_name)
+
+
+def invalidate_collection_info(collection_name: str = COLLECTION_NAME) -> None:
+    """Forget the cached metadata of a collection, e.g. after it was recreated."""
+    get_collection_info_cache().invalidate(collection_name)
+
+
+def is_not_found(error: Exception) -> bool:
+    """Whether a Qdrant client error means the collection is gone."""
+    return isinstance(error, UnexpectedResponse) and error.status_code == 404
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Retrieval
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+def platform_filter(platform: str):
+    """Return the Qdrant filter that restricts a search to one platform's posts."""
+    from qdrant_client.models import Filter, FieldCondition, MatchValue
+    
+    return Filter(must=[FieldCondition(key="platform", match=MatchValue(value=platform))])
+
+
 async def retrieve_similar_posts(
     query_text: str,
     platform: str,
     limit: int = 3,
-    collection_name: str = "social_media_posts"
+    collection_name: str = COLLECTION_NAME,
+    raise_errors: bool = False
 ) -> List[str]:
     """
     Retrieve similar posts from Qdrant based on the query text.
     
+    The query is embedded with the CPU embedder (see embeddings.py), which must
+    be the one populate_qdrant.py used, then searched with a platform filter.
+    
     Args:
         query_text: The text to use for similarity search
         platform: The platform to filter by (linkedin, x, instagram)
         limit: Maximum number of similar posts to retrieve
         collection_name: Name of the Qdrant collection
+        raise_errors: Re-raise search errors instead of returning no posts
     
     Returns:
-        List of similar post texts
+        List of similar post texts, most similar first (empty on any error)
     """
+    from embeddings import get_embedder
+    
     try:
-        client = get_qdrant_client()
-        if client is None:
+        info = await get_collection_info(collection_name)
+        if info is None:
             logger.warning("Qdrant client not available, skipping retrieval")
             return []
+        if not info.exists:
+            # Nothing to search, so skip embedding the query as well
+            return []
         
-        logger.info(f"Retrieving {limit} similar {platform} posts from Qdrant")
-        
-        # Search for similar posts using the client's neural search
-        # Note: This assumes you have embeddings configured in Qdrant
-        # You'll need to adapt this based on your actual Qdrant schema
+        logger.info("Retrieving %s similar %s posts from Qdrant", limit, platform)
+        with span("embed", platform):
+            embedding = await get_embedder().embed(query_text)
         
-        # For now, return empty list if collection doesn't exist
-        # In production, you'd use client.search() with proper embeddings
-        try:
-            # Check if collection exists
-            collections = client.get_collections()
-            collection_names = [col.name for col in collections.collections]
-            
-            if collection_name not in collection_names:
-                logger.warning(f"Collection '{collection_name}' does not exist in Qdrant")
-                return []
-            
-            # In a real implementation, you would:
-            # 1. Generate embeddings for query_text
-            # 2. Use client.search() to find similar posts
-            # 3. Filter by platform metadata
-            # 
-            # Example (pseudo-code):
-            # results = client.search(
-            #     collection_name=collection_name,
-            #     query_vector=generate_embedding(query_text),
-            #     query_filter={
-            #         "must": [
-            #             {"key": "platform", "match": {"value": platform}}
-            #         ]
-            #     },
-            #     limit=limit
-            # )
-            # return [result.payload["text"] for result in results]
-            
-            logger.info(f"Collection '{collection_name}' exists. Implement search logic.")
-            return []
-            
-        except Exception as e:
-            logger.error(f"Error retrieving from Qdrant: {e}")
-            return []
+        results = await search_similar_posts_with_embedding(
+            embedding, platform, limit, collection_name, raise_errors=raise_errors
+        )
+        return [post["text"] for post in results if post["text"]]
     
     except Exception as e:
-        logger.error(f"Failed to retrieve similar posts: {e}", exc_info=True)
+        if raise_errors:
+            raise
+        logger.error("Failed to retrieve similar posts: %s", e, exc_info=True)
         return []
 
 
+def post_from_point(point) -> dict:
+    """Extract a post's text, score and metadata from a scored search result."""
+    payload = point.payload or {}
+    return {
+        "text": payload.get("text", ""),
+        "score": point.score,
+        "metadata": payload,
+    }
+
+
 async def search_similar_posts_with_embedding(
     embedding: List[float],
     platform: str,
     limit: int = 3,
-    collection_name: str = "social_media_posts"
+    collection_name: str = COLLECTION_NAME,
+    raise_errors: bool = False
 ) -> List[dict]:
     """
     Search for similar posts using a pre-computed embedding vector.
@@ -131,6 +289,7 @@ async def search_similar_posts_with_embedding(
         platform: The platform to filter by (linkedin, x, instagram)
         limit: Maximum number of similar posts to retrieve
         collection_name: Name of the Qdrant collection
+        raise_errors: Re-raise search errors instead of returning no posts
     
     Returns:
         List of similar posts with their metadata
@@ -141,47 +300,158 @@ async def search_similar_posts_with_embedding(
             logger.warning("Qdrant client not available, skipping search")
             return []
         
-        logger.info(f"Searching for {limit} similar {platform} posts using embedding")
-        
-        # Check if collection exists
-        collections = client.get_collections()
-        collection_names = [col.name for col in collections.collections]
+        logger.info("Searching for %s similar %s posts using embedding", limit, platform)
         
-        if collection_name not in collection_names:
-            logger.warning(f"Collection '{collection_name}' does not exist")
+        # Check the collection exists and matches the query, from cached metadata
+        info = await get_collection_info_cache().get(client, collection_name)
+        problem = info.validate_query(embedding)
+        if problem is not None:
+            if info.exists:
+                logger.error("Cannot search Qdrant: %s", problem)
             return []
         
         # Perform vector search with platform filter
-        from qdrant_client.models import Filter, FieldCondition, MatchValue
+        with span("qdrant_search", platform):
+            response = await client.query_points(
+                collection_name=collection_name,
+                query=embedding,
+                query_filter=platform_filter(platform),
+                limit=limit,
+                with_payload=True,
+            )
         
-        results = client.search(
-            collection_name=collection_name,
-            query_vector=embedding,
-            query_filter=Filter(
-                must=[
-                    FieldCondition(
-                        key="platform",
-                        match=MatchValue(value=platform)
-                    )
-                ]
-            ),
-            limit=limit
-        )
+        similar_posts = [post_from_point(point) for point in response.points]
         
-        # Extract post texts and metadata
-        similar_posts = []
-        for result in results:
-            post_data = {
-                "text": result.payload.get("text", ""),
-                "score": result.score,
-                "metadata": result.payload
-            }
-            similar_posts.append(post_data)
-        
-        logger.info(f"Retrieved {len(similar_posts)} similar posts")
+        logger.info("Retrieved %s similar posts", len(similar_posts))
         return similar_posts
     
     except Exception as e:
-        logger.error(f"Error searching with embedding: {e}", exc_info=True)
+        if raise_errors:
+            raise
+        if is_not_found(e):
+            # Deleted (or being recreated) since its metadata was cached
+            logger.warning("Collection '%s' not found during search, dropping its cached metadata", collection_name)
+            invalidate_collection_info(collection_name)
+            return []
+        logger.error("Error searching with embedding: %s", e, exc_info=True)
         return []
 
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Batched Retrieval
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+async def retrieve_similar_posts_batch(
+    queries: Sequence[tuple[str, str]],
+    limit: int = 3,
+    collection_name: str = COLLECTION_NAME,
+    raise_errors: bool = False
+) -> List[List[str]]:
+    """
+    Retrieve similar posts for several (query text, platform) pairs at once.
+    
+    The queries are embedded as one batch and searched with a single
+    query_batch_points request, so the per-platform retrievals of a /generate request
+    cost one Qdrant round trip instead of one each.
+    
+    Args:
+        queries: (query text, platform) pairs
+        limit: Maximum number of similar posts to retrieve per query
+        collection_name: Name of the Qdrant collection
+        raise_errors: Re-raise search errors instead of returning no posts
+    
+    Returns:
+        One list of similar post texts per query, in order (all empty on any error)
+    """
+    from embeddings import get_embedder
+    
+    if not queries:
+        return []
+    try:
+        info = await get_collection_info(collection_name)
+        if info is None:
+            logger.warning("Qdrant client not available, skipping retrieval")
+            return [[] for _ in queries]
+        if not info.exists:
+            return [[] for _ in queries]
+        
+        with span("embed", "batch"):
+            embeddings = await get_embedder().embed_many([query_text for query_text, _ in queries])
+        
+        results = await search_similar_posts_batch(
+            [(embedding, platform) for embedding, (_, platform) in zip(embeddings, queries)],
+            limit,
+            collection_name,
+            raise_errors=raise_errors,
+        )
+        return [[post["text"] for post in posts if post["text"]] for posts in results]
+    
+    except Exception as e:
+        if raise_errors:
+            raise
+        logger.error("Failed to retrieve similar posts in batch: %s", e, exc_info=True)
+        return [[] for _ in queries]
+
+
+async def search_similar_posts_batch(
+    queries: Sequence[tuple[List[float], str]],
+    limit: int = 3,
+    collection_name: str = COLLECTION_NAME,
+    raise_errors: bool = False
+) -> List[List[dict]]:
+    """
+    Search for similar posts for several (embedding, platform) pairs in one request.
+    
+    Args:
+        queries: (query embedding, platform) pairs
+        limit: Maximum number of similar posts to retrieve per query
+        collection_name: Name of the Qdrant collection
+        raise_errors: Re-raise search errors instead of returning no posts
+    
+    Returns:
+        One list of similar posts with their metadata per query, in order
+    """
+    try:
+        client = get_qdrant_client()
+        if client is None:
+            logger.warning("Qdrant client not available, skipping search")
+            return [[] for _ in queries]
+        
+        info = await get_collection_info_cache().get(client, collection_name)
+        for embedding, _ in queries:
+            problem = info.validate_query(embedding)
+            if problem is not None:
+                if info.exists:
+                    logger.error("Cannot search Qdrant: %s", problem)
+                return [[] for _ in queries]
+        
+        from qdrant_client.models import QueryRequest
+        
+        logger.info("Searching for %s similar posts for %s queries in one batch", limit, len(queries))
+        with span("qdrant_search", "batch"):
+            responses = await client.query_batch_points(
+                collection_name=collection_name,
+                requests=[
+                    QueryRequest(
+                        query=embedding,
+                        filter=platform_filter(platform),
+                        limit=limit,
+                        # Unlike query_points(), batch requests return no payload unless asked
+                        with_payload=True,
+                    )
+                    for embedding, platform in queries
+                ],
+            )
+        
+        return [[post_from_point(point) for point in response.points] for response in responses]
+    
+    except Exception as e:
+        if raise_errors:
+            raise
+        if is_not_found(e):
+            logger.warning("Collection '%s' not found during search, dropping its cached metadata", collection_name)
+            invalidate_collection_info(collection_name)
+            return [[] for _ in queries]
+        logger.error("Error in batched search: %s", e, exc_info=True)
+        return [[] for _ in queries]
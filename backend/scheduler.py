@@ -0,0 +1,197 @@
+"""
+Provider-aware concurrency and rate limiting for OpenRouter and Fal calls
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Dict
+
+from prometheus_client import Counter, Gauge
+
+from constants import PROVIDER_LIMITS
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_CONCURRENCY_LIMIT = Gauge(
+    "viral_spark_provider_concurrency_limit",
+    "Concurrency limit currently learned by the provider limiter",
+    ["provider"],
+)
+
+PROVIDER_RATE_LIMIT = Gauge(
+    "viral_spark_provider_rate_per_second",
+    "Request rate currently allowed by the provider limiter",
+    ["provider"],
+)
+
+PROVIDER_IN_FLIGHT = Gauge(
+    "viral_spark_provider_in_flight",
+    "Provider calls currently holding a concurrency slot",
+    ["provider"],
+)
+
+PROVIDER_THROTTLED = Counter(
+    "viral_spark_provider_throttled_total",
+    "Provider calls rejected with HTTP 429",
+    ["provider"],
+)
+
+
+def is_rate_limited(exc: BaseException | None) -> bool:
+    """Return True if the exception, or any exception it was raised from, is an HTTP 429."""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        status = getattr(exc, "status_code", None)
+        if status is None:
+            status = getattr(getattr(exc, "response", None), "status_code", None)
+        if status == 429:
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency slots plus a token bucket for one provider, tuned AIMD-style.
+
+    Every call takes a token (bounding the request rate) and a concurrency slot.
+    Successful calls grow the concurrency limit and rate additively up to their
+    configured maxima; a 429 halves both, and a call much slower than the observed
+    baseline latency trims the concurrency limit. Baselines are kept per stage,
+    since a short draft and a long final post on the same provider take very
+    different times. Decreases are rate limited by a cooldown so one burst of
+    429s only backs off once.
+
+    The limit, rate, calls in flight and 429 count are exported on /metrics.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        min_concurrency: int,
+        max_rate_per_second: float,
+        min_rate_per_second: float,
+        latency_tolerance: float = 2.0,
+        cooldown_seconds: float = 5.0,
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_rate = max_rate_per_second
+        self.min_rate = min_rate_per_second
+        self.latency_tolerance = latency_tolerance
+        self.cooldown_seconds = cooldown_seconds
+
+        self.limit = float(max_concurrency)
+        self.rate = max_rate_per_second
+        self.in_flight = 0
+        self.throttled = 0
+        self.baseline_latency: Dict[str, float] = {}
+
+        self._tokens = float(max(1.0, max_rate_per_second))
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._slots = asyncio.Condition()
+        self._bucket = asyncio.Lock()
+
+        PROVIDER_CONCURRENCY_LIMIT.labels(provider=name).set_function(lambda: self.limit)
+        PROVIDER_RATE_LIMIT.labels(provider=name).set_function(lambda: self.rate)
+        PROVIDER_IN_FLIGHT.labels(provider=name).set_function(lambda: self.in_flight)
+
+    @asynccontextmanager
+    async def slot(self, stage: str = "") -> AsyncIterator[None]:
+        """
+        Hold a token and a concurrency slot for the duration of one provider call.
+
+        ``stage`` selects the latency baseline the call is compared against.
+        """
+        await self._take_token()
+        async with self._slots:
+            await self._slots.wait_for(lambda: self.in_flight < max(1, int(self.limit)))
+            self.in_flight += 1
+
+        start = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            if is_rate_limited(e):
+                self._on_throttled()
+            raise
+        else:
+            self._on_success(time.monotonic() - start, stage)
+        finally:
+            async with self._slots:
+                self.in_flight -= 1
+                self._slots.notify_all()
+
+    async def _take_token(self) -> None:
+        async with self._bucket:
+            while True:
+                now = time.monotonic()
+                capacity = max(1.0, self.rate)
+                self._tokens = min(capacity, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
+
+    def _on_success(self, latency: float, stage: str = "") -> None:
+        baseline = self.baseline_latency.get(stage)
+        if baseline is None:
+            baseline = latency
+        else:
+            # Tracks the fastest recent calls; drifts up slowly so it adapts to a slower provider
+            baseline = min(latency, baseline * 1.01)
+        self.baseline_latency[stage] = baseline
+
+        if latency > self.latency_tolerance * baseline and self._can_decrease():
+            self._decrease(
+                0.9, rate_factor=1.0,
+                reason=f"{stage or 'call'} latency {latency:.1f}s vs baseline {baseline:.1f}s",
+            )
+            return
+
+        self.limit = min(self.max_concurrency, self.limit + 1.0 / max(1.0, self.limit))
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 100.0)
+
+    def _on_throttled(self) -> None:
+        self.throttled += 1
+        PROVIDER_THROTTLED.labels(provider=self.name).inc()
+        if self._can_decrease():
+            self._decrease(0.5, rate_factor=0.5, reason="HTTP 429")
+
+    def _can_decrease(self) -> bool:
+        return time.monotonic() - self._last_decrease >= self.cooldown_seconds
+
+    def _decrease(self, factor: float, rate_factor: float, reason: str) -> None:
+        self._last_decrease = time.monotonic()
+        self.limit = max(self.min_concurrency, self.limit * factor)
+        self.rate = max(self.min_rate, self.rate * rate_factor)
+        logger.warning(
+            "%s limiter backing off (%s): concurrency limit %.1f, rate %.2f/s",
+            self.name, reason, self.limit, self.rate,
+        )
+
+
+@lru_cache(maxsize=None)
+def get_limiter(provider: str) -> AdaptiveLimiter:
+    """Return the singleton limiter for a provider configured in PROVIDER_LIMITS."""
+    if provider not in PROVIDER_LIMITS:
+        raise ValueError(f"Unknown provider: {provider}")
+    logger.info("Creating %s limiter: %s", provider, PROVIDER_LIMITS[provider])
+    return AdaptiveLimiter(provider, **PROVIDER_LIMITS[provider])
+
+
+def provider_slot(provider: str, stage: str = ""):
+    """
+    Async context manager holding a scheduling slot for one call to the provider.
+
+    Calls of the same ``stage`` share a latency baseline.
+    """
+    return get_limiter(provider).slot(stage)
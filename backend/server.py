@@ -3,36 +3,75 @@ AI Marketing Tool API Server
 Generates and edits viral social media posts for LinkedIn, X, and Instagram
 """
 
-import tempfile
-import os
+import asyncio
 import logging
 import re
+import sys
+import time
+import uuid
+from contextlib import asynccontextmanager
 from typing import List, Optional
 
-from fastapi import FastAPI, File, Form, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-import fal_client
+from fastapi.responses import Response, StreamingResponse
 
-from models import AgentDeps, GenerateResponse, EditResponse, PlatformContentResponse
+from pydantic import ValidationError
+
+from constants import (
+    BATCH_DEFAULT_CONCURRENCY,
+    EDIT_DEADLINE_SECONDS,
+    GENERATE_DEADLINE_SECONDS,
+    IMAGE_MAX_EDGE,
+    IMAGE_OUTPUT_FORMAT,
+    MAX_DEADLINE_SECONDS,
+    RAG_ENABLED,
+    STARTUP_WARMUP,
+    log_configuration,
+)
+from logging_config import configure_logging, request_id_var
+from deadlines import Deadline, DeadlineExceededError
+from usage import usage_ledger
+from models import AgentDeps, DirectUploadResponse, GenerateResponse, EditResponse, JobStatusResponse, StreamEvent
 from agents import (
-    generate_all_platform_content,
     edit_content_part,
     edit_full_content,
-    generate_platform_images,
     generate_edited_image,
     ImageGenerationError,
+    warmup_agents,
+)
+from pipeline import (
+    build_generation_prompt,
+    generate_campaign,
+    normalize_platforms,
+    stream_generation_pipeline,
+)
+from uploads import (
+    UploadedImage,
+    initiate_direct_upload,
+    lookup_uploaded_url,
+    reference_image_urls,
+    resolve_image_references,
+    upload_product_images,
+)
+from cache import close_caches
+from http_clients import close_http_clients, warmup_http_clients
+from embeddings import get_embedder, shutdown_embedding_pool
+from images import shutdown_image_pool
+from jobs import Job, JobStatus, QueueFullError, get_job_manager
+from batch import BatchRequest, resolve_batch, run_batch
+from singleflight import edit_request_key, generate_request_key, get_request_coalescer
+from metrics import (
+    METRICS_CONTENT_TYPE,
+    observe_request,
+    render_metrics,
+    server_timing_header,
+    start_request_timing,
 )
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+configure_logging()
 logger = logging.getLogger(__name__)
-
-# Reduce noise from httpx and other libraries
-logging.getLogger("httpx").setLevel(logging.WARNING)
-logging.getLogger("httpcore").setLevel(logging.WARNING)
 logging.getLogger("fal_client").setLevel(logging.INFO)
 
 
@@ -52,39 +91,236 @@ def parse_edit_tags(prompt: str) -> set[str]:
     return {tag.lower() for tag in found if tag.lower() in valid_tags}
 
 
-async def upload_image_to_fal(upload_file: UploadFile) -> str:
-    """Upload an image to Fal CDN and return the URL."""
-    logger.info(f"Uploading image to Fal CDN: {upload_file.filename}")
-    content = await upload_file.read()
-    logger.debug(f"Read {len(content)} bytes from {upload_file.filename}")
+def parse_platforms(platforms: str | None) -> tuple[str, ...]:
+    """
+    Parse a comma-separated platform list (e.g. "linkedin,x").
+    Returns all platforms when the value is empty; raises HTTPException for unknown names.
+    """
+    try:
+        return normalize_platforms((platforms or "").split(","))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def parse_list(value: str | None) -> list[str]:
+    """Parse a comma-separated form field into its non-empty items."""
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+async def collect_product_images(
+    images: List[UploadFile] | None,
+    image_urls: str | None,
+    image_digests: str | None,
+) -> list[UploadedImage]:
+    """
+    Upload a request's image files and resolve its pre-uploaded image URLs and digests.
     
-    # Create a temporary file to upload
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{upload_file.filename}") as tmp:
-        tmp.write(content)
-        tmp_path = tmp.name
+    Raises HTTPException: 400 when no image is given or a URL or digest is rejected,
+    500 when an upload fails.
+    """
+    urls = parse_list(image_urls)
+    digests = parse_list(image_digests)
+    images = images or []
+    logger.info("Images provided: %s files, %s URLs, %s digests", len(images), len(urls), len(digests))
+    if not (images or urls or digests):
+        logger.error("No images provided in request")
+        raise HTTPException(status_code=400, detail="At least one product image is required")
     
     try:
-        # Upload to Fal CDN
-        url = fal_client.upload_file(tmp_path)
-        logger.info(f"Successfully uploaded {upload_file.filename} to Fal CDN: {url}")
-        return url
+        referenced = await resolve_image_references(urls, digests)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        uploaded = await upload_product_images(images) if images else []
     except Exception as e:
-        logger.error(f"Failed to upload {upload_file.filename} to Fal CDN: {e}")
-        raise
-    finally:
-        # Clean up temp file
-        os.unlink(tmp_path)
-        logger.debug(f"Cleaned up temporary file: {tmp_path}")
+        logger.error("Image upload failed: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Image upload failed: {str(e)}")
+    return uploaded + referenced
+
+
+def make_deadline(timeout_seconds: float | None, default_seconds: float) -> Deadline:
+    """Create a request deadline from an optional client timeout, capped at MAX_DEADLINE_SECONDS."""
+    if timeout_seconds is None:
+        return Deadline(default_seconds)
+    if timeout_seconds <= 0:
+        raise HTTPException(status_code=400, detail="timeout_seconds must be positive")
+    return Deadline(min(timeout_seconds, MAX_DEADLINE_SECONDS))
+
+
+def _part_status(error: BaseException) -> str:
+    return "timeout" if isinstance(error, DeadlineExceededError) else "error"
+
+
+async def perform_edit(
+    prompt: str,
+    tags: set[str],
+    hook: str,
+    body: str,
+    outro: str,
+    image_url: str | None,
+    deadline: Deadline,
+) -> EditResponse:
+    """
+    Apply edit instructions to the tagged parts of a post within the request deadline.
+    
+    Text parts named by tags are edited in parallel (all parts when no text tag is
+    present), and a new image is generated when the @image tag is present. A part
+    that fails or misses the deadline keeps its current value and is reported in
+    the response status; the request only fails if nothing could be edited. The
+    response carries the token usage of every agent run made for the edit.
+    """
+    with usage_ledger() as ledger:
+        response = await _apply_edits(prompt, tags, hook, body, outro, image_url, deadline)
+    response.usage = ledger.summary()
+    logger.info("Edit used %s tokens in %s model requests", response.usage.total_tokens, response.usage.requests)
+    return response
+
+
+async def _apply_edits(
+    prompt: str,
+    tags: set[str],
+    hook: str,
+    body: str,
+    outro: str,
+    image_url: str | None,
+    deadline: Deadline,
+) -> EditResponse:
+    current = {"hook": hook, "body": body, "outro": outro}
+    edited = dict(current)
+    status = {part: "unchanged" for part in ("hook", "body", "outro", "image")}
+    errors = []
+    new_image_url = image_url
+    
+    # Create full context for editing
+    full_context = f"Hook: {hook}\n\nBody: {body}\n\nOutro: {outro}"
+    
+    text_tags = tags - {"image"}  # Remove image tag for text editing logic
+    
+    if not text_tags:
+        # No specific text tags - edit all text parts in one run
+        logger.info("No specific tags found, editing all text parts...")
+        try:
+            edited["hook"], edited["body"], edited["outro"] = await deadline.run(
+                edit_full_content(hook, body, outro, prompt),
+                stage="edit",
+            )
+            status.update(hook="edited", body="edited", outro="edited")
+        except Exception as e:
+            logger.error("Editing content failed, keeping current content: %s", e)
+            status.update(hook=_part_status(e), body=_part_status(e), outro=_part_status(e))
+            errors.append(e)
+    else:
+        parts = [part for part in ("hook", "body", "outro") if part in text_tags]
+        logger.info("Editing %s in parallel...", ', '.join(parts))
+        
+        results = await asyncio.gather(
+            *(
+                deadline.run(
+                    edit_content_part(part, current[part], full_context, prompt),
+                    stage=f"edit {part}",
+                )
+                for part in parts
+            ),
+            return_exceptions=True,
+        )
+        for part, result in zip(parts, results):
+            if isinstance(result, Exception):
+                logger.error("Editing %s failed, keeping current content: %s", part, result)
+                status[part] = _part_status(result)
+                errors.append(result)
+            else:
+                edited[part] = result
+                status[part] = "edited"
+    
+    # Generate new image only if @image tag is present
+    if "image" in tags:
+        logger.info("Generating new image (due to @image tag)...")
+        full_content = f"{edited['hook']}\n\n{edited['body']}\n\n{edited['outro']}"
+        try:
+            new_image_url = await deadline.run(
+                generate_edited_image(
+                    original_content=f"{hook}\n\n{body}\n\n{outro}",
+                    edit_instructions=prompt,
+                    edited_content=full_content,
+                    original_image_url=image_url,
+                ),
+                stage="edit image",
+            )
+            status["image"] = "edited"
+            logger.info("New image generated successfully")
+        except Exception as e:
+            logger.error("Editing image failed, keeping current image: %s", e)
+            status["image"] = _part_status(e)
+            errors.append(e)
+    
+    if errors and "edited" not in status.values():
+        raise errors[0]
+    
+    return EditResponse(
+        hook=edited["hook"],
+        body=edited["body"],
+        outro=edited["outro"],
+        image_url=new_image_url,
+        status=status,
+    )
+
+
+def format_sse(event: StreamEvent) -> str:
+    """Serialize a stream event into the Server-Sent Events wire format."""
+    return f"event: {event.event}\ndata: {event.model_dump_json(exclude_none=True)}\n\n"
+
+
+def job_status_response(job: Job) -> JobStatusResponse:
+    """Build the API status response for a background job."""
+    return JobStatusResponse(
+        job_id=job.id,
+        status=job.status.value,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        error=job.error,
+    )
 
 
 # ──────────────────────────────────────────────────────────────────────────────
 # FastAPI Application
 # ──────────────────────────────────────────────────────────────────────────────
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Warm up agents and provider connections, and run the background job workers
+    for the lifetime of the application.
+    """
+    log_configuration()
+    if STARTUP_WARMUP:
+        # Fails startup on missing API keys instead of failing the first request
+        warmup_agents()
+        await warmup_http_clients()
+        if RAG_ENABLED:
+            # Spawn the embedding worker and load its model before the first retrieval
+            await get_embedder().embed("warmup")
+    job_manager = get_job_manager()
+    await job_manager.start()
+    try:
+        yield
+    finally:
+        await job_manager.stop()
+        await close_http_clients()
+        await close_caches()
+        shutdown_image_pool()
+        shutdown_embedding_pool()
+        # The Qdrant helper (and SDK) is only imported once retrieval has been used
+        qdrant_helper = sys.modules.get("qdrant_client_helper")
+        if qdrant_helper is not None:
+            await qdrant_helper.close_qdrant_client()
+
+
 app = FastAPI(
     title="AI Marketing Tool API",
     description="Generate and edit viral social media posts for LinkedIn, X, and Instagram",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Configure CORS for frontend development
@@ -94,103 +330,341 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Request-ID"],
 )
 
 
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    """Tag every log record of a request with its id (X-Request-ID or a new one) and echo it back."""
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:16]
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+@app.middleware("http")
+async def server_timing(request: Request, call_next):
+    """
+    Time each request and report its stage spans in a Server-Timing header.
+    
+    Streaming responses send their headers before generation starts, so they only
+    carry the spans recorded up to that point (e.g. uploads).
+    """
+    spans = start_request_timing()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    route = request.scope.get("route")
+    observe_request(request.method, getattr(route, "path", "unmatched"), response.status_code, elapsed)
+    response.headers["Server-Timing"] = server_timing_header(spans, elapsed)
+    return response
+
+
 @app.get("/")
 async def root():
     """Health check endpoint."""
-    logger.info("Health check endpoint called")
+    logger.debug("Health check endpoint called")
     return {"status": "healthy", "service": "AI Marketing Tool API"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-stage and per-request duration histograms."""
+    return Response(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.post("/uploads/direct", response_model=DirectUploadResponse)
+async def create_direct_upload(
+    content_type: str = Form(..., description="Content type of the image, e.g. image/webp"),
+    file_name: str = Form("product-image", description="File name of the image"),
+    digest: Optional[str] = Form(None, description="SHA-256 hex digest of the image bytes, to skip images uploaded before"),
+):
+    """
+    Issue parameters for uploading a product image straight to the Fal CDN.
+    
+    The client PUTs the image bytes to `upload_url` (with the same Content-Type) and
+    then passes `file_url` to `/generate` in `image_urls`, so the bytes never pass
+    through this server. If `digest` matches an image this server uploaded before,
+    no upload is needed: `cached` is true and `file_url` is the existing URL.
+    `max_edge` and `format` are the downscaling the server would apply, for clients
+    that can resize before uploading.
+    """
+    if not content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="content_type must be an image type")
+    hints = {"max_edge": IMAGE_MAX_EDGE, "format": IMAGE_OUTPUT_FORMAT.lower()}
+    
+    if digest:
+        cached_url = await lookup_uploaded_url(digest)
+        if cached_url is not None:
+            logger.info("Direct upload skipped, digest %.12s already uploaded", digest)
+            return DirectUploadResponse(file_url=cached_url, cached=True, **hints)
+    
+    try:
+        upload_url, file_url = await initiate_direct_upload(content_type, file_name)
+    except Exception as e:
+        logger.error("Failed to initiate direct upload: %s", e, exc_info=True)
+        raise HTTPException(status_code=502, detail="Could not initiate the upload with Fal storage")
+    return DirectUploadResponse(file_url=file_url, upload_url=upload_url, **hints)
+
+
 @app.post("/generate", response_model=GenerateResponse)
 async def generate_content(
     prompt: str = Form(..., description="User's prompt describing the product/company"),
-    images: List[UploadFile] = File(..., description="Product images (at least one required)"),
+    images: Optional[List[UploadFile]] = File(None, description="Product images (at least one image, URL or digest required)"),
+    image_urls: Optional[str] = Form(None, description="Comma-separated URLs of product images already on the Fal CDN"),
+    image_digests: Optional[str] = Form(None, description="Comma-separated SHA-256 digests of product images uploaded before"),
+    platforms: Optional[str] = Form(None, description="Comma-separated platforms to generate (linkedin, x, instagram); defaults to all"),
+    timeout_seconds: Optional[float] = Form(None, description="Deadline for the whole request in seconds (capped server-side)"),
 ):
     """
     Generate viral social media content for LinkedIn, X, and Instagram.
     
     - **prompt**: Description of the product, company, or marketing campaign
-    - **images**: Product images to use for generating marketing visuals (required)
+    - **images**: Product images to use for generating marketing visuals
+    - **image_urls** / **image_digests**: Product images uploaded beforehand (see `/uploads/direct`);
+      at least one image is required across the three fields
+    - **platforms**: Optional comma-separated subset of platforms; omitted platforms are null in the response
+    - **timeout_seconds**: Optional deadline for the whole request
     
-    Returns generated posts (with hook, body, outro) and images for each platform.
+    Returns generated posts (with hook, body, outro) and images for each requested platform.
+    Platforms that fail or run out of time are null, with the reason in `status`.
     """
-    logger.info(f"=== Starting content generation request ===")
-    logger.info(f"Prompt: {prompt[:100]}..." if len(prompt) > 100 else f"Prompt: {prompt}")
-    logger.info(f"Number of images provided: {len(images)}")
+    logger.info("=== Starting content generation request ===")
+    logger.info("Prompt: %.100s", prompt)
     
-    if not images:
-        logger.error("No images provided in request")
-        raise HTTPException(status_code=400, detail="At least one product image is required")
+    selected_platforms = parse_platforms(platforms)
+    logger.info("Platforms requested: %s", ', '.join(selected_platforms))
+    deadline = make_deadline(timeout_seconds, GENERATE_DEADLINE_SECONDS)
+    
+    # Upload images to Fal CDN (or resolve the ones uploaded beforehand)
+    uploaded_images = await collect_product_images(images, image_urls, image_digests)
     
     try:
-        # Upload images to Fal CDN
-        logger.info(f"Uploading {len(images)} product images to Fal CDN...")
-        product_image_urls = []
-        for idx, image in enumerate(images, 1):
-            logger.info(f"Uploading image {idx}/{len(images)}: {image.filename}")
-            url = await upload_image_to_fal(image)
-            product_image_urls.append(url)
-        logger.info(f"All product images uploaded successfully")
+        product_image_urls = await reference_image_urls(uploaded_images)
         
-        # Create dependencies
-        deps = AgentDeps(product_images_base64=[])  # URLs are used instead now
-        
-        # Build the full prompt with image context
-        full_prompt = prompt
-        full_prompt += f"\n\n[User has provided {len(product_image_urls)} product image(s) for reference]"
-        
-        # Generate content using 3 separate API calls in parallel
-        logger.info("Generating social media content for all platforms (3 parallel API calls)...")
-        generated_content = await generate_all_platform_content(full_prompt, deps)
-        logger.info("Content generation completed successfully")
-        logger.debug(f"LinkedIn hook: {generated_content.linkedin.hook[:50]}...")
-        logger.debug(f"X hook: {generated_content.x.hook[:50]}...")
-        logger.debug(f"Instagram hook: {generated_content.instagram.hook[:50]}...")
-        
-        # Generate platform-specific images using product images
-        logger.info("Generating platform-specific marketing images...")
-        linkedin_image, x_image, instagram_image = await generate_platform_images(
-            product_description=prompt,
-            linkedin_content=generated_content.linkedin,
-            x_content=generated_content.x,
-            instagram_content=generated_content.instagram,
-            product_image_urls=product_image_urls,
+        # Run one text -> image prompt -> image chain per platform, each at its own pace.
+        # Identical requests already in flight (double-clicks, retries) share one execution.
+        logger.info("Generating social media content and images for all platforms...")
+        key = generate_request_key(
+            prompt, [image.digest for image in uploaded_images], selected_platforms, deadline.budget_seconds
+        )
+        response = await get_request_coalescer().do(
+            key,
+            lambda: generate_campaign(prompt, product_image_urls, selected_platforms, deadline),
         )
-        logger.info("All platform images generated successfully")
         
         logger.info("=== Content generation request completed successfully ===")
-        return GenerateResponse(
-            linkedin=PlatformContentResponse(
-                hook=generated_content.linkedin.hook,
-                body=generated_content.linkedin.body,
-                outro=generated_content.linkedin.outro,
-            ),
-            x=PlatformContentResponse(
-                hook=generated_content.x.hook,
-                body=generated_content.x.body,
-                outro=generated_content.x.outro,
-            ),
-            instagram=PlatformContentResponse(
-                hook=generated_content.instagram.hook,
-                body=generated_content.instagram.body,
-                outro=generated_content.instagram.outro,
-            ),
-            linkedin_image_url=linkedin_image,
-            x_image_url=x_image,
-            instagram_image_url=instagram_image,
-        )
+        return response
         
+    except DeadlineExceededError as e:
+        logger.error("Content generation timed out: %s", e)
+        raise HTTPException(status_code=504, detail=str(e))
     except ImageGenerationError as e:
-        logger.error(f"Image generation error: {e}")
+        logger.error("Image generation error: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
-        logger.error(f"Content generation failed: {e}", exc_info=True)
+        logger.error("Content generation failed: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Content generation failed: {str(e)}")
 
 
+@app.post("/generate/stream")
+async def generate_content_stream(
+    prompt: str = Form(..., description="User's prompt describing the product/company"),
+    images: Optional[List[UploadFile]] = File(None, description="Product images (at least one image, URL or digest required)"),
+    image_urls: Optional[str] = Form(None, description="Comma-separated URLs of product images already on the Fal CDN"),
+    image_digests: Optional[str] = Form(None, description="Comma-separated SHA-256 digests of product images uploaded before"),
+    platforms: Optional[str] = Form(None, description="Comma-separated platforms to generate (linkedin, x, instagram); defaults to all"),
+    timeout_seconds: Optional[float] = Form(None, description="Deadline for the whole request in seconds (capped server-side)"),
+):
+    """
+    Stream viral social media content for LinkedIn, X, and Instagram over Server-Sent Events.
+    
+    - **prompt**: Description of the product, company, or marketing campaign
+    - **images**, **image_urls**, **image_digests**: Product images, as for `/generate`
+    - **platforms**: Optional comma-separated subset of platforms
+    - **timeout_seconds**: Optional deadline for the whole request
+    
+    Emits a `content` event with hook, body and outro as soon as each platform's text
+    is ready, an `image` event as soon as each platform's image is ready, `error` events
+    for platforms that fail, and a final `done` event with timing information.
+    """
+    logger.info("=== Starting streaming content generation request ===")
+    logger.info("Prompt: %.100s", prompt)
+    
+    selected_platforms = parse_platforms(platforms)
+    logger.info("Platforms requested: %s", ', '.join(selected_platforms))
+    deadline = make_deadline(timeout_seconds, GENERATE_DEADLINE_SECONDS)
+    
+    # Upload before the stream opens so upload failures surface as regular HTTP errors
+    uploaded_images = await collect_product_images(images, image_urls, image_digests)
+    try:
+        product_image_urls = await reference_image_urls(uploaded_images)
+    except Exception as e:
+        logger.error("Image upload failed: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Image upload failed: {str(e)}")
+    
+    deps = AgentDeps(product_images_base64=[])
+    full_prompt = build_generation_prompt(prompt, product_image_urls)
+    
+    async def event_source():
+        async for event in stream_generation_pipeline(
+            prompt=full_prompt,
+            product_description=prompt,
+            deps=deps,
+            product_image_urls=product_image_urls,
+            platforms=selected_platforms,
+            deadline=deadline,
+        ):
+            yield format_sse(event)
+        logger.info("=== Streaming content generation request completed ===")
+    
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # Disable proxy buffering so events flush immediately
+        },
+    )
+
+
+@app.post("/generate/batch")
+async def generate_batch(
+    manifest: str = Form(..., description='JSON batch: {"items": [{"prompt": "...", "images": [0, 1], "platforms": ["x"], "id": "..."}]}'),
+    images: List[UploadFile] = File(..., description="Product images referenced by index from the manifest"),
+    concurrency: int = Form(BATCH_DEFAULT_CONCURRENCY, description="Campaigns to run at once"),
+):
+    """
+    Generate content for many campaigns in one request.
+    
+    - **manifest**: JSON object with an `items` list. Each item has a `prompt`, the
+      `images` it uses (indices into the uploaded `images` list), and optional
+      `platforms` and `id`
+    - **images**: All product images for the batch; images shared by several items
+      are uploaded once
+    - **concurrency**: How many campaigns run at once across the batch
+    
+    Streams newline-delimited JSON, one result object per campaign in completion order.
+    """
+    logger.info("=== Starting batch generation request ===")
+    logger.info("Number of images provided: %s", len(images))
+    
+    try:
+        request = BatchRequest.model_validate_json(manifest)
+    except ValidationError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch manifest: {e}")
+    
+    try:
+        uploaded_images = await upload_product_images(images)
+    except Exception as e:
+        logger.error("Image upload failed: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Image upload failed: {str(e)}")
+    
+    try:
+        campaigns = resolve_batch(request, uploaded_images)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    async def result_lines():
+        async for item_result in run_batch(campaigns, concurrency):
+            yield item_result.model_dump_json() + "\n"
+        logger.info("=== Batch generation request completed ===")
+    
+    return StreamingResponse(
+        result_lines(),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/jobs/generate", response_model=JobStatusResponse, status_code=202)
+async def submit_generate_job(
+    prompt: str = Form(..., description="User's prompt describing the product/company"),
+    images: Optional[List[UploadFile]] = File(None, description="Product images (at least one image, URL or digest required)"),
+    image_urls: Optional[str] = Form(None, description="Comma-separated URLs of product images already on the Fal CDN"),
+    image_digests: Optional[str] = Form(None, description="Comma-separated SHA-256 digests of product images uploaded before"),
+    platforms: Optional[str] = Form(None, description="Comma-separated platforms to generate (linkedin, x, instagram); defaults to all"),
+):
+    """
+    Submit a generate request as a background job and return immediately.
+    
+    - **prompt**: Description of the product, company, or marketing campaign
+    - **images**, **image_urls**, **image_digests**: Product images, as for `/generate`
+    - **platforms**: Optional comma-separated subset of platforms
+    
+    Images are uploaded before the job is queued; generation runs on the worker pool.
+    Poll `GET /jobs/{job_id}` for status and fetch `GET /jobs/{job_id}/result` once it
+    has succeeded. Returns 503 with a Retry-After header when the queue is full.
+    """
+    logger.info("=== Submitting generate job ===")
+    logger.info("Prompt: %.100s", prompt)
+    
+    selected_platforms = parse_platforms(platforms)
+    logger.info("Platforms requested: %s", ', '.join(selected_platforms))
+    
+    job_manager = get_job_manager()
+    if job_manager.queued >= job_manager.max_queue_size:
+        # Reject before paying for the uploads
+        raise HTTPException(status_code=503, detail="Job queue is full, retry later", headers={"Retry-After": "30"})
+    
+    # UploadFile spools are closed once the request ends, so upload before queueing
+    uploaded_images = await collect_product_images(images, image_urls, image_digests)
+    try:
+        product_image_urls = await reference_image_urls(uploaded_images)
+    except Exception as e:
+        logger.error("Image upload failed: %s", e, exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Image upload failed: {str(e)}")
+    
+    key = generate_request_key(
+        prompt, [image.digest for image in uploaded_images], selected_platforms, GENERATE_DEADLINE_SECONDS
+    )
+    try:
+        job = await job_manager.submit(
+            lambda: get_request_coalescer().do(
+                key,
+                # The deadline starts when a worker picks the job up, not while it is queued
+                lambda: generate_campaign(
+                    prompt, product_image_urls, selected_platforms, Deadline(GENERATE_DEADLINE_SECONDS)
+                ),
+            )
+        )
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    
+    return job_status_response(job)
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_job_status(job_id: str):
+    """Return the status of a background generate job."""
+    job = await get_job_manager().lookup(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job_status_response(job)
+
+
+@app.get("/jobs/{job_id}/result", response_model=GenerateResponse)
+async def get_job_result(job_id: str):
+    """
+    Return the result of a finished background generate job.
+    
+    Returns 409 while the job is still queued or running and 500 if it failed.
+    """
+    job = await get_job_manager().lookup(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    if job.status == JobStatus.FAILED:
+        raise HTTPException(status_code=500, detail=f"Content generation failed: {job.error}")
+    if job.status != JobStatus.SUCCEEDED:
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is {job.status.value}")
+    return job.result
+
+
 @app.post("/edit", response_model=EditResponse)
 async def edit_content(
     prompt: str = Form(..., description="Edit instructions with optional tags (@hook, @body, @outro, @image)"),
@@ -198,6 +672,7 @@ async def edit_content(
     body: str = Form(..., description="The current body content"),
     outro: str = Form(..., description="The current outro content"),
     image_url: Optional[str] = Form(None, description="The current image URL (required if @image tag is used)"),
+    timeout_seconds: Optional[float] = Form(None, description="Deadline for the whole request in seconds (capped server-side)"),
 ):
     """
     Edit existing social media content based on user instructions with tag-based targeting.
@@ -212,107 +687,49 @@ async def edit_content(
     - **body**: The current body content
     - **outro**: The current outro content
     - **image_url**: The current image URL (required if @image tag is used)
+    - **timeout_seconds**: Optional deadline for the whole request
     
     Returns the edited content (hook, body, outro) and optionally a new image URL.
+    Parts that fail or run out of time keep their current value; `status` reports
+    what happened to each part.
     """
-    logger.info(f"=== Starting content edit request ===")
-    logger.info(f"Edit instructions: {prompt[:100]}..." if len(prompt) > 100 else f"Edit instructions: {prompt}")
-    logger.info(f"Original hook: {hook[:50]}..." if len(hook) > 50 else f"Original hook: {hook}")
-    logger.info(f"Original body: {body[:50]}..." if len(body) > 50 else f"Original body: {body}")
-    logger.info(f"Original outro: {outro[:50]}..." if len(outro) > 50 else f"Original outro: {outro}")
-    logger.info(f"Image URL provided: {image_url is not None}")
+    logger.info("=== Starting content edit request ===")
+    logger.info("Edit instructions: %.100s", prompt)
+    logger.debug("Original hook: %.50s | body: %.50s | outro: %.50s", hook, body, outro)
+    logger.info("Image URL provided: %s", image_url is not None)
+    deadline = make_deadline(timeout_seconds, EDIT_DEADLINE_SECONDS)
     
     try:
         # Parse tags from the prompt
         tags = parse_edit_tags(prompt)
-        logger.info(f"Parsed tags from prompt: {tags if tags else 'none (will edit all text parts)'}")
-        
-        # Initialize with current values
-        new_hook = hook
-        new_body = body
-        new_outro = outro
-        new_image_url = image_url
-        
-        # Create full context for editing
-        full_context = f"Hook: {hook}\n\nBody: {body}\n\nOutro: {outro}"
+        logger.info("Parsed tags from prompt: %s", tags if tags else 'none (will edit all text parts)')
         
-        # Determine which parts to edit
-        text_tags = tags - {"image"}  # Remove image tag for text editing logic
-        
-        if not text_tags:
-            # No specific text tags found - edit all text parts
-            logger.info("No specific tags found, editing all text parts...")
-            new_hook, new_body, new_outro = await edit_full_content(
-                hook=hook,
-                body=body,
-                outro=outro,
-                edit_instructions=prompt,
+        if "image" in tags and not image_url:
+            raise HTTPException(
+                status_code=400,
+                detail="image_url is required when using @image tag"
             )
-        else:
-            # Edit only the specified parts in parallel
-            import asyncio
-            
-            tasks = []
-            task_mapping = []  # To track which task corresponds to which part
-            
-            if "hook" in text_tags:
-                logger.info("Editing hook...")
-                tasks.append(edit_content_part("hook", hook, full_context, prompt))
-                task_mapping.append("hook")
-            
-            if "body" in text_tags:
-                logger.info("Editing body...")
-                tasks.append(edit_content_part("body", body, full_context, prompt))
-                task_mapping.append("body")
-            
-            if "outro" in text_tags:
-                logger.info("Editing outro...")
-                tasks.append(edit_content_part("outro", outro, full_context, prompt))
-                task_mapping.append("outro")
-            
-            if tasks:
-                results = await asyncio.gather(*tasks)
-                for i, part_name in enumerate(task_mapping):
-                    if part_name == "hook":
-                        new_hook = results[i]
-                    elif part_name == "body":
-                        new_body = results[i]
-                    elif part_name == "outro":
-                        new_outro = results[i]
         
-        # Generate new image only if @image tag is present
-        if "image" in tags:
-            if not image_url:
-                raise HTTPException(
-                    status_code=400,
-                    detail="image_url is required when using @image tag"
-                )
-            
-            logger.info("Generating new image (due to @image tag)...")
-            full_content = f"{new_hook}\n\n{new_body}\n\n{new_outro}"
-            new_image_url = await generate_edited_image(
-                original_content=f"{hook}\n\n{body}\n\n{outro}",
-                edit_instructions=prompt,
-                edited_content=full_content,
-                original_image_url=image_url,
-            )
-            logger.info("New image generated successfully")
+        # Identical edits already in flight (double-clicks, retries) share one execution
+        key = edit_request_key(prompt, hook, body, outro, image_url, deadline.budget_seconds)
+        response = await get_request_coalescer().do(
+            key,
+            lambda: perform_edit(prompt, tags, hook, body, outro, image_url, deadline),
+        )
         
         logger.info("=== Content edit request completed successfully ===")
-        return EditResponse(
-            hook=new_hook,
-            body=new_body,
-            outro=new_outro,
-            image_url=new_image_url,
-        )
+        return response
         
+    except DeadlineExceededError as e:
+        logger.error("Content edit timed out: %s", e)
+        raise HTTPException(status_code=504, detail=str(e))
     except ImageGenerationError as e:
-        logger.error(f"Image generation error during edit: {e}")
+        logger.error("Image generation error during edit: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Content editing failed: {e}", exc_info=True)
+        logger.error("Content editing failed: %s", e, exc_info=True)
         raise HTTPException(status_code=500, detail=f"Content editing failed: {str(e)}")
 
 
@@ -323,4 +740,5 @@ async def edit_content(
 if __name__ == "__main__":
     import uvicorn
     logger.info("Starting AI Marketing Tool API server on port 8000...")
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # log_config=None: uvicorn's loggers go through the queue-backed root handler
+    uvicorn.run(app, host="0.0.0.0", port=8000, log_config=None)
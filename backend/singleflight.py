@@ -0,0 +1,129 @@
+"""
+Single-flight coalescing of identical in-flight requests
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_text(text: str | None) -> str:
+    """Collapse whitespace so trivially different copies of a request share a key."""
+    return " ".join((text or "").split())
+
+
+def _hash_fields(kind: str, fields: dict) -> str:
+    payload = json.dumps({"kind": kind, **fields}, sort_keys=True, ensure_ascii=False)
+    return f"{kind}:{hashlib.sha256(payload.encode()).hexdigest()}"
+
+
+def generate_request_key(
+    prompt: str,
+    image_digests: Sequence[str],
+    platforms: Sequence[str],
+    budget_seconds: float,
+) -> str:
+    """
+    Return the coalescing key for a generate request.
+
+    The deadline budget is part of the key: a caller only shares an execution
+    running under the same budget, never one that would time out sooner (or
+    later) than it asked for.
+    """
+    return _hash_fields("generate", {
+        "prompt": _normalize_text(prompt),
+        "images": list(image_digests),
+        "platforms": sorted(platforms),
+        "budget_seconds": budget_seconds,
+    })
+
+
+def edit_request_key(
+    prompt: str,
+    hook: str,
+    body: str,
+    outro: str,
+    image_url: str | None,
+    budget_seconds: float,
+) -> str:
+    """
+    Return the coalescing key for an edit request (see generate_request_key for the budget).
+
+    Only the instructions are whitespace-normalized. Line breaks and spacing in
+    the hook, body and outro are part of the post being edited (and of the
+    edited result), so they are only stripped at the ends.
+    """
+    return _hash_fields("edit", {
+        "prompt": _normalize_text(prompt),
+        "hook": (hook or "").strip(),
+        "body": (body or "").strip(),
+        "outro": (outro or "").strip(),
+        "image_url": image_url or "",
+        "budget_seconds": budget_seconds,
+    })
+
+
+class SingleFlight:
+    """
+    Share one execution among concurrent callers with the same key.
+
+    The first caller for a key starts the work as a task; callers arriving while it
+    is in flight await the same task and receive its result or exception. The work
+    keeps running if an individual caller goes away, and is only cancelled once no
+    caller is waiting on it any more.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.create_task(fn())
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda t, key=key: self._finish(key, t))
+        else:
+            self.coalesced += 1
+            logger.info("Coalescing duplicate in-flight request %.24s... (%s waiting)",
+                        key, self._waiters[key] + 1)
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and self._waiters.get(key) == 1:
+                logger.info("Last waiter for %s... went away, cancelling shared execution", key[:24])
+                # Forget the task now rather than in _finish: it only finishes on a later
+                # loop iteration, and a caller arriving before then must start afresh
+                # instead of joining a cancelled execution
+                del self._inflight[key]
+                del self._waiters[key]
+                task.cancel()
+            raise
+        finally:
+            if key in self._waiters and self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            del self._waiters[key]
+        # Mark the exception as retrieved even if every waiter has gone away
+        if not task.cancelled():
+            task.exception()
+
+
+@lru_cache(maxsize=1)
+def get_request_coalescer() -> SingleFlight:
+    """Return a singleton coalescer shared by the generate and edit endpoints."""
+    return SingleFlight()
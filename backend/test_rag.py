@@ -6,6 +6,8 @@ import asyncio
 import os
 from dotenv import load_dotenv
 
+from logging_config import configure_logging
+
 # Load environment variables
 load_dotenv()
 
@@ -24,7 +26,7 @@ async def test_qdrant_connection():
             return False
         
         # Test connection by getting collections
-        collections = client.get_collections()
+        collections = await client.get_collections()
         print(f"✅ Connected to Qdrant successfully")
         print(f"📦 Found {len(collections.collections)} collections:")
         for col in collections.collections:
@@ -204,5 +206,6 @@ async def main():
 
 
 if __name__ == "__main__":
+    configure_logging()
     asyncio.run(main())
 
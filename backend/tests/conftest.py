@@ -0,0 +1,8 @@
+"""
+Shared test setup: the backend modules are flat, so import them from the parent directory
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,166 @@
+"""
+Tests for the memory tier, the SQLite backend and tiered lookups
+"""
+
+import asyncio
+
+from cache import CacheBackend, SQLiteBackend, TieredCache, TTLCache
+
+
+class FailingBackend(CacheBackend):
+    """A shared backend that is down."""
+
+    name = "failing"
+
+    async def get(self, key):
+        raise ConnectionError("backend down")
+
+    async def set(self, key, value, ttl_seconds):
+        raise ConnectionError("backend down")
+
+    async def delete(self, key):
+        raise ConnectionError("backend down")
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# TTLCache
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    memory = TTLCache(max_entries=2, ttl_seconds=60)
+    memory.set("a", 1)
+    memory.set("b", 2)
+    assert memory.get("a") == 1  # "b" is now the least recently used
+    memory.set("c", 3)
+    assert memory.get("b") is None
+    assert (memory.get("a"), memory.get("c")) == (1, 3)
+    assert len(memory) == 2
+
+
+def test_ttl_cache_expires_entries():
+    memory = TTLCache(max_entries=10, ttl_seconds=60)
+    memory.set("stale", 1, ttl_seconds=-1)
+    memory.set("fresh", 2)
+    assert memory.get("stale") is None
+    assert memory.get("fresh") == 2
+    assert len(memory) == 1
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# SQLiteBackend
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+def test_sqlite_round_trips_json_values(tmp_path):
+    backend = SQLiteBackend(tmp_path / "cache.sqlite3")
+
+    async def main():
+        await backend.set("job", {"status": "queued", "urls": ["https://fal.media/a.png"]}, 60)
+        value = await backend.get("job")
+        await backend.delete("job")
+        return value, await backend.get("job")
+
+    assert asyncio.run(main()) == ({"status": "queued", "urls": ["https://fal.media/a.png"]}, None)
+
+
+def test_sqlite_skips_expired_rows(tmp_path):
+    backend = SQLiteBackend(tmp_path / "cache.sqlite3")
+
+    async def main():
+        await backend.set("stale", 1, -1)
+        return await backend.get("stale")
+
+    assert asyncio.run(main()) is None
+
+
+def test_sqlite_purges_expired_rows(tmp_path):
+    backend = SQLiteBackend(tmp_path / "cache.sqlite3", purge_every=2)
+
+    async def main():
+        await backend.set("stale", 1, -1)
+        await backend.set("fresh", 2, 60)
+
+    asyncio.run(main())
+    rows = backend._connect().execute("SELECT key FROM cache").fetchall()
+    assert rows == [("fresh",)]
+
+
+def test_sqlite_is_shared_between_instances(tmp_path):
+    # Two workers on one host open the same file
+    writer = SQLiteBackend(tmp_path / "cache.sqlite3")
+    reader = SQLiteBackend(tmp_path / "cache.sqlite3")
+
+    async def main():
+        await writer.set("upload", "https://fal.media/a.png", 60)
+        return await reader.get("upload")
+
+    assert asyncio.run(main()) == "https://fal.media/a.png"
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# TieredCache
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+def test_tiered_cache_promotes_shared_hits_into_memory(tmp_path):
+    backend = SQLiteBackend(tmp_path / "cache.sqlite3")
+    other_worker = TieredCache("uploads", 60, TTLCache(10, 60), backend)
+    this_worker = TieredCache("uploads", 60, TTLCache(10, 60), backend)
+
+    async def main():
+        await other_worker.set("digest", "https://fal.media/a.png")
+        return await this_worker.get("digest")
+
+    assert asyncio.run(main()) == "https://fal.media/a.png"
+    assert this_worker.memory.get("digest") == "https://fal.media/a.png"
+
+
+def test_tiered_cache_namespaces_keys_by_name(tmp_path):
+    backend = SQLiteBackend(tmp_path / "cache.sqlite3")
+    uploads = TieredCache("uploads", 60, backend=backend)
+    jobs = TieredCache("jobs", 60, backend=backend)
+
+    async def main():
+        await uploads.set("key", "upload")
+        return await jobs.get("key")
+
+    assert asyncio.run(main()) is None
+
+
+def test_tiered_cache_without_memory_reads_the_backend(tmp_path):
+    backend = SQLiteBackend(tmp_path / "cache.sqlite3")
+    cache = TieredCache("jobs", 60, backend=backend)
+    assert cache.shared
+
+    async def main():
+        await cache.set("job", {"status": "queued"})
+        await cache.set("job", {"status": "running"})
+        return await cache.get("job")
+
+    assert asyncio.run(main()) == {"status": "running"}
+
+
+def test_tiered_cache_treats_backend_failures_as_misses():
+    cache = TieredCache("uploads", 60, TTLCache(10, 60), FailingBackend())
+
+    async def main():
+        await cache.set("digest", "url")
+        memory_hit = await cache.get("digest")
+        cache.memory.delete("digest")
+        backend_error = await cache.get("digest")
+        await cache.delete("digest")
+        return memory_hit, backend_error
+
+    assert asyncio.run(main()) == ("url", None)
+
+
+def test_memory_only_cache_is_not_shared():
+    cache = TieredCache("retrieval", 60, TTLCache(10, 60))
+    assert not cache.shared
+
+    async def main():
+        await cache.set("query", ["post"])
+        return await cache.get("query")
+
+    assert asyncio.run(main()) == ["post"]
@@ -0,0 +1,99 @@
+"""
+Tests for per-request deadline budgets
+"""
+
+import asyncio
+
+import pytest
+
+from deadlines import Deadline, DeadlineExceededError
+
+
+def test_remaining_counts_down_and_never_goes_negative():
+    deadline = Deadline(60)
+    assert 59 < deadline.remaining() <= 60
+    assert not deadline.expired
+    deadline.expires_at -= 120
+    assert deadline.remaining() == 0.0
+    assert deadline.expired
+
+
+def test_run_returns_the_stage_result():
+    async def main():
+        return await Deadline(5).run(asyncio.sleep(0, result="ok"), stage="text")
+
+    assert asyncio.run(main()) == "ok"
+
+
+def test_run_reraises_the_stage_error():
+    async def stage():
+        raise ValueError("bad output")
+
+    with pytest.raises(ValueError):
+        asyncio.run(Deadline(5).run(stage()))
+
+
+def test_expired_deadline_skips_the_stage():
+    started = False
+
+    async def stage():
+        nonlocal started
+        started = True
+
+    deadline = Deadline(5)
+    deadline.expires_at -= 10
+    with pytest.raises(DeadlineExceededError, match="skipped"):
+        asyncio.run(deadline.run(stage(), stage="image"))
+    assert not started
+
+
+def test_stage_past_the_deadline_is_cancelled_and_awaited():
+    events = []
+
+    async def stage():
+        try:
+            await asyncio.sleep(10)
+        finally:
+            # Cleanup that itself awaits, e.g. cancelling the provider job
+            await asyncio.sleep(0.01)
+            events.append("cleaned up")
+
+    async def main():
+        try:
+            await Deadline(0.01).run(stage(), stage="image")
+        except DeadlineExceededError:
+            events.append("raised")
+
+    asyncio.run(main())
+    assert events == ["cleaned up", "raised"]
+
+
+def test_caller_cancellation_cancels_and_awaits_the_stage():
+    events = []
+
+    async def stage():
+        try:
+            await asyncio.sleep(10)
+        finally:
+            await asyncio.sleep(0.01)
+            events.append("cleaned up")
+
+    async def main():
+        task = asyncio.create_task(Deadline(10).run(stage()))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        events.append("cancelled")
+
+    asyncio.run(main())
+    assert events == ["cleaned up", "cancelled"]
+
+
+def test_inner_timeout_is_not_relabelled():
+    async def stage():
+        # The stage's own timeout (e.g. a socket read) fires well before the request deadline
+        await asyncio.wait_for(asyncio.sleep(10), timeout=0.01)
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(Deadline(10).run(stage()))
@@ -0,0 +1,172 @@
+"""
+Tests for hedged agent calls: hedge timing, the hedge budget and model fallback
+"""
+
+import asyncio
+
+import pytest
+
+from hedging import Hedger
+
+FALLBACK = "fallback-model"
+
+
+def make_hedger(**overrides) -> Hedger:
+    config = dict(
+        percentile=0.9,
+        min_samples=5,
+        min_delay_seconds=0.01,
+        max_ratio=1.0,
+        fallback_model=FALLBACK,
+    )
+    config.update(overrides)
+    return Hedger(**config)
+
+
+def warm(hedger: Hedger, key: str, seconds: float = 0.01, count: int = 10) -> None:
+    """Give a key enough latency samples to be hedged."""
+    for _ in range(count):
+        hedger._record(key, seconds)
+
+
+class Attempts:
+    """Fake agent call: a slow primary and a fast fallback, or failures on request."""
+
+    def __init__(self, primary_seconds: float = 0.0, fail: tuple = ()):
+        self.primary_seconds = primary_seconds
+        self.fail = fail
+        self.models = []
+        self.cancelled = []
+
+    async def __call__(self, model):
+        name = "primary" if model is None else model
+        self.models.append(name)
+        try:
+            if model is None:
+                await asyncio.sleep(self.primary_seconds)
+        except asyncio.CancelledError:
+            self.cancelled.append(name)
+            raise
+        if name in self.fail:
+            raise RuntimeError(f"{name} failed")
+        return name
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Hedge Timing
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+def test_no_hedge_until_enough_samples():
+    hedger = make_hedger()
+    warm(hedger, "text", count=4)
+    assert hedger.hedge_delay("text") is None
+    warm(hedger, "text", count=1)
+    assert hedger.hedge_delay("text") is not None
+    assert hedger.hedge_delay("other") is None
+
+
+def test_hedge_delay_is_the_percentile_with_a_floor():
+    hedger = make_hedger(min_delay_seconds=0.5)
+    for seconds in range(1, 11):
+        hedger._record("text", float(seconds))
+    assert hedger.hedge_delay("text") == 10.0
+    hedger = make_hedger(min_delay_seconds=0.5)
+    warm(hedger, "text", seconds=0.1)
+    assert hedger.hedge_delay("text") == 0.5
+
+
+def test_fast_primary_is_not_hedged():
+    hedger = make_hedger()
+    warm(hedger, "text", seconds=1.0)
+    attempts = Attempts(primary_seconds=0.0)
+
+    assert asyncio.run(hedger.run("text", attempts)) == "primary"
+    assert attempts.models == ["primary"]
+    assert hedger.hedges == 0
+
+
+def test_slow_primary_is_hedged_and_the_loser_cancelled():
+    hedger = make_hedger()
+    warm(hedger, "text")
+    attempts = Attempts(primary_seconds=10.0)
+
+    assert asyncio.run(hedger.run("text", attempts)) == FALLBACK
+    assert attempts.models == ["primary", FALLBACK]
+    assert attempts.cancelled == ["primary"]
+    assert (hedger.hedges, hedger.hedge_wins) == (1, 1)
+
+
+def test_unsampled_key_waits_for_the_primary():
+    hedger = make_hedger()
+    attempts = Attempts(primary_seconds=0.05)
+
+    assert asyncio.run(hedger.run("text", attempts)) == "primary"
+    assert attempts.models == ["primary"]
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Hedge Budget
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+def test_zero_budget_never_hedges():
+    hedger = make_hedger(max_ratio=0.0)
+    warm(hedger, "text")
+    attempts = Attempts(primary_seconds=0.05)
+
+    assert asyncio.run(hedger.run("text", attempts)) == "primary"
+    assert attempts.models == ["primary"]
+    assert hedger.hedges == 0
+
+
+def test_hedges_stay_within_the_budget_ratio():
+    hedger = make_hedger(max_ratio=0.25)
+    # Enough fast samples that the slow unhedged calls don't move the percentile
+    warm(hedger, "text", count=100)
+
+    async def main():
+        for _ in range(8):
+            await hedger.run("text", Attempts(primary_seconds=0.05))
+
+    asyncio.run(main())
+    assert hedger.calls == 8
+    assert hedger.hedges == 2
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Fallback
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+def test_failed_primary_falls_back_immediately():
+    hedger = make_hedger()
+    attempts = Attempts(fail=("primary",))
+
+    assert asyncio.run(hedger.run("text", attempts)) == FALLBACK
+    assert attempts.models == ["primary", FALLBACK]
+    assert hedger.fallbacks == 1
+
+
+def test_failed_primary_without_fallback_model_raises():
+    hedger = make_hedger(fallback_model=None)
+    attempts = Attempts(fail=("primary",))
+
+    with pytest.raises(RuntimeError, match="primary failed"):
+        asyncio.run(hedger.run("text", attempts))
+    assert attempts.models == ["primary"]
+
+
+def test_all_attempts_failing_raises_the_first_error():
+    hedger = make_hedger()
+    attempts = Attempts(fail=("primary", FALLBACK))
+
+    with pytest.raises(RuntimeError, match="primary failed"):
+        asyncio.run(hedger.run("text", attempts))
+    assert attempts.models == ["primary", FALLBACK]
+
+
+def test_fallback_latency_is_not_recorded():
+    hedger = make_hedger()
+    asyncio.run(hedger.run("text", Attempts(fail=("primary",))))
+    assert "text" not in hedger._latencies
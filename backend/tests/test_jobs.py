@@ -0,0 +1,90 @@
+"""
+Tests for the background job manager and its shared job state
+"""
+
+import asyncio
+
+import pytest
+
+from jobs import JobManager, JobStatus, QueueFullError
+
+
+class SlowQueuedStore:
+    """A shared store whose first (QUEUED) write is slow, as a remote write can be."""
+
+    shared = True
+
+    def __init__(self):
+        self.values = {}
+        self.writes = []
+
+    async def set(self, key, value, ttl_seconds=None):
+        if not self.writes:
+            await asyncio.sleep(0.05)
+        self.values[key] = value
+        self.writes.append(value["status"])
+
+    async def get(self, key):
+        return self.values.get(key)
+
+
+def test_submit_returns_once_the_job_is_visible_in_the_store():
+    store = SlowQueuedStore()
+    manager = JobManager(concurrency=1, max_queue_size=10, result_ttl_seconds=60, store=store)
+    release = None
+
+    async def work():
+        await release.wait()
+        return {"ok": True}
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        await manager.start()
+        job = await manager.submit(work)
+        visible = job.id in store.values
+        await asyncio.sleep(0.01)
+        status_while_running = store.values[job.id]["status"]
+        release.set()
+        while not job.done:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.01)
+        await manager.stop()
+        return visible, status_while_running, store.values[job.id]["status"]
+
+    visible, running, final = asyncio.run(main())
+    assert visible
+    # The slow QUEUED write never lands on top of a later state
+    assert running == JobStatus.RUNNING.value
+    assert final == JobStatus.SUCCEEDED.value
+    assert store.writes[-1] == JobStatus.SUCCEEDED.value
+
+
+def test_submit_rejects_when_the_queue_is_full():
+    manager = JobManager(concurrency=1, max_queue_size=1, result_ttl_seconds=60)
+    release = None
+
+    async def work():
+        await release.wait()
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        await manager.start()
+        await manager.submit(work)  # Taken by the worker
+        await asyncio.sleep(0)
+        await manager.submit(work)  # Waits in the queue
+        try:
+            with pytest.raises(QueueFullError):
+                await manager.submit(work)
+        finally:
+            release.set()
+            await manager.stop()
+
+    asyncio.run(main())
+
+
+def test_submit_requires_running_workers():
+    manager = JobManager(concurrency=1, max_queue_size=1, result_ttl_seconds=60)
+    with pytest.raises(RuntimeError):
+        asyncio.run(manager.submit(lambda: asyncio.sleep(0)))
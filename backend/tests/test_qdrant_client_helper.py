@@ -0,0 +1,108 @@
+"""
+Tests for Qdrant retrieval against an in-memory collection
+"""
+
+import asyncio
+
+import pytest
+from qdrant_client import AsyncQdrantClient
+from qdrant_client.models import Distance, PointStruct, VectorParams
+
+import qdrant_client_helper
+from qdrant_client_helper import (
+    CollectionInfo,
+    search_similar_posts_batch,
+    search_similar_posts_with_embedding,
+)
+
+COLLECTION = "test_posts"
+
+POSTS = [
+    ([1.0, 0.0, 0.0], "linkedin", "LinkedIn post about launches"),
+    ([0.9, 0.1, 0.0], "linkedin", "LinkedIn post about hiring"),
+    ([1.0, 0.0, 0.0], "x", "X post about launches"),
+    ([0.0, 1.0, 0.0], "instagram", "Instagram caption"),
+]
+
+
+@pytest.fixture
+def use_client(monkeypatch):
+    """Point the helper at an in-memory client holding POSTS; call it inside the test's event loop."""
+    # Collection metadata is cached per process; don't keep it across tests
+    qdrant_client_helper.get_collection_info_cache.cache_clear()
+
+    async def setup() -> AsyncQdrantClient:
+        client = AsyncQdrantClient(":memory:")
+        await client.create_collection(COLLECTION, vectors_config=VectorParams(size=3, distance=Distance.COSINE))
+        await client.upsert(COLLECTION, points=[
+            PointStruct(id=idx, vector=vector, payload={"platform": platform, "text": text})
+            for idx, (vector, platform, text) in enumerate(POSTS)
+        ])
+        monkeypatch.setattr(qdrant_client_helper, "get_qdrant_client", lambda: client)
+        return client
+
+    yield setup
+    qdrant_client_helper.get_collection_info_cache.cache_clear()
+
+
+def test_search_filters_by_platform_and_ranks_by_similarity(use_client):
+    async def main():
+        await use_client()
+        return await search_similar_posts_with_embedding([1.0, 0.0, 0.0], "linkedin", limit=3, collection_name=COLLECTION)
+
+    posts = asyncio.run(main())
+    assert [post["text"] for post in posts] == ["LinkedIn post about launches", "LinkedIn post about hiring"]
+    assert posts[0]["score"] == pytest.approx(1.0)
+    assert posts[0]["metadata"]["platform"] == "linkedin"
+
+
+def test_batch_search_answers_each_query_in_order(use_client):
+    async def main():
+        await use_client()
+        return await search_similar_posts_batch(
+            [([1.0, 0.0, 0.0], "x"), ([0.0, 1.0, 0.0], "instagram"), ([1.0, 0.0, 0.0], "linkedin")],
+            limit=1,
+            collection_name=COLLECTION,
+        )
+
+    results = asyncio.run(main())
+    assert [[post["text"] for post in posts] for posts in results] == [
+        ["X post about launches"],
+        ["Instagram caption"],
+        ["LinkedIn post about launches"],
+    ]
+
+
+def test_mismatched_dimensions_return_no_posts(use_client):
+    async def main():
+        await use_client()
+        return await search_similar_posts_with_embedding([1.0, 0.0], "linkedin", collection_name=COLLECTION)
+
+    assert asyncio.run(main()) == []
+
+
+def test_search_errors_return_no_posts_unless_raised(use_client, monkeypatch):
+    async def main():
+        client = await use_client()
+
+        async def failing_query(**kwargs):
+            raise ConnectionError("qdrant down")
+
+        monkeypatch.setattr(client, "query_points", failing_query)
+        monkeypatch.setattr(client, "query_batch_points", failing_query)
+        swallowed = await search_similar_posts_with_embedding([1.0, 0.0, 0.0], "x", collection_name=COLLECTION)
+        swallowed_batch = await search_similar_posts_batch([([1.0, 0.0, 0.0], "x")], collection_name=COLLECTION)
+        with pytest.raises(ConnectionError):
+            await search_similar_posts_with_embedding([1.0, 0.0, 0.0], "x", collection_name=COLLECTION, raise_errors=True)
+        with pytest.raises(ConnectionError):
+            await search_similar_posts_batch([([1.0, 0.0, 0.0], "x")], collection_name=COLLECTION, raise_errors=True)
+        return swallowed, swallowed_batch
+
+    assert asyncio.run(main()) == ([], [[]])
+
+
+def test_collection_info_validates_queries():
+    info = CollectionInfo(name=COLLECTION, exists=True, vector_size=3, distance="Cosine")
+    assert info.validate_query([0.0, 0.0, 1.0]) is None
+    assert "dimensions" in info.validate_query([0.0, 1.0])
+    assert "does not exist" in CollectionInfo(name=COLLECTION, exists=False).validate_query([0.0])
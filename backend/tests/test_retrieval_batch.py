@@ -0,0 +1,131 @@
+"""
+Tests for batching one request's per-platform retrievals into one Qdrant search
+"""
+
+import asyncio
+from collections import deque
+
+import pytest
+
+import agents
+import qdrant_client_helper
+from agents import RetrievalBatch, create_retrieval_batch
+
+
+@pytest.fixture(autouse=True)
+def fresh_arrival_gaps(monkeypatch):
+    # Gaps are tracked across requests; start each test without history
+    monkeypatch.setattr(RetrievalBatch, "_arrival_gaps", deque(maxlen=200))
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    """Record each batched search and answer every query with its own text."""
+    calls = []
+
+    async def fake_batch(queries, limit=3, collection_name=None):
+        calls.append(list(queries))
+        return [[f"{platform}: {query_text}"] for query_text, platform in queries]
+
+    monkeypatch.setattr(qdrant_client_helper, "retrieve_similar_posts_batch", fake_batch)
+    return calls
+
+
+def test_flushes_once_every_platform_has_queried(searches):
+    batch = RetrievalBatch(["linkedin", "x", "instagram"], limit=3, max_wait_seconds=10)
+
+    async def main():
+        return await asyncio.gather(
+            batch.retrieve("draft a", "linkedin"),
+            batch.retrieve("draft b", "x"),
+            batch.retrieve("draft c", "instagram"),
+        )
+
+    results = asyncio.run(asyncio.wait_for(main(), timeout=1))
+    assert results == [["linkedin: draft a"], ["x: draft b"], ["instagram: draft c"]]
+    assert searches == [[("draft a", "linkedin"), ("draft b", "x"), ("draft c", "instagram")]]
+
+
+def test_skipped_platform_releases_the_batch(searches):
+    batch = RetrievalBatch(["linkedin", "x"], limit=3, max_wait_seconds=10)
+
+    async def main():
+        waiting = asyncio.create_task(batch.retrieve("draft", "linkedin"))
+        await asyncio.sleep(0)
+        batch.skip("x")  # Answered from the retrieval cache
+        return await waiting
+
+    assert asyncio.run(asyncio.wait_for(main(), timeout=1)) == ["linkedin: draft"]
+    assert searches == [[("draft", "linkedin")]]
+
+
+def test_flushes_after_max_wait_when_a_platform_never_queries(searches):
+    batch = RetrievalBatch(["linkedin", "x"], limit=3, max_wait_seconds=0.05)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        result = await batch.retrieve("draft", "linkedin")
+        return result, loop.time() - start
+
+    result, waited = asyncio.run(main())
+    assert result == ["linkedin: draft"]
+    assert waited >= 0.05
+
+
+def test_late_platform_opens_a_new_batch(searches):
+    batch = RetrievalBatch(["linkedin", "x", "instagram"], limit=3, max_wait_seconds=0.02)
+
+    async def main():
+        first = asyncio.create_task(batch.retrieve("draft a", "linkedin"))
+        await first
+        return await asyncio.gather(batch.retrieve("draft b", "x"), batch.retrieve("draft c", "instagram"))
+
+    asyncio.run(asyncio.wait_for(main(), timeout=1))
+    assert searches == [[("draft a", "linkedin")], [("draft b", "x"), ("draft c", "instagram")]]
+
+
+def test_searches_at_once_when_others_usually_arrive_later(searches):
+    # Recent requests' other platforms arrived well after the window
+    RetrievalBatch._arrival_gaps.extend([3.0] * RetrievalBatch.MIN_GAP_SAMPLES)
+    batch = RetrievalBatch(["linkedin", "x"], limit=3, max_wait_seconds=1)
+
+    async def main():
+        return await batch.retrieve("draft", "linkedin")
+
+    assert asyncio.run(asyncio.wait_for(main(), timeout=1)) == ["linkedin: draft"]
+
+
+def test_waits_when_others_usually_arrive_within_the_window():
+    RetrievalBatch._arrival_gaps.extend([0.01] * RetrievalBatch.MIN_GAP_SAMPLES)
+    batch = RetrievalBatch(["linkedin", "x"], limit=3, max_wait_seconds=0.1)
+    assert batch._worth_waiting(0.0)
+    assert not batch._worth_waiting(0.5)
+
+
+def test_search_error_reaches_every_waiter(monkeypatch):
+    async def failing_batch(queries, limit=3, collection_name=None):
+        raise ConnectionError("qdrant down")
+
+    monkeypatch.setattr(qdrant_client_helper, "retrieve_similar_posts_batch", failing_batch)
+    batch = RetrievalBatch(["linkedin", "x"], limit=3, max_wait_seconds=10)
+
+    async def main():
+        return await asyncio.gather(
+            batch.retrieve("draft a", "linkedin"),
+            batch.retrieve("draft b", "x"),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(asyncio.wait_for(main(), timeout=1))
+    assert [type(result) for result in results] == [ConnectionError, ConnectionError]
+
+
+def test_batching_is_off_by_default_and_for_single_platforms(monkeypatch):
+    monkeypatch.setattr(agents, "RAG_ENABLED", True)
+    monkeypatch.setattr(agents, "RETRIEVAL_BATCH_MAX_WAIT_MS", 0)
+    assert create_retrieval_batch(["linkedin", "x"]) is None
+    monkeypatch.setattr(agents, "RETRIEVAL_BATCH_MAX_WAIT_MS", 50)
+    assert create_retrieval_batch(["linkedin"]) is None
+    batch = create_retrieval_batch(["linkedin", "x"])
+    assert batch is not None and batch.max_wait_seconds == 0.05
@@ -0,0 +1,175 @@
+"""
+Tests for the AIMD provider limiter and HTTP 429 detection
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+from scheduler import AdaptiveLimiter, is_rate_limited
+
+
+def make_limiter(**overrides) -> AdaptiveLimiter:
+    config = dict(
+        name="test",
+        max_concurrency=8,
+        min_concurrency=1,
+        max_rate_per_second=1000.0,
+        min_rate_per_second=1.0,
+        latency_tolerance=2.0,
+        # No cooldown unless a test asks for one, so every decrease applies
+        cooldown_seconds=0.0,
+    )
+    config.update(overrides)
+    return AdaptiveLimiter(**config)
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+def http_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://openrouter.ai/api/v1/chat/completions")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status, request=request))
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# 429 Detection
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+def test_is_rate_limited_by_status_code_attribute():
+    assert is_rate_limited(RateLimited())
+
+
+def test_is_rate_limited_by_response_status():
+    assert is_rate_limited(http_error(429))
+    assert not is_rate_limited(http_error(500))
+
+
+def test_is_rate_limited_through_exception_chain():
+    try:
+        try:
+            raise http_error(429)
+        except httpx.HTTPStatusError as e:
+            raise RuntimeError("agent run failed") from e
+    except RuntimeError as wrapped:
+        assert is_rate_limited(wrapped)
+
+
+def test_is_rate_limited_ignores_other_errors():
+    assert not is_rate_limited(None)
+    assert not is_rate_limited(ValueError("bad output"))
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# AIMD
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+def test_success_grows_limit_additively_up_to_max():
+    limiter = make_limiter(max_concurrency=4)
+    limiter.limit = 2.0
+    limiter._on_success(1.0, "text")
+    assert limiter.limit == pytest.approx(2.5)
+    for _ in range(100):
+        limiter._on_success(1.0, "text")
+    assert limiter.limit == 4
+    assert limiter.rate == 1000.0
+
+
+def test_throttle_halves_limit_and_rate():
+    limiter = make_limiter()
+    limiter._on_throttled()
+    assert limiter.limit == 4
+    assert limiter.rate == 500.0
+    assert limiter.throttled == 1
+
+
+def test_throttle_respects_minimums():
+    limiter = make_limiter(max_concurrency=2, min_concurrency=1, max_rate_per_second=2.0, min_rate_per_second=1.5)
+    for _ in range(5):
+        limiter._on_throttled()
+    assert limiter.limit == 1
+    assert limiter.rate == 1.5
+
+
+def test_cooldown_backs_off_once_per_burst():
+    limiter = make_limiter(cooldown_seconds=60.0)
+    for _ in range(3):
+        limiter._on_throttled()
+    assert limiter.limit == 4
+    assert limiter.throttled == 3
+
+
+def test_slow_call_trims_limit_but_not_rate():
+    limiter = make_limiter()
+    limiter._on_success(1.0, "text")
+    limit = limiter.limit
+    limiter._on_success(5.0, "text")
+    assert limiter.limit == pytest.approx(limit * 0.9)
+    assert limiter.rate == 1000.0
+
+
+def test_latency_baselines_are_per_stage():
+    limiter = make_limiter()
+    limiter.limit = 4.0
+    limiter._on_success(1.0, "rag_initial")
+    limiter._on_success(10.0, "text")
+    limit = limiter.limit
+    # A long final post is slow next to a short draft, but not next to other final posts
+    limiter._on_success(12.0, "text")
+    assert limiter.limit > limit
+    # The baseline drifts up 1% per call towards slower calls
+    assert limiter.baseline_latency == {"rag_initial": 1.0, "text": pytest.approx(10.1)}
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Slots
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+def test_slot_bounds_concurrency_to_limit():
+    limiter = make_limiter(max_concurrency=2)
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        async with limiter.slot("text"):
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*(call() for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2
+    assert limiter.in_flight == 0
+
+
+def test_slot_backs_off_on_429_and_reraises():
+    limiter = make_limiter()
+
+    async def main():
+        async with limiter.slot("text"):
+            raise RateLimited()
+
+    with pytest.raises(RateLimited):
+        asyncio.run(main())
+    assert limiter.throttled == 1
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
+
+
+def test_slot_other_errors_leave_limits_alone():
+    limiter = make_limiter()
+
+    async def main():
+        async with limiter.slot("text"):
+            raise ValueError("bad output")
+
+    with pytest.raises(ValueError):
+        asyncio.run(main())
+    assert limiter.limit == 8
+    assert limiter.throttled == 0
@@ -0,0 +1,167 @@
+"""
+Tests for single-flight coalescing and the request coalescing keys
+"""
+
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight, edit_request_key, generate_request_key
+
+
+async def settle() -> None:
+    """Let every ready task run until it blocks again."""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# SingleFlight
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+def test_concurrent_callers_share_one_execution():
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "done"
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(3)))
+
+    assert asyncio.run(main()) == ["done"] * 3
+    assert calls == 1
+    assert (flight.executions, flight.coalesced) == (1, 2)
+    assert flight._inflight == {} and flight._waiters == {}
+
+
+def test_callers_share_the_exception():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(2)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert [type(result) for result in results] == [ValueError, ValueError]
+
+
+def test_finished_key_runs_again():
+    flight = SingleFlight()
+
+    async def main():
+        first = await flight.do("key", lambda: asyncio.sleep(0, result=1))
+        second = await flight.do("key", lambda: asyncio.sleep(0, result=2))
+        return first, second
+
+    assert asyncio.run(main()) == (1, 2)
+    assert flight.executions == 2
+
+
+def test_work_survives_while_a_caller_remains():
+    flight = SingleFlight()
+    release = None
+
+    async def work():
+        await release.wait()
+        return "done"
+
+    async def main():
+        nonlocal release
+        release = asyncio.Event()
+        leaving = asyncio.create_task(flight.do("key", work))
+        staying = asyncio.create_task(flight.do("key", work))
+        await settle()
+        leaving.cancel()
+        await settle()
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+        return await staying
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_last_caller_leaving_cancels_the_work():
+    flight = SingleFlight()
+    cancelled = False
+
+    async def work():
+        nonlocal cancelled
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+
+    async def main():
+        caller = asyncio.create_task(flight.do("key", work))
+        await settle()
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        await settle()
+
+    asyncio.run(main())
+    assert cancelled
+    assert flight._inflight == {} and flight._waiters == {}
+
+
+def test_caller_arriving_right_after_cancel_starts_fresh():
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return calls
+
+    async def main():
+        first = asyncio.create_task(flight.do("key", work))
+        await settle()
+        first.cancel()
+        # Let the cancellation reach the waiter, but not yet the cancelled work's done callback
+        await asyncio.sleep(0)
+        second = asyncio.create_task(flight.do("key", work))
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == 2
+    assert flight.executions == 2
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Coalescing Keys
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+def test_generate_key_ignores_prompt_whitespace_and_platform_order():
+    assert generate_request_key("new  bottle\n", ["a"], ["x", "linkedin"], 60) == \
+        generate_request_key("new bottle", ["a"], ["linkedin", "x"], 60)
+
+
+def test_generate_key_includes_images_and_budget():
+    key = generate_request_key("prompt", ["a"], ["x"], 60)
+    assert key != generate_request_key("prompt", ["b"], ["x"], 60)
+    assert key != generate_request_key("prompt", ["a"], ["x"], 30)
+
+
+def test_edit_key_normalizes_instructions_only():
+    key = edit_request_key("make it  shorter", "Hook", "Line one\n\nLine two", "Outro", None, 60)
+    assert key == edit_request_key("make it shorter ", " Hook", "Line one\n\nLine two", "Outro\n", None, 60)
+    assert key != edit_request_key("make it shorter", "Hook", "Line one Line two", "Outro", None, 60)
+
+
+def test_edit_key_includes_image_and_budget():
+    key = edit_request_key("edit", "h", "b", "o", None, 60)
+    assert key != edit_request_key("edit", "h", "b", "o", "https://fal.media/a.png", 60)
+    assert key != edit_request_key("edit", "h", "b", "o", None, 120)
@@ -0,0 +1,263 @@
+"""
+Product image uploads to the Fal CDN
+"""
+
+import asyncio
+import logging
+import mimetypes
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Sequence
+from urllib.parse import urlsplit
+
+from fastapi import UploadFile
+
+from cache import TieredCache, content_digest, get_cache
+from constants import (
+    FAL_UPLOAD_INITIATE_PATH,
+    IMAGE_REFERENCE_SHEET,
+    IMAGE_URL_ALLOWED_HOSTS,
+    UPLOAD_CACHE_MAX_ENTRIES,
+    UPLOAD_CACHE_TTL_SECONDS,
+)
+from http_clients import get_fal_client, get_http_client
+from images import prepare_image, prepare_reference_sheet, preprocess_variant
+from metrics import span
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+SHA256_HEX = re.compile(r"^[0-9a-f]{64}$")
+
+# fal_client's default repository (fal_v3) opens a new httpx client for every
+# upload and never closes it; "cdn" posts to fal.media over the client's own,
+# pooled httpx client (see http_clients.get_fal_client)
+FAL_UPLOAD_REPOSITORY = "cdn"
+
+
+@dataclass
+class UploadedImage:
+    """A product image on the Fal CDN, addressed by the digest of its bytes."""
+    digest: str
+    url: str
+    cached: bool = False
+    # Original bytes, kept only while they may go into a reference sheet
+    data: bytes | None = field(default=None, repr=False)
+
+
+def get_upload_cache() -> TieredCache:
+    """Return the digest -> CDN URL cache for uploaded images, shared across workers."""
+    return get_cache("uploads", UPLOAD_CACHE_TTL_SECONDS, UPLOAD_CACHE_MAX_ENTRIES)
+
+
+@lru_cache(maxsize=1)
+def get_upload_flight() -> SingleFlight:
+    """Return a singleton coalescer so identical images uploading at once share one upload."""
+    return SingleFlight()
+
+
+async def upload_to_fal_cdn(data: bytes, content_type: str) -> str:
+    """Upload bytes to the Fal CDN over the shared Fal connection pool and return their URL."""
+    return await get_fal_client().upload(data, content_type, repository=FAL_UPLOAD_REPOSITORY)
+
+
+def guess_content_type(filename: str | None, declared: str | None = None) -> str:
+    """Return the declared content type, falling back to a guess from the filename."""
+    if declared and declared != "application/octet-stream":
+        return declared
+    guessed, _ = mimetypes.guess_type(filename or "")
+    return guessed or "application/octet-stream"
+
+
+async def upload_image_bytes(data: bytes, filename: str | None, content_type: str) -> UploadedImage:
+    """
+    Preprocess image bytes (see images.py) and upload them to Fal CDN over the
+    async client, reusing the CDN URL when identical bytes were uploaded before.
+
+    The cache key is the digest of the original bytes plus the preprocessing
+    settings, so a cache hit skips preprocessing as well as the upload.
+    """
+    with span("upload") as timing:
+        # hashlib releases the GIL on large buffers, so hash off the event loop thread
+        digest = await asyncio.to_thread(content_digest, data)
+        cache_key = f"{digest}:{preprocess_variant()}"
+        cache = get_upload_cache()
+
+        cached_url = await cache.get(cache_key)
+        if cached_url is not None:
+            logger.info("Upload cache hit for %s (%s): %s", filename, digest[:12], cached_url)
+            timing.outcome = "cached"
+            return UploadedImage(
+                digest=digest, url=cached_url, cached=True, data=data if IMAGE_REFERENCE_SHEET else None
+            )
+
+        async def upload() -> str:
+            prepared = await prepare_image(data, content_type, filename)
+            logger.debug("Uploading %s bytes (%s) for %s", len(prepared.data), prepared.content_type, filename)
+            url = await upload_to_fal_cdn(prepared.data, prepared.content_type)
+            await cache.set(cache_key, url)
+            return url
+
+        url = await get_upload_flight().do(cache_key, upload)
+        return UploadedImage(digest=digest, url=url, data=data if IMAGE_REFERENCE_SHEET else None)
+
+
+async def upload_image_to_fal(upload_file: UploadFile) -> UploadedImage:
+    """
+    Upload an image to Fal CDN and return the uploaded image.
+
+    The bytes are read straight from the request's upload spool and sent with the
+    async Fal client, so there is no temporary file copy and the event loop is
+    never blocked on network I/O.
+    """
+    logger.info("Uploading image to Fal CDN: %s", upload_file.filename)
+    content = await upload_file.read()
+    logger.debug("Read %s bytes from %s", len(content), upload_file.filename)
+
+    try:
+        uploaded = await upload_image_bytes(
+            content,
+            upload_file.filename,
+            guess_content_type(upload_file.filename, upload_file.content_type),
+        )
+        if not uploaded.cached:
+            logger.info("Successfully uploaded %s to Fal CDN: %s", upload_file.filename, uploaded.url)
+        return uploaded
+    except Exception as e:
+        logger.error("Failed to upload %s to Fal CDN: %s", upload_file.filename, e)
+        raise
+
+
+async def upload_product_images(images: List[UploadFile]) -> list[UploadedImage]:
+    """Upload all product images to Fal CDN concurrently and return them in order."""
+    logger.info("Uploading %s product images to Fal CDN concurrently...", len(images))
+    uploaded = await asyncio.gather(*(upload_image_to_fal(image) for image in images))
+    cache_hits = sum(1 for image in uploaded if image.cached)
+    logger.info("All product images uploaded successfully (%s/%s from cache)", cache_hits, len(uploaded))
+    return list(uploaded)
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# Pre-uploaded Images
+# ──────────────────────────────────────────────────────────────────────────────
+
+
+def validate_image_url(url: str) -> str:
+    """
+    Check that a client-supplied image URL is https and on an allowed host
+    (IMAGE_URL_ALLOWED_HOSTS), so fal is never pointed at arbitrary servers.
+
+    Raises:
+        ValueError: If the URL is not allowed
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower()
+    if parts.scheme != "https" or not any(host == allowed or host.endswith(f".{allowed}") for allowed in IMAGE_URL_ALLOWED_HOSTS):
+        raise ValueError(f"Image URL must be https on one of: {', '.join(IMAGE_URL_ALLOWED_HOSTS)}")
+    return parts.geturl()
+
+
+async def resolve_image_references(image_urls: Sequence[str], image_digests: Sequence[str]) -> list[UploadedImage]:
+    """
+    Resolve images the client uploaded beforehand, without touching their bytes.
+
+    Args:
+        image_urls: URLs of images already on the Fal CDN (e.g. from /uploads/direct)
+        image_digests: SHA-256 digests of images this server uploaded before
+
+    Returns:
+        The images, URLs first, then digests. Images given by URL are keyed by
+        the digest of the URL.
+
+    Raises:
+        ValueError: If a URL is not allowed, or a digest is malformed or unknown
+    """
+    resolved = [
+        UploadedImage(digest="url:" + content_digest(url.encode("utf-8")), url=url)
+        for url in map(validate_image_url, image_urls)
+    ]
+    for digest in image_digests:
+        digest = digest.strip().lower()
+        if not SHA256_HEX.match(digest):
+            raise ValueError(f"Invalid image digest: {digest[:64]}")
+        url = await lookup_uploaded_url(digest)
+        if url is None:
+            raise ValueError(f"Unknown image digest {digest[:12]}..., upload the image instead")
+        resolved.append(UploadedImage(digest=digest, url=url, cached=True))
+    logger.info("Resolved %s pre-uploaded images (%s by URL)", len(resolved), len(image_urls))
+    return resolved
+
+
+async def lookup_uploaded_url(digest: str) -> str | None:
+    """Return the CDN URL of an image this server uploaded before, by the digest of its bytes."""
+    return await get_upload_cache().get(f"{digest.strip().lower()}:{preprocess_variant()}")
+
+
+async def initiate_direct_upload(content_type: str, file_name: str) -> tuple[str, str]:
+    """
+    Ask Fal storage for a presigned upload URL, so a client can upload an image
+    straight to the CDN without the bytes (or our Fal key) passing through here.
+
+    The final URL must pass validate_image_url, since the client sends it back
+    in ``image_urls``; a URL outside IMAGE_URL_ALLOWED_HOSTS is rejected here
+    instead of after the client has uploaded the image.
+
+    Returns:
+        The presigned upload URL (for an HTTP PUT) and the image's final URL
+
+    Raises:
+        ValueError: If Fal storage returns a file URL outside IMAGE_URL_ALLOWED_HOSTS
+    """
+    from fal_client.client import REST_URL
+
+    response = await get_http_client("fal").post(
+        f"{REST_URL}{FAL_UPLOAD_INITIATE_PATH}",
+        json={"content_type": content_type, "file_name": file_name},
+    )
+    response.raise_for_status()
+    data = response.json()
+    try:
+        file_url = validate_image_url(data["file_url"])
+    except ValueError:
+        logger.error("Fal storage returned file URL %s outside IMAGE_URL_ALLOWED_HOSTS", data["file_url"])
+        raise
+    return data["upload_url"], file_url
+
+
+async def reference_image_urls(uploaded: Sequence[UploadedImage]) -> list[str]:
+    """
+    Return the image URLs to send to fal as references for a campaign.
+
+    In reference sheet mode (IMAGE_REFERENCE_SHEET), near-duplicate images are
+    dropped and the rest are packed into one contact sheet, uploaded once and
+    cached by the digests of its images, so every platform's fal call gets a
+    single compact reference. Otherwise, or if the sheet cannot be built, the
+    individual image URLs are returned.
+    """
+    urls = [image.url for image in uploaded]
+    if not IMAGE_REFERENCE_SHEET or len(uploaded) < 2 or any(image.data is None for image in uploaded):
+        return urls
+
+    digests = [image.digest for image in uploaded]
+    cache_key = "sheet:" + content_digest(f"{':'.join(digests)}:{preprocess_variant()}".encode("ascii"))
+    cache = get_upload_cache()
+    cached_urls = await cache.get(cache_key)
+    if cached_urls is not None:
+        logger.info("Reference sheet cache hit for %s images", len(uploaded))
+        return cached_urls
+
+    async def build() -> list[str]:
+        sheet = await prepare_reference_sheet([image.data for image in uploaded])
+        if sheet is None:
+            return urls
+        if sheet.data is None:
+            # Everything but one image was a duplicate
+            reference_urls = [urls[idx] for idx in sheet.kept]
+        else:
+            with span("upload", "sheet"):
+                reference_urls = [await upload_to_fal_cdn(sheet.data, sheet.content_type)]
+        await cache.set(cache_key, reference_urls)
+        return reference_urls
+
+    return await get_upload_flight().do(cache_key, build)
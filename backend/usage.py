@@ -0,0 +1,120 @@
+"""
+Token and cost accounting for agent runs
+"""
+
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterator, List
+
+from prometheus_client import Counter
+
+from constants import MODEL_PRICES_PER_MTOK
+from models import UsageEntry, UsageSummary
+
+logger = logging.getLogger(__name__)
+
+LLM_REQUESTS = Counter(
+    "viral_spark_llm_requests_total",
+    "Model requests made by agent runs",
+    ["stage", "platform", "model"],
+)
+
+LLM_TOKENS = Counter(
+    "viral_spark_llm_tokens_total",
+    "Tokens used by agent runs",
+    ["stage", "platform", "model", "kind"],
+)
+
+LLM_COST = Counter(
+    "viral_spark_llm_cost_usd_total",
+    "Estimated cost of agent runs in USD",
+    ["stage", "platform", "model"],
+)
+
+
+class UsageLedger:
+    """Usage of every agent run made while handling one request."""
+
+    def __init__(self):
+        self.entries: List[UsageEntry] = []
+
+    def summary(self) -> UsageSummary:
+        return UsageSummary(
+            requests=sum(entry.requests for entry in self.entries),
+            request_tokens=sum(entry.request_tokens for entry in self.entries),
+            response_tokens=sum(entry.response_tokens for entry in self.entries),
+            total_tokens=sum(entry.total_tokens for entry in self.entries),
+            cost_usd=round(sum(entry.cost_usd or 0.0 for entry in self.entries), 6),
+            entries=list(self.entries),
+        )
+
+
+# Ledger for the request being handled; None outside a request
+_current_ledger: ContextVar[UsageLedger | None] = ContextVar("usage_ledger", default=None)
+
+
+@contextmanager
+def usage_ledger(ledger: UsageLedger | None = None) -> Iterator[UsageLedger]:
+    """
+    Collect the usage of agent runs made inside the block, including runs in
+    tasks created inside it.
+    """
+    ledger = ledger or UsageLedger()
+    token = _current_ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _current_ledger.reset(token)
+
+
+def model_name(model: Any) -> str:
+    """Return a readable name for a pydantic-ai model object or model string."""
+    return getattr(model, "model_name", None) or str(model)
+
+
+def estimate_cost(model: str, request_tokens: int, response_tokens: int) -> float | None:
+    """Return the estimated cost in USD, or None if the model has no configured price."""
+    prices = MODEL_PRICES_PER_MTOK.get(model)
+    if prices is None:
+        return None
+    prompt_price, completion_price = prices
+    return (request_tokens * prompt_price + response_tokens * completion_price) / 1_000_000
+
+
+def record_usage(stage: str, platform: str | None, model: str, usage: Any) -> UsageEntry:
+    """
+    Record the usage of one agent run in the current request's ledger and the
+    aggregate counters.
+
+    Args:
+        stage: Pipeline stage the run belongs to
+        platform: Platform (or post part) the run was for, if any
+        model: Name of the model that served the run
+        usage: The run's ``result.usage()``
+    """
+    request_tokens = usage.request_tokens or 0
+    response_tokens = usage.response_tokens or 0
+    entry = UsageEntry(
+        stage=stage,
+        platform=platform,
+        model=model,
+        requests=usage.requests or 0,
+        request_tokens=request_tokens,
+        response_tokens=response_tokens,
+        total_tokens=usage.total_tokens or request_tokens + response_tokens,
+        cost_usd=estimate_cost(model, request_tokens, response_tokens),
+    )
+
+    labels = {"stage": stage, "platform": platform or "", "model": model}
+    LLM_REQUESTS.labels(**labels).inc(entry.requests)
+    LLM_TOKENS.labels(**labels, kind="request").inc(entry.request_tokens)
+    LLM_TOKENS.labels(**labels, kind="response").inc(entry.response_tokens)
+    if entry.cost_usd is not None:
+        LLM_COST.labels(**labels).inc(entry.cost_usd)
+
+    ledger = _current_ledger.get()
+    if ledger is not None:
+        ledger.entries.append(entry)
+    logger.debug("Usage for %s (%s) on %s: %s tokens", stage, platform or "-", model, entry.total_tokens)
+    return entry